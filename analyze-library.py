@@ -0,0 +1,33 @@
+import argparse
+import os
+import sys
+
+# This script runs with regular Python, not under Blender. It counts the
+# polygons, studs and primitives of every part in the library and caches
+# them in ./cache/part-stats.json for the schedulers.
+#
+#   python analyze-library.py --processes 8
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, dir_path)
+
+from lib.renderer.dat import ldraw_index
+from lib.renderer.dat_graph import analyze_parts
+
+parser = argparse.ArgumentParser(description="Count the polygons and studs of LDraw parts")
+parser.add_argument("parts", nargs="*", help="LDraw ids, defaults to every part in the library")
+parser.add_argument("--ldraw-path", default="./ldraw")
+parser.add_argument("--processes", type=int, default=os.cpu_count())
+parser.add_argument("--cache", default="./cache/part-stats.json")
+parser.add_argument("--top", type=int, default=20, help="list the most complex parts")
+args = parser.parse_args()
+
+ldraw_ids = args.parts or sorted(ldraw_id for ldraw_id in ldraw_index(args.ldraw_path).parts if "/" not in ldraw_id)
+stats = analyze_parts(ldraw_ids, args.ldraw_path, args.processes, args.cache)
+
+print(f"{'part':<20} {'triangles':>10} {'quads':>8} {'studs':>6} {'primitives':>10}")
+for ldraw_id, part in sorted(stats.items(), key=lambda item: -item[1].polygons)[:args.top]:
+    print(f"{ldraw_id:<20} {part.triangles:>10} {part.quads:>8} {part.studs:>6} {len(part.primitives):>10}")
+
+if stats:
+    polygons = sorted(part.polygons for part in stats.values())
+    print(f"\n{len(stats)} parts, median {polygons[len(polygons) // 2]} triangles after expansion, max {polygons[-1]}")
@@ -0,0 +1,81 @@
+import sys
+import os
+import time
+from copy import copy
+from PIL import Image
+
+# This script runs under Blender's python environment. Add the current
+# directly to the path so we can import our own modules
+dir_path = os.path.dirname(os.path.realpath(__file__))
+print(f"Prepending {dir_path} to Python path...")
+sys.path.insert(0, dir_path)
+
+from lib.image_utils import grid
+from lib.colors import RebrickableColors
+from lib.renderer.render_options import RenderOptions, Quality, LightingStyle, Format, BackgroundType
+from lib.renderer.renderer import Renderer
+from lib.renderer.compositing import composite_filename
+
+# Compare rendering each background with Cycles against rendering once on a
+# transparent background and compositing onto the backgrounds. Prints
+# images/sec for both and saves a grid with one row per method.
+#
+#   ./run.sh benchmark-compositing.py
+
+RENDER_DIR = "./renders/benchmark-compositing"
+parts = ["3001", "3039", "3062b", "32523", "4070", "98138"]
+backgrounds_per_render = 4
+
+renderer = Renderer(ldraw_path="./ldraw", output_threads=2)
+
+base_options = RenderOptions(
+    format = Format.JPEG,
+    quality = Quality.NORMAL,
+    lighting_style = LightingStyle.DEFAULT,
+    part_color = RebrickableColors.Red.value.best_hex,
+    part_rotation = (0, 0, 0),
+    camera_height = 45,
+    zoom = 0.1,
+    width = 244,
+    height = 244,
+)
+
+# Import every part once so the timings only measure rendering
+for part in parts:
+    options = copy(base_options)
+    options.image_filename = os.path.join(RENDER_DIR, "warmup.jpg")
+    renderer.render_part(part, options)
+renderer.wait()
+
+# One Cycles render per background
+start = time.time()
+for part in parts:
+    for i in range(backgrounds_per_render):
+        options = copy(base_options)
+        options.background_type = BackgroundType.IMAGE
+        options.image_filename = os.path.join(RENDER_DIR, f"render_{part}_bg{i}.jpg")
+        renderer.render_part(part, options)
+renderer.wait()
+render_seconds = time.time() - start
+
+# One Cycles render composited onto every background
+start = time.time()
+for part in parts:
+    options = copy(base_options)
+    options.background_type = BackgroundType.COMPOSITED
+    options.composite_count = backgrounds_per_render
+    options.image_filename = os.path.join(RENDER_DIR, f"composited_{part}.jpg")
+    renderer.render_part(part, options)
+renderer.wait()
+composite_seconds = time.time() - start
+renderer.close()
+
+images = [Image.open(os.path.join(RENDER_DIR, f"render_{part}_bg0.jpg")) for part in parts]
+images += [Image.open(composite_filename(os.path.join(RENDER_DIR, f"composited_{part}.jpg"), 0)) for part in parts]
+grid(images, 2, len(parts)).save(os.path.join(RENDER_DIR, "comparison.png"))
+
+num_images = len(parts) * backgrounds_per_render
+print(f"{'method':<12} {'seconds':>8} {'images/sec':>10}")
+print(f"{'render':<12} {render_seconds:>8.1f} {num_images / render_seconds:>10.2f}")
+print(f"{'composited':<12} {composite_seconds:>8.1f} {num_images / composite_seconds:>10.2f}")
+print(f"Comparison saved to {os.path.join(RENDER_DIR, 'comparison.png')} (rows: render, composited)")
@@ -0,0 +1,66 @@
+import sys
+import os
+import time
+from copy import copy
+from PIL import Image
+
+# This script runs under Blender's python environment. Add the current
+# directly to the path so we can import our own modules
+dir_path = os.path.dirname(os.path.realpath(__file__))
+print(f"Prepending {dir_path} to Python path...")
+sys.path.insert(0, dir_path)
+
+from lib.image_utils import grid
+from lib.colors import RebrickableColors
+from lib.renderer.render_options import RenderOptions, Quality, LightingStyle, Look, Format, Engine
+from lib.renderer.renderer import Renderer
+
+# Compare render engines for the part library's line art thumbnails.
+# Prints images/sec for each engine and saves a grid with one row per
+# engine to compare how they look.
+#
+#   ./run.sh benchmark-engines.py
+
+RENDER_DIR = "./renders/benchmark-engines"
+parts = ["3001", "3039", "3062b", "32523", "4070", "60484", "73587p01", "98138"]
+engines = [Engine.CYCLES, Engine.EEVEE, Engine.WORKBENCH]
+
+renderer = Renderer(ldraw_path="./ldraw")
+
+base_options = RenderOptions(
+    format = Format.PNG,
+    quality = Quality.DRAFT,
+    lighting_style = LightingStyle.BRIGHT,
+    part_color = RebrickableColors.White.value.best_hex,
+    part_rotation = (0, 0, 0),
+    zoom = 1,
+    look = Look.INSTRUCTIONS,
+    width = 150,
+    height = 150,
+)
+
+# Import every part once so the timings only measure rendering
+for part in parts:
+    options = copy(base_options)
+    options.image_filename = os.path.join(RENDER_DIR, "warmup.png")
+    renderer.render_part(part, options)
+
+results = []
+images = []
+for engine in engines:
+    start = time.time()
+    for part in parts:
+        options = copy(base_options)
+        options.engine = engine
+        options.image_filename = os.path.join(RENDER_DIR, f"{engine.value}_{part}.png")
+        renderer.render_part(part, options)
+    seconds = time.time() - start
+    results.append((engine, seconds))
+    images += [Image.open(os.path.join(RENDER_DIR, f"{engine.value}_{part}.png")) for part in parts]
+
+grid(images, len(engines), len(parts)).save(os.path.join(RENDER_DIR, "comparison.png"))
+
+print(f"{'engine':<12} {'seconds':>8} {'images/sec':>10}")
+for engine, seconds in results:
+    print(f"{engine.value:<12} {seconds:>8.1f} {len(parts) / seconds:>10.2f}")
+print(f"Comparison saved to {os.path.join(RENDER_DIR, 'comparison.png')} (rows: {', '.join(e.value for e in engines)})")
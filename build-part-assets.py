@@ -0,0 +1,42 @@
+import argparse
+import csv
+import os
+import sys
+import time
+
+# This script runs with regular Python, not under Blender. It flattens parts
+# once and saves them as mesh assets (see lib/renderer/part_assets.py) that
+# workers with Renderer(native_import=True) load instead of parsing the
+# library again:
+#
+#   python build-part-assets.py --csv ../lego-inventory/sorter-10000.csv
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, dir_path)
+
+from lib.renderer.dat import ldraw_index
+from lib.renderer.part_assets import build_part_assets
+
+parser = argparse.ArgumentParser(description="Build mesh assets for LDraw parts")
+parser.add_argument("parts", nargs="*", help="LDraw ids")
+parser.add_argument("--csv", help="a catalog with an ldraw_id column, e.g. ../lego-inventory/sorter-10000.csv")
+parser.add_argument("--all", action="store_true", help="every part in the library")
+parser.add_argument("--ldraw-path", default="./ldraw")
+parser.add_argument("--directory", default="./cache/part-assets")
+parser.add_argument("--processes", type=int, default=os.cpu_count())
+args = parser.parse_args()
+
+ldraw_ids = list(args.parts)
+if args.csv:
+    with open(args.csv) as f:
+        ldraw_ids += [row["ldraw_id"] for row in csv.DictReader(f) if row["ldraw_id"]]
+if args.all:
+    ldraw_ids += [ldraw_id for ldraw_id in ldraw_index(args.ldraw_path).parts if "/" not in ldraw_id]
+ldraw_ids = sorted(set(ldraw_ids))
+
+# The import settings of the quality presets: high resolution primitives
+# and logo studs, or neither for draft renders
+variants = [(True, True), (False, False)]
+
+start = time.time()
+built = build_part_assets(ldraw_ids, variants, args.ldraw_path, args.directory, args.processes)
+print(f"Built {built} assets for {len(ldraw_ids)} parts in {time.time() - start:.1f}s")
@@ -3,6 +3,8 @@ import shutil
 import random
 from collections import defaultdict
 
+from lib.file_utils import temporary_filename
+
 def create_yaml(part_names, yaml_path="dataset/lego.yaml", val_path="images/val", train_path="images/train"):
     os.makedirs(os.path.dirname(yaml_path), exist_ok=True)  # ensure directory exists
     with open(yaml_path, "w") as f:
@@ -16,11 +18,31 @@ def create_yaml(part_names, yaml_path="dataset/lego.yaml", val_path="images/val"
     print(f"[OK] Wrote YOLO dataset config to: {yaml_path}")
 
 def write_label_file(filename, bounding_box, class_id=0):
+    write_labels_file(filename, [(class_id, bounding_box)])
+
+# One line per object, labels is a list of (class_id, yolo bounding box)
+def write_labels_file(filename, labels):
+    os.makedirs(os.path.dirname(filename), exist_ok=True)  # ensure directory exists
+
+    # Write then rename so a label file is never partially written
+    temp_filename = temporary_filename(filename)
+    with open(temp_filename, "w") as f:
+        for class_id, bounding_box in labels:
+            f.write(f"{class_id} {bounding_box[0]:.3f} {bounding_box[1]:.3f} {bounding_box[2]:.3f} {bounding_box[3]:.3f}\n")
+    os.replace(temp_filename, filename)
+    print(f"[OK] Wrote {len(labels)} label(s) to: {filename}")
+
+# YOLO segmentation format, one line per object. segments is a list of
+# (class_id, polygon) where the polygon is [x1, y1, x2, y2, ...] normalized to 0-1
+def write_segmentation_file(filename, segments):
     os.makedirs(os.path.dirname(filename), exist_ok=True)  # ensure directory exists
 
-    with open(filename, "w") as f:
-        f.write(f"{class_id} {bounding_box[0]:.3f} {bounding_box[1]:.3f} {bounding_box[2]:.3f} {bounding_box[3]:.3f}\n")
-    print(f"[OK] Wrote label to: {filename}")
+    temp_filename = temporary_filename(filename)
+    with open(temp_filename, "w") as f:
+        for class_id, polygon in segments:
+            f.write(f"{class_id} " + " ".join(f"{value:.5f}" for value in polygon) + "\n")
+    os.replace(temp_filename, filename)
+    print(f"[OK] Wrote {len(segments)} outline(s) to: {filename}")
 
 def split_lego_dataset(images_dir, labels_dir, output_dir, val_ratio=0.2, seed=42):
     random.seed(seed)
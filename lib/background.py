@@ -1,29 +1,65 @@
 import random
-from PIL import Image, ImageDraw
-from lib.colors import random_color_for_pil, hsv2rgb
+import numpy as np
+from PIL import Image
+from lib.colors import RebrickableColors, random_color_for_pil, hsv2rgb
+
+CIRCLE = 0
+RECTANGLE = 1
+TRIANGLE = 2
+LINE = 3
 
 def save_background_image(color, size, num_shapes, filename):
-    img = Image.new('RGB', size, color)
-    add_random_shapes(img, num_shapes, int(size[0]/3))
-    img.save(filename)
+    img = np.empty((size[1], size[0], 3), dtype=np.uint8)
+    img[:] = color
+    rng = np.random.default_rng(random.getrandbits(64))
+    add_random_shapes(img, rng, random_color_for_pil(), num_shapes, int(size[0]/3))
+    Image.fromarray(img).save(filename)
+
+# A random background as a (height, width, 3) uint8 array. The same seed
+# always gives the same image, so backgrounds can be generated in other
+# processes.
+def generate_background(seed, size=(1024, 1024), num_shapes=60):
+    rng = np.random.default_rng(seed)
+    colors = list(RebrickableColors)
+    background_color, base_color = (rebrickable_color_for_pil(colors[i]) for i in rng.integers(len(colors), size=2))
+    img = np.empty((size[1], size[0], 3), dtype=np.uint8)
+    img[:] = background_color
+    add_random_shapes(img, rng, base_color, num_shapes, int(size[0]/3))
+    return img
+
+def rebrickable_color_for_pil(color):
+    r, g, b = color.value.blender[:3]
+    return (int(r * 255), int(g * 255), int(b * 255))
+
+# Draw shapes in colors close to base_color. Each shape is rasterized with
+# NumPy over its bounding box, in order so later shapes cover earlier ones.
+def add_random_shapes(img, rng, base_color, num_shapes, max_size):
+    height, width = img.shape[:2]
+    max_size = max(10, min(max_size, width, height))
+    colors = np.clip(np.array(base_color) + rng.integers(-35, 36, size=(num_shapes, 3)), 0, 255).astype(np.uint8)
+    shape_types = rng.integers(4, size=num_shapes)
+    shape_sizes = rng.integers(10, max_size + 1, size=num_shapes)
+    x1s = rng.integers(0, width - shape_sizes + 1)
+    y1s = rng.integers(0, height - shape_sizes + 1)
+
+    for shape_type, shape_size, x1, y1, color in zip(shape_types, shape_sizes, x1s, y1s, colors):
+        x2 = min(x1 + shape_size, width - 1)
+        y2 = min(y1 + shape_size, height - 1)
+        ys, xs = np.ogrid[y1:y2 + 1, x1:x2 + 1]
+        region = img[y1:y2 + 1, x1:x2 + 1]
+        region[shape_mask(shape_type, xs, ys, x1, y1, shape_size)] = color
 
-def add_random_shapes(img, num_shapes, max_size):
-    draw = ImageDraw.Draw(img)
-    width, height = img.size
-    base_color = random_color_for_pil()
-    for i in range(num_shapes):
-        color = (base_color[0] + random.randint(-35, 35), base_color[1] + random.randint(-35, 35), base_color[2] + random.randint(-35, 35))
-        shape_type = random.choice(['circle', 'rectangle', 'triangle', 'line'])
-        shape_size = random.randint(10, max_size)
-        x1 = random.randint(0, width - shape_size)
-        y1 = random.randint(0, height - shape_size)
-        x2 = x1 + shape_size
-        y2 = y1 + shape_size
-        if shape_type == 'circle':
-            draw.ellipse((x1, y1, x2, y2), fill=color)
-        elif shape_type == 'rectangle':
-            draw.rectangle((x1, y1, x2, y2), fill=color)
-        elif shape_type == 'triangle':
-            draw.polygon([(x1, y1), (x2, y1), ((x1+x2)//2, y2)], fill=color)
-        elif shape_type == 'line':
-          draw.line((x1, y1, x2, y2), width=2, fill=color)
+def shape_mask(shape_type, xs, ys, x1, y1, shape_size):
+    half = shape_size / 2
+    cx = x1 + half
+    cy = y1 + half
+    if shape_type == CIRCLE:
+        return (xs - cx) ** 2 + (ys - cy) ** 2 <= half ** 2
+    elif shape_type == RECTANGLE:
+        return np.ones((ys.shape[0], xs.shape[1]), dtype=bool)
+    elif shape_type == TRIANGLE:
+        # Base along the top edge, point at the bottom middle
+        return np.abs(xs - cx) <= half * (y1 + shape_size - ys) / shape_size
+    else:
+        # Two pixels wide, top left to bottom right
+        return np.abs((xs - x1) - (ys - y1)) <= 1.5
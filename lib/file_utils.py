@@ -0,0 +1,7 @@
+import os
+
+# A filename next to the given one for writing before renaming it into place.
+# Keeps the extension so image writers pick the right format.
+def temporary_filename(filename):
+    base, ext = os.path.splitext(filename)
+    return f"{base}.tmp{os.getpid()}{ext}"
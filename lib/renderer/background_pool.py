@@ -0,0 +1,125 @@
+import os
+import glob
+import random
+import bpy
+from PIL import Image
+
+from lib.file_utils import temporary_filename
+
+MATERIAL_NAME = "LegoGroundPlaneMaterial"
+MAX_TEXTURE_SIZE = 4096
+
+# Background images for the ground plane, loaded once and reused
+#
+# The image directory is scanned once. Each photo is downscaled to a size
+# that suits the render resolution and saved to cache_dir, so a 224x224
+# render doesn't load a 4000 pixel photo. Loaded images and the ground
+# material are kept across renders (and clear_scene), choosing a
+# background only changes the image of the texture node.
+class BackgroundPool:
+    def __init__(self, image_dir="./lib/backgrounds", cache_dir="./cache/backgrounds"):
+        self.image_dir = os.path.abspath(image_dir)
+        self.cache_dir = cache_dir
+        self.paths = sorted(glob.glob(os.path.join(self.image_dir, "*.jpg")) + glob.glob(os.path.join(self.image_dir, "*.png")))
+        self.images = {}  # (path, size) -> bpy image
+        self.material = None
+        self.texture_node = None
+        if not self.paths:
+            print(f"No background images found in: {self.image_dir}")
+
+    # Images and materials clear_scene should keep
+    @property
+    def datablocks(self):
+        blocks = list(self.images.values())
+        if self.material is not None:
+            blocks.append(self.material)
+        return blocks
+
+    # Assign a random background to the ground. Returns False if there are
+    # no background images.
+    def apply(self, ground, options):
+        if not self.paths:
+            return False
+
+        path = random.choice(self.paths)
+        self.apply_image(ground, self.image(path, texture_size(options)))
+        return True
+
+    # Use any Blender image as the ground texture, e.g. a generated one
+    def apply_image(self, ground, image):
+        material = self.ground_material()
+        self.texture_node.image = image
+
+        if ground.data.materials:
+            ground.data.materials[0] = material
+        else:
+            ground.data.materials.append(material)
+
+    def image(self, path, size):
+        key = (path, size)
+        image = self.images.get(key)
+        if image is None:
+            image = bpy.data.images.load(self.variant(path, size), check_existing=True)
+            image.use_fake_user = True
+            self.images[key] = image
+        return image
+
+    # A copy of the image no larger than size, cached on disk. Rebuilt when
+    # the original is newer.
+    def variant(self, path, size):
+        name, ext = os.path.splitext(os.path.basename(path))
+        filename = os.path.abspath(os.path.join(self.cache_dir, f"{name}_{size}{ext}"))
+        if os.path.exists(filename) and os.path.getmtime(filename) >= os.path.getmtime(path):
+            return filename
+
+        with Image.open(path) as original:
+            if max(original.size) <= size:
+                return path
+            image_format = original.format
+            image = original.copy()
+        image.thumbnail((size, size), Image.LANCZOS)
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        temp_filename = temporary_filename(filename)
+        image.save(temp_filename, format=image_format, quality=95)
+        os.replace(temp_filename, filename)
+        print(f"[BACKGROUND] {os.path.basename(path)} downscaled to {image.size[0]}x{image.size[1]}")
+        return filename
+
+    # The material is built once, later backgrounds only change the image
+    def ground_material(self):
+        if self.material is not None:
+            return self.material
+
+        material = bpy.data.materials.get(MATERIAL_NAME) or bpy.data.materials.new(name=MATERIAL_NAME)
+        material.use_nodes = True
+        material.use_fake_user = True
+
+        nodes = material.node_tree.nodes
+        links = material.node_tree.links
+        nodes.clear()
+
+        tex_coord = nodes.new('ShaderNodeTexCoord')
+        mapping = nodes.new('ShaderNodeMapping')
+        tex_image = nodes.new('ShaderNodeTexImage')
+        bsdf = nodes.new('ShaderNodeBsdfPrincipled')
+        output = nodes.new('ShaderNodeOutputMaterial')
+
+        links.new(tex_coord.outputs['UV'], mapping.inputs['Vector'])
+        links.new(mapping.outputs['Vector'], tex_image.inputs['Vector'])
+        links.new(tex_image.outputs['Color'], bsdf.inputs['Base Color'])
+        links.new(bsdf.outputs['BSDF'], output.inputs['Surface'])
+
+        self.material = material
+        self.texture_node = tex_image
+        return material
+
+# The ground plane is much larger than the frame, so use a few texels for
+# each rendered pixel. Rounded up to a power of two so similar render sizes
+# share a cached image.
+def texture_size(options):
+    pixels = 4 * max(options.render_width, options.render_height)
+    size = 256
+    while size < pixels and size < MAX_TEXTURE_SIZE:
+        size *= 2
+    return size
@@ -0,0 +1,41 @@
+import numpy as np
+
+# Where a camera has to be for points to fill its frame, the same place
+# bpy.ops.view3d.camera_to_view_selected moves it to, but without needing a
+# selection or walking every vertex. points are world space points with the
+# same extremes as the objects, e.g. their convex hulls. The camera keeps
+# its rotation, a 3x3 matrix.
+#
+# Each side of the frame is a plane through the camera. The camera is moved
+# back until the point furthest out of each pair of opposite planes is on
+# them, and sideways so it is centered between them. The tighter of the two
+# directions (width or height) sets the distance. Perspective cameras only.
+# Doesn't need Blender, see tests/test_camera_fit.py.
+def camera_fit_location(points, rotation, lens, sensor_width, sensor_height, sensor_fit, resolution_x, resolution_y):
+    rotation = np.asarray(rotation, dtype=np.float64)
+    right, up, forward = rotation[:, 0], rotation[:, 1], -rotation[:, 2]  # cameras look down -z
+    x = points @ right
+    y = points @ up
+    depth = points @ forward
+
+    # Tangents of half the field of view, as Blender's sensor fit works them out
+    if sensor_fit == 'VERTICAL':
+        tan_y = sensor_height / 2 / lens
+        tan_x = tan_y * resolution_x / resolution_y
+    elif sensor_fit == 'HORIZONTAL' or resolution_x >= resolution_y:
+        tan_x = sensor_width / 2 / lens
+        tan_y = tan_x * resolution_y / resolution_x
+    else:
+        tan_y = sensor_width / 2 / lens
+        tan_x = tan_y * resolution_x / resolution_y
+
+    center_x, depth_x = fit_planes(x, depth, tan_x)
+    center_y, depth_y = fit_planes(y, depth, tan_y)
+    return center_x * right + center_y * up + min(depth_x, depth_y) * forward
+
+# Offset across and depth of a camera whose frame planes at +/- tangent
+# touch the outermost points
+def fit_planes(across, depth, tangent):
+    positive = np.max(across - tangent * depth)
+    negative = np.max(-across - tangent * depth)
+    return (positive - negative) / 2, -(positive + negative) / (2 * tangent)
@@ -0,0 +1,77 @@
+import os
+import glob
+import random
+import threading
+import numpy as np
+from PIL import Image
+
+from lib.background import generate_background
+
+# Composite one transparent render onto many backgrounds
+#
+# With BackgroundType.COMPOSITED the part is rendered once with a transparent
+# film and the ground plane as a shadow catcher, so the render has the part
+# plus its shadow in the alpha channel. Each background is then laid under
+# it in 2D, which is much cheaper than rendering the part again. The part
+# doesn't move, so every composite has the same label.
+class CompositeBackgrounds:
+    def __init__(self, image_dir="./lib/backgrounds", generated_fraction=0.5, white_fraction=0.1, num_shapes=60):
+        self.paths = sorted(glob.glob(os.path.join(image_dir, "*.jpg")) + glob.glob(os.path.join(image_dir, "*.png")))
+        self.generated_fraction = generated_fraction
+        self.white_fraction = white_fraction
+        self.num_shapes = num_shapes
+        self.photos = {}  # path -> linear (height, width, 3) float array
+        self.lock = threading.Lock()
+
+    # count random backgrounds as linear (height, width, 3) float arrays
+    def choose(self, count, width, height):
+        return [self.background(width, height) for i in range(count)]
+
+    def background(self, width, height):
+        r = random.random()
+        if r < self.white_fraction:
+            return np.ones((height, width, 3), dtype=np.float32)
+        if r < self.white_fraction + self.generated_fraction or not self.paths:
+            pixels = generate_background(random.getrandbits(32), (width, height), self.num_shapes)
+            return srgb_to_linear(pixels / np.float32(255))
+        return random_crop(self.photo(random.choice(self.paths)), width, height)
+
+    # Photos are decoded once and kept in memory
+    def photo(self, path):
+        with self.lock:
+            if path not in self.photos:
+                with Image.open(path) as image:
+                    pixels = np.asarray(image.convert('RGB'), dtype=np.float32) / 255
+                self.photos[path] = srgb_to_linear(pixels)
+            return self.photos[path]
+
+# A random region of a photo, at a random scale, resized to width x height
+def random_crop(photo, width, height):
+    photo_height, photo_width = photo.shape[:2]
+    scale = random.uniform(0.5, 1.0) * min(photo_width / width, photo_height / height)
+    crop_width = max(1, int(width * scale))
+    crop_height = max(1, int(height * scale))
+    x = random.randint(0, photo_width - crop_width)
+    y = random.randint(0, photo_height - crop_height)
+    crop = photo[y:y + crop_height, x:x + crop_width]
+
+    # Nearest neighbour sampling, photos are much larger than the render
+    rows = (np.arange(height) * crop_height // height)
+    cols = (np.arange(width) * crop_width // width)
+    return crop[rows][:, cols]
+
+# Alpha over with premultiplied render pixels, all in linear color
+def composite(pixels, background):
+    alpha = pixels[:, :, 3:4]
+    result = np.empty_like(pixels)
+    result[:, :, :3] = pixels[:, :, :3] + background * (1 - alpha)
+    result[:, :, 3] = 1
+    return result
+
+# "renders/3001_0.png" -> "renders/3001_0_bg2.png"
+def composite_filename(filename, index):
+    base, ext = os.path.splitext(filename)
+    return f"{base}_bg{index}{ext}"
+
+def srgb_to_linear(c):
+    return np.where(c <= 0.04045, c / 12.92, np.power((c + 0.055) / 1.055, 2.4)).astype(np.float32)
@@ -0,0 +1,124 @@
+import os
+import json
+import heapq
+import numpy as np
+
+from lib.renderer.render_options import BackgroundType, Engine, Material
+
+# What a render's time is made of, one coefficient (seconds) each
+FEATURES = [
+    "overhead",         # scene setup, writing the image
+    "polygons",         # importing the part and building the BVH, per 10k triangles
+    "logo_studs",       # studs with the LEGO logo are imported as extra geometry, per stud
+    "samples",          # path tracing, per 256 samples of a megapixel
+    "transparent",      # the same, for transparent parts rendered with 15 bounces instead of 2
+    "raster",           # workbench and eevee, per megapixel
+    "composites",       # compositing onto extra backgrounds, per image
+]
+
+# Guesses from renders on an M1 Pro, used until there are measurements
+PRIOR = [2.0, 0.5, 0.02, 6.0, 20.0, 0.5, 0.2]
+
+# Predicts how long a job takes to render
+#
+# A linear model over features of the job's options and the part's geometry
+# (see dat_graph.py). It learns online: every measured render time is added
+# to the sums of a least squares fit, which is regularized towards PRIOR so
+# a few measurements don't throw it off. The sums are saved to filename and
+# carried over to later batches.
+class CostModel:
+    def __init__(self, filename="./cache/cost-model.json", prior_weight=10.0):
+        self.filename = filename
+        self.prior = np.array(PRIOR)
+        self.prior_weight = prior_weight
+        self.xtx = np.zeros((len(FEATURES), len(FEATURES)))
+        self.xty = np.zeros(len(FEATURES))
+        self.count = 0
+        self.learned_until = {}  # queue path -> completed_at of the last job learned from it
+        self.coefficients = self.prior.copy()
+        self.load()
+
+    def predict(self, features):
+        return max(0.1, float(np.dot(features, self.coefficients)))
+
+    def learn(self, features, seconds):
+        features = np.asarray(features, dtype=np.float64)
+        self.xtx += np.outer(features, features)
+        self.xty += features * seconds
+        self.count += 1
+
+    # Fit the coefficients to everything learned so far
+    def fit(self):
+        # Scale the prior to the features so it weighs the same for each
+        scale = np.maximum(np.diag(self.xtx) / max(self.count, 1), 1e-6)
+        regularization = np.diag(self.prior_weight * scale)
+        coefficients = np.linalg.solve(self.xtx + regularization, self.xty + regularization @ self.prior)
+        # A negative time makes no sense, it's noise in the measurements
+        self.coefficients = np.maximum(coefficients, 0)
+        return self.coefficients
+
+    # Learn from the jobs a queue completed since last time. Returns the
+    # number of jobs learned from.
+    def learn_from_queue(self, queue, part_stats):
+        key = os.path.abspath(queue.db_path)
+        since = self.learned_until.get(key, 0)
+        completed = queue.completed_since(since)
+        for ldraw_id, options, duration, completed_at in completed:
+            self.learn(job_features(options, part_stats.get(ldraw_id)), duration)
+            since = max(since, completed_at)
+        self.learned_until[key] = since
+        if completed:
+            self.fit()
+        return len(completed)
+
+    def load(self):
+        if not self.filename or not os.path.exists(self.filename):
+            return
+        with open(self.filename) as f:
+            data = json.load(f)
+        if data.get("features") != FEATURES:
+            return  # saved by a different version of the model
+        self.xtx = np.array(data["xtx"])
+        self.xty = np.array(data["xty"])
+        self.count = data["count"]
+        self.learned_until = data["learned_until"]
+        if self.count:
+            self.fit()
+
+    def save(self):
+        if not self.filename:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.filename)), exist_ok=True)
+        temp_filename = f"{self.filename}.tmp{os.getpid()}"
+        with open(temp_filename, "w") as f:
+            json.dump({
+                "features": FEATURES,
+                "xtx": self.xtx.tolist(),
+                "xty": self.xty.tolist(),
+                "count": self.count,
+                "learned_until": self.learned_until,
+            }, f)
+        os.replace(temp_filename, self.filename)
+
+# Features of a job, in the order of FEATURES. stats is the part's PartStats,
+# or None when it isn't known (then only the options count).
+def job_features(options, stats):
+    megapixels = options.render_width * options.render_height / 1e6
+    polygons = stats.polygons / 10000 if stats else 0
+    logo_studs = stats.studs if stats and options.use_logo_studs else 0
+    path_traced = options.engine == Engine.CYCLES
+    samples = megapixels * options.render_samples / 256 if path_traced else 0
+    transparent = samples if options.material == Material.TRANSPARENT else 0
+    raster = 0 if path_traced else megapixels
+    composites = options.composite_count if options.background_type == BackgroundType.COMPOSITED else 0
+    return [1.0, polygons, logo_studs, samples, transparent, raster, composites]
+
+# Estimated wall clock time of rendering jobs with the given costs on a
+# number of workers, handing each job in order to the first free worker.
+# Returns the time and the total time per worker.
+def schedule_makespan(costs, workers):
+    finish_times = [0.0] * workers
+    heapq.heapify(finish_times)
+    for cost in costs:
+        heapq.heappush(finish_times, heapq.heappop(finish_times) + cost)
+    return max(finish_times), sorted(finish_times, reverse=True)
@@ -1,14 +1,110 @@
 import os
+import json
+import fnmatch
 
-def ldraw_dat_exists(ldraw_id):
-    # Check if the file exists in the parts directories
-    part_filename = os.path.abspath(os.path.join("./ldraw/parts", f"{ldraw_id}.dat"))
-    if os.path.exists(part_filename):
-        return True
+# Where parts are looked for, in order
+PART_DIRECTORIES = ["parts", os.path.join("unofficial", "parts")]
+
+# Where the files a part references are looked for, in order. "s\x.dat"
+# is found in parts/s and "48\x.dat" in p/48.
+REFERENCE_DIRECTORIES = ["parts", "p", os.path.join("unofficial", "parts"), os.path.join("unofficial", "p"), "models"]
+
+# Every file in the LDraw library, from one walk of the directory tree
+#
+# Checking whether a part exists used to stat its possible paths on each call,
+# which is slow when the library is on network storage. The index is saved to
+# cache_filename with the modification time of every directory. Adding or
+# removing a file changes its directory's time, so checking the directories
+# (hundreds, not the 20k+ files) is enough to tell if the saved index is
+# still good.
+class LDrawIndex:
+    def __init__(self, ldraw_path="./ldraw", cache_filename="./cache/ldraw-index.json"):
+        self.ldraw_path = os.path.abspath(ldraw_path)
+        self.cache_filename = cache_filename
+        self.files = []          # paths relative to ldraw_path
+        self.parts = {}          # lowercase part id, e.g. "3001" or "s/3001s01" -> absolute path
+        self.directories = {}    # relative directory -> modification time
+        self.lowercase_files = None
+        if not self.load():
+            self.build()
+            self.save()
+        self.index_parts()
+
+    def part_path(self, ldraw_id):
+        return self.parts.get(ldraw_id.lower().replace("\\", "/"))
+
+    def part_exists(self, ldraw_id):
+        return self.part_path(ldraw_id) is not None
+
+    # Path of a file referenced by another, e.g. "s\3001s01.dat" or "stud.dat"
+    def resolve(self, reference):
+        if self.lowercase_files is None:
+            self.lowercase_files = {path.lower().replace(os.sep, "/"): path for path in self.files}
+        reference = reference.lower().replace("\\", "/")
+        for directory in REFERENCE_DIRECTORIES:
+            path = self.lowercase_files.get(f"{directory.replace(os.sep, '/')}/{reference}")
+            if path is not None:
+                return os.path.join(self.ldraw_path, path)
+        return None
 
-    # Check if the file exists in the unofficial parts directories
-    part_filename = os.path.abspath(os.path.join("./ldraw/unofficial/parts", f"{ldraw_id}.dat"))
-    if os.path.exists(part_filename):
+    # Like glob("**/pattern") below the library
+    def matching(self, pattern):
+        return [os.path.join(self.ldraw_path, path) for path in self.files if fnmatch.fnmatch(os.path.basename(path), pattern)]
+
+    def build(self):
+        print(f"[LDRAW] Indexing {self.ldraw_path}...")
+        self.files = []
+        self.directories = {}
+        for directory, subdirectories, filenames in os.walk(self.ldraw_path):
+            relative = os.path.relpath(directory, self.ldraw_path)
+            self.directories[relative] = os.stat(directory).st_mtime
+            self.files.extend(os.path.normpath(os.path.join(relative, filename)) for filename in filenames)
+        print(f"[LDRAW] Indexed {len(self.files)} files")
+
+    def index_parts(self):
+        self.parts = {}
+        # Official parts win over unofficial ones
+        for part_directory in reversed(PART_DIRECTORIES):
+            prefix = part_directory + os.sep
+            for path in self.files:
+                if path.startswith(prefix) and path.lower().endswith(".dat"):
+                    ldraw_id = path[len(prefix):-4].lower().replace(os.sep, "/")
+                    self.parts[ldraw_id] = os.path.join(self.ldraw_path, path)
+
+    def load(self):
+        if not self.cache_filename or not os.path.exists(self.cache_filename):
+            return False
+        with open(self.cache_filename) as f:
+            data = json.load(f)
+        if data.get("ldraw_path") != self.ldraw_path or "." not in data["directories"]:
+            return False
+        for relative, mtime in data["directories"].items():
+            try:
+                if os.stat(os.path.join(self.ldraw_path, relative)).st_mtime != mtime:
+                    return False
+            except FileNotFoundError:
+                return False
+        self.files = data["files"]
+        self.directories = data["directories"]
         return True
 
-    return False
+    def save(self):
+        if not self.cache_filename or not self.directories:
+            return  # no library to index yet
+        os.makedirs(os.path.dirname(os.path.abspath(self.cache_filename)), exist_ok=True)
+        temp_filename = f"{self.cache_filename}.tmp{os.getpid()}"
+        with open(temp_filename, "w") as f:
+            json.dump({"ldraw_path": self.ldraw_path, "directories": self.directories, "files": self.files}, f)
+        os.replace(temp_filename, self.cache_filename)
+
+# One index per library, shared by everything in the process
+indexes = {}
+
+def ldraw_index(ldraw_path="./ldraw"):
+    key = os.path.abspath(ldraw_path)
+    if key not in indexes:
+        indexes[key] = LDrawIndex(ldraw_path)
+    return indexes[key]
+
+def ldraw_dat_exists(ldraw_id, ldraw_path="./ldraw"):
+    return ldraw_index(ldraw_path).part_exists(ldraw_id)
@@ -0,0 +1,200 @@
+import os
+import re
+import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from lib.renderer.dat import ldraw_index
+
+# Stud primitives, e.g. stud.dat, stud2a.dat, stud4.dat. Not stud groups
+# (stug-*.dat), those are made of studs and counted through them.
+STUD_PATTERN = re.compile(r"^stud\d*[a-z]?\.dat$")
+
+# How complex a part is, without starting Blender
+#
+# triangles and quads count every polygon after expanding all the files the
+# part references (a 2x4 brick has 8 studs, each with their own polygons).
+# primitives are the distinct files from p/ it uses.
+class PartStats:
+    def __init__(self, triangles=0, quads=0, lines=0, studs=0, primitives=(), files=(), mtime=0, unresolved=()):
+        self.triangles = triangles
+        self.quads = quads
+        self.lines = lines             # edge lines, drawn by the instructions look
+        self.studs = studs
+        self.primitives = set(primitives)
+        self.files = set(files)        # every file it depends on, including itself
+        self.mtime = mtime             # newest modification time of those files
+        self.unresolved = set(unresolved)  # references to files that aren't in the library
+
+    @property
+    def polygons(self):
+        return self.triangles + self.quads * 2
+
+    def to_dict(self):
+        return {
+            "triangles": self.triangles,
+            "quads": self.quads,
+            "lines": self.lines,
+            "studs": self.studs,
+            "primitives": sorted(self.primitives),
+            "files": sorted(self.files),
+            "mtime": self.mtime,
+            "unresolved": sorted(self.unresolved),
+        }
+
+    @classmethod
+    def from_dict(cls, values):
+        return cls(values["triangles"], values["quads"], values["lines"], values["studs"], values["primitives"], values["files"], values["mtime"], values["unresolved"])
+
+# Dependency graph of LDraw files
+#
+# Each file is parsed once, the stats of a file are the counts of its own
+# lines plus the stats of every file it references (once per reference).
+# Shared subfiles (studs, cylinders, ...) are computed once and memoized.
+class DatGraph:
+    def __init__(self, ldraw_path="./ldraw"):
+        self.index = ldraw_index(ldraw_path)
+        self.stats = {}        # path -> PartStats
+        self.references = {}   # path -> referenced paths, one per type 1 line
+
+    def part_stats(self, ldraw_id):
+        path = self.index.part_path(ldraw_id)
+        if path is None:
+            raise FileNotFoundError(f"Part file not found: {ldraw_id}.dat")
+        return self.file_stats(path)
+
+    def file_stats(self, path, visiting=()):
+        if path in self.stats:
+            return self.stats[path]
+        if path in visiting:
+            print(f"[DAT] WARNING: {path} references itself")
+            return PartStats()
+
+        triangles, quads, lines, references = parse_dat(path)
+        stats = PartStats(triangles, quads, lines, files=[path], mtime=os.path.getmtime(path))
+        self.references[path] = []
+        for reference in references:
+            if STUD_PATTERN.match(os.path.basename(reference.replace("\\", "/")).lower()):
+                stats.studs += 1
+            child = self.index.resolve(reference)
+            if child is None:
+                print(f"[DAT] WARNING: {path} references missing file {reference}")
+                stats.unresolved.add(reference.lower().replace("\\", "/"))
+                continue
+            self.references[path].append(child)
+
+            child_stats = self.file_stats(child, (*visiting, path))
+            stats.triangles += child_stats.triangles
+            stats.quads += child_stats.quads
+            stats.lines += child_stats.lines
+            if not STUD_PATTERN.match(os.path.basename(child).lower()):
+                stats.studs += child_stats.studs
+            stats.primitives |= child_stats.primitives
+            stats.files |= child_stats.files
+            stats.unresolved |= child_stats.unresolved
+            stats.mtime = max(stats.mtime, child_stats.mtime)
+
+        if is_primitive(self.index.ldraw_path, path):
+            stats.primitives.add(os.path.relpath(path, self.index.ldraw_path))
+        self.stats[path] = stats
+        return stats
+
+def is_primitive(ldraw_path, path):
+    relative = os.path.relpath(path, ldraw_path).replace(os.sep, "/")
+    return relative.startswith("p/") or relative.startswith("unofficial/p/")
+
+# Counts the triangles (type 3), quads (type 4) and edge lines (type 2) of a
+# file and lists the files it references (type 1)
+def parse_dat(path):
+    triangles = quads = lines = 0
+    references = []
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            kind = line[0]
+            if kind == "3":
+                triangles += 1
+            elif kind == "4":
+                quads += 1
+            elif kind == "2":
+                lines += 1
+            elif kind == "1":
+                fields = line.split(None, 14)
+                if len(fields) == 15:
+                    references.append(fields[14])
+    return triangles, quads, lines, references
+
+# Stats of many parts, e.g. the whole library, in a process pool. Results are
+# saved to cache_filename, next to those of other libraries, and reused while
+# none of the files a part depends on has changed and none of the files it
+# references but that were missing has been added.
+def analyze_parts(ldraw_ids, ldraw_path="./ldraw", processes=None, cache_filename="./cache/part-stats.json", chunk_size=200):
+    libraries = load_stats_cache(cache_filename)
+    cached = libraries.setdefault(os.path.abspath(ldraw_path), {})
+    index = ldraw_index(ldraw_path)
+    results = {}
+    todo = []
+    mtimes = {}
+    for ldraw_id in ldraw_ids:
+        entry = cached.get(ldraw_id)
+        if entry is not None and is_current(entry, mtimes, index):
+            results[ldraw_id] = PartStats.from_dict(entry)
+        else:
+            todo.append(ldraw_id)
+
+    if todo:
+        print(f"[DAT] Analyzing {len(todo)} parts ({len(results)} cached)...")
+        chunks = [todo[i:i + chunk_size] for i in range(0, len(todo), chunk_size)]
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("fork" if "fork" in methods else None)
+        with ProcessPoolExecutor(max_workers=processes, mp_context=context) as executor:
+            for chunk_results in executor.map(analyze_chunk, chunks, [ldraw_path] * len(chunks)):
+                for ldraw_id, values in chunk_results.items():
+                    cached[ldraw_id] = values
+                    results[ldraw_id] = PartStats.from_dict(values)
+        save_stats_cache(cache_filename, libraries)
+    return results
+
+# Runs in a worker process. Subfiles shared by the parts of a chunk are only
+# parsed once.
+def analyze_chunk(ldraw_ids, ldraw_path):
+    graph = DatGraph(ldraw_path)
+    results = {}
+    for ldraw_id in ldraw_ids:
+        try:
+            results[ldraw_id] = graph.part_stats(ldraw_id).to_dict()
+        except (FileNotFoundError, OSError) as e:
+            print(f"[DAT] WARNING: {ldraw_id}: {e}")
+    return results
+
+def is_current(entry, mtimes, index):
+    if any(index.resolve(reference) is not None for reference in entry["unresolved"]):
+        return False
+    for path in entry["files"]:
+        if path not in mtimes:
+            try:
+                mtimes[path] = os.path.getmtime(path)
+            except OSError:
+                mtimes[path] = None
+        if mtimes[path] is None or mtimes[path] > entry["mtime"]:
+            return False
+    return True
+
+# The cache maps each library's absolute path to the stats of its parts by
+# ldraw id. Caches written before it was keyed by library are dropped.
+def load_stats_cache(cache_filename):
+    if not cache_filename or not os.path.exists(cache_filename):
+        return {}
+    with open(cache_filename) as f:
+        return json.load(f).get("libraries", {})
+
+def save_stats_cache(cache_filename, libraries):
+    if not cache_filename:
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(cache_filename)), exist_ok=True)
+    temp_filename = f"{cache_filename}.tmp{os.getpid()}"
+    with open(temp_filename, "w") as f:
+        json.dump({"libraries": libraries}, f)
+    os.replace(temp_filename, cache_filename)
@@ -0,0 +1,113 @@
+import sys
+import types
+import random
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import bpy
+import numpy as np
+
+from lib.background import generate_background
+
+# Procedurally generated backgrounds for BackgroundType.GENERATED
+#
+# A rolling set of count textures is kept in memory as Blender images. Each
+# render picks one at random. After a texture has been used reuse times it
+# is regenerated with a new seed in a process pool, so new backgrounds are
+# drawn while Blender renders. Seeds follow from seed, so a run with the same
+# seed uses the same backgrounds.
+#
+# The pool workers are fresh python processes (forkserver, or spawn where
+# that isn't available) that only import lib/background.py. Forking Blender
+# while the output pipeline and heartbeat threads hold locks can deadlock
+# the child.
+class GeneratedBackgrounds:
+    def __init__(self, count=16, size=1024, num_shapes=60, reuse=8, processes=2, seed=None):
+        self.count = count
+        self.size = size
+        self.num_shapes = num_shapes
+        self.reuse = reuse
+        self.processes = processes
+        self.next_seed = seed if seed is not None else random.getrandbits(32)
+        self.executor = None
+        self.images = []     # one Blender image per slot
+        self.uses = []       # renders since each slot was generated
+        self.pending = {}    # slot -> future of its new pixels
+
+    @property
+    def datablocks(self):
+        return list(self.images)
+
+    # A Blender image with a generated background
+    def next_image(self):
+        if self.executor is None:
+            self.start()
+
+        self.collect(wait=False)
+        ready = [slot for slot in range(self.count) if slot not in self.pending]
+        if not ready:
+            self.collect(wait=True)
+            ready = [slot for slot in range(self.count) if slot not in self.pending]
+
+        slot = random.choice(ready)
+        self.uses[slot] += 1
+        if self.uses[slot] >= self.reuse:
+            self.generate(slot)
+        return self.images[slot]
+
+    def start(self):
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+        if context.get_start_method() == "forkserver":
+            context.set_forkserver_preload(["lib.background"])
+        self.executor = ProcessPoolExecutor(max_workers=min(self.processes, self.count), mp_context=context)
+        for slot in range(self.count):
+            image = bpy.data.images.new(f"lego-rendering-generated-{slot}", self.size, self.size, alpha=False)
+            image.use_fake_user = True
+            self.images.append(image)
+            self.uses.append(0)
+        # The workers start on the first submits
+        with hidden_main():
+            for slot in range(self.count):
+                self.generate(slot)
+
+    def generate(self, slot):
+        self.pending[slot] = self.executor.submit(generate_background, self.next_seed, (self.size, self.size), self.num_shapes)
+        self.next_seed += 1
+
+    # Copy finished backgrounds into their images. With wait, block until
+    # at least one is finished.
+    def collect(self, wait):
+        if wait:
+            next(iter(self.pending.values())).result()
+        for slot, future in list(self.pending.items()):
+            if future.done():
+                del self.pending[slot]
+                set_image_pixels(self.images[slot], future.result())
+                self.uses[slot] = 0
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+# New python processes run the parent's __main__ before anything else. Under
+# Blender that is the render script, which can't run without bpy, so an
+# empty __main__ is put in its place while the pool starts its workers.
+@contextlib.contextmanager
+def hidden_main():
+    main = sys.modules["__main__"]
+    sys.modules["__main__"] = types.ModuleType("__main__")
+    try:
+        yield
+    finally:
+        sys.modules["__main__"] = main
+
+# Copy a (height, width, 3) uint8 array into a Blender image. Blender stores
+# rows bottom first.
+def set_image_pixels(image, pixels):
+    height, width = pixels.shape[:2]
+    rgba = np.ones((height, width, 4), dtype=np.float32)
+    rgba[:, :, :3] = pixels[::-1] / 255
+    image.pixels.foreach_set(rgba.ravel())
+    image.update()
@@ -0,0 +1,38 @@
+import bpy
+import numpy as np
+from lib.renderer.utils import world_points
+
+# World space points of the parts of one render, gathered once
+#
+# After the parts are rotated the scene is updated once and each part's
+# convex hull (see HullCache) is moved to world space. The hull has the same
+# extremes as all of the part's vertices, so grounding, layout, camera
+# framing and labels all work from these arrays. Moving a part afterwards
+# moves its points too, instead of updating the scene and reading the
+# meshes again.
+class GeometrySnapshot:
+    def __init__(self, points):
+        self.points = points  # (n, 3) array per part
+
+    # parts is a list of (cached part, options)
+    @classmethod
+    def capture(cls, parts, hulls):
+        bpy.context.view_layer.update()
+        return cls([world_points(cached.part, hulls.get(cached.key[0], options, cached.part)) for cached, options in parts])
+
+    # Call after moving part i (or its root) by offset, an (x, y, z) tuple
+    def translate(self, i, offset):
+        self.points[i] = self.points[i] + np.asarray(offset, dtype=np.float64)
+
+    def lowest_z(self, i):
+        return float(self.points[i][:, 2].min())
+
+    # (min x, min y, max x, max y) of a part seen from above
+    def footprint(self, i):
+        min_x, min_y = self.points[i][:, :2].min(axis=0)
+        max_x, max_y = self.points[i][:, :2].max(axis=0)
+        return float(min_x), float(min_y), float(max_x), float(max_y)
+
+    @property
+    def all_points(self):
+        return np.concatenate(self.points)
@@ -0,0 +1,66 @@
+import os
+import numpy as np
+from lib.renderer.utils import world_vertices, convex_hull
+
+# Convex hull points of each part, saved to disk
+#
+# The 2D bounding box of a part only depends on the points of its convex
+# hull, which are usually a small fraction of its vertices. The hull is
+# computed the first time a part is labeled and stored in the part's own
+# coordinates, so it works for any rotation and camera.
+#
+# Hulls are keyed by what the mesh was built from: the importer and our own
+# loader (see native_import.py) don't make the same vertices, and a part
+# whose .dat file changed gets a new hull. mesh_source(options) returns
+# "importer" or "native", ldraw_index finds the .dat file.
+class HullCache:
+    def __init__(self, cache_dir="./cache/hulls", ldraw_index=None, mesh_source=None):
+        self.cache_dir = cache_dir
+        self.ldraw_index = ldraw_index
+        self.mesh_source = mesh_source
+        self.hulls = {}
+        self.versions = {}  # part id -> modification time of its .dat file, read once per run
+
+    def key(self, ldraw_part_id, options):
+        source = self.mesh_source(options) if self.mesh_source else "importer"
+        return (ldraw_part_id, options.res_prisms, options.use_logo_studs, source, self.version(ldraw_part_id))
+
+    def version(self, ldraw_part_id):
+        version = self.versions.get(ldraw_part_id)
+        if version is None:
+            path = self.ldraw_index.part_path(ldraw_part_id) if self.ldraw_index else None
+            version = os.stat(path).st_mtime_ns if path and os.path.exists(path) else 0
+            self.versions[ldraw_part_id] = version
+        return version
+
+    def filename(self, key):
+        ldraw_part_id, res_prisms, use_logo_studs, source, version = key
+        logo = "logo" if use_logo_studs else "plain"
+        return os.path.join(self.cache_dir, f"{ldraw_part_id}_{res_prisms.lower()}_{logo}_{source}_{version}.npy")
+
+    # Hull points in the part's coordinates as an (n, 3) array
+    def get(self, ldraw_part_id, options, part):
+        key = self.key(ldraw_part_id, options)
+        if key in self.hulls:
+            return self.hulls[key]
+
+        filename = self.filename(key)
+        if os.path.exists(filename):
+            hull = np.load(filename)
+        else:
+            hull = self.compute(part)
+            os.makedirs(self.cache_dir, exist_ok=True)
+            temp_filename = f"{filename}.tmp{os.getpid()}.npy"
+            np.save(temp_filename, hull)
+            os.replace(temp_filename, filename)
+
+        self.hulls[key] = hull
+        return hull
+
+    def compute(self, part):
+        points = world_vertices(part)
+        to_local = np.array(part.matrix_world.inverted(), dtype=np.float64)
+        local = points @ to_local[:3, :3].T + to_local[:3, 3]
+        hull = convex_hull(local)
+        print(f"[HULL] {part.name}: {len(hull)} of {len(local)} vertices")
+        return hull
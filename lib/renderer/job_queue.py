@@ -0,0 +1,274 @@
+import json
+import sqlite3
+import threading
+import time
+import traceback
+
+from lib.renderer.render_options import RenderOptions
+
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+
+# Render jobs shared by many worker processes
+#
+# Each job is a part and its render options. A worker leases a job, renders
+# it and marks it done. While rendering it heartbeats to extend the lease.
+# If a worker dies its lease expires and the job goes back to pending so
+# another worker picks it up. SQLite handles the locking between processes.
+class JobQueue:
+    def __init__(self, db_path="render_queue.db", max_attempts=3):
+        self.db_path = db_path
+        self.max_attempts = max_attempts
+        self.conn = sqlite3.connect(db_path, timeout=60, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY,
+            ldraw_id TEXT NOT NULL,
+            options TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            worker TEXT,
+            lease_expires REAL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            duration REAL,
+            error TEXT)""")
+        # Added later, queues planned before have to be upgraded
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(jobs)")}
+        if "cost" not in columns:
+            self.conn.execute("ALTER TABLE jobs ADD COLUMN cost REAL")  # estimated seconds, see cost_model.py
+        if "completed_at" not in columns:
+            self.conn.execute("ALTER TABLE jobs ADD COLUMN completed_at REAL")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, lease_expires)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS jobs_completed ON jobs (completed_at)")
+        # So leasing doesn't sort the whole queue while holding the write lock
+        self.conn.execute("CREATE INDEX IF NOT EXISTS jobs_part ON jobs (status, ldraw_id, id)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS jobs_order ON jobs (status, id)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS jobs_cost ON jobs (status, cost DESC, id)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS jobs_part_cost ON jobs (status, ldraw_id, cost DESC)")
+
+    def close(self):
+        self.conn.close()
+
+    def add(self, ldraw_id, options):
+        self.add_many([(ldraw_id, options)])
+
+    def add_many(self, jobs):
+        with self.transaction():
+            self.conn.executemany(
+                "INSERT INTO jobs (ldraw_id, options) VALUES (?, ?)",
+                [(ldraw_id, json.dumps(options.to_dict())) for ldraw_id, options in jobs])
+
+    # Lease the next job, or None if there is nothing to do.
+    #
+    # The most expensive job goes first (longest processing time first), so
+    # the slow jobs don't all end up at the end of the batch with one worker
+    # rendering them while the others are idle. Jobs for the same part as
+    # the previous job are preferred, so the worker can reuse the part it
+    # already imported, as long as they cost at least half as much as the
+    # most expensive one. Without estimated costs jobs go in the order they
+    # were added.
+    def lease(self, worker, lease_seconds=300, prefer_ldraw_id=None):
+        now = time.time()
+        with self.transaction():
+            self.requeue_expired()
+            row = self.next_job(prefer_ldraw_id)
+            if row is None:
+                return None
+            self.conn.execute("""
+                UPDATE jobs SET status = ?, worker = ?, lease_expires = ?, attempts = attempts + 1
+                WHERE id = ?""", (LEASED, worker, now + lease_seconds, row[0]))
+        job_id, ldraw_id, options = row
+        return job_id, ldraw_id, RenderOptions.from_dict(json.loads(options))
+
+    # A few queries that each read one row from an index, rather than one
+    # that sorts every pending job. Jobs without an estimate (cost is NULL)
+    # sort after the estimated ones.
+    def next_job(self, prefer_ldraw_id=None):
+        most = self.conn.execute("""
+            SELECT cost FROM jobs WHERE status = ?
+            ORDER BY cost DESC, id LIMIT 1""", (PENDING,)).fetchone()
+        if most is None:
+            return None
+        most = most[0]
+
+        row = None
+        if prefer_ldraw_id is not None:
+            if most is None:
+                row = self.conn.execute("""
+                    SELECT id, ldraw_id, options FROM jobs
+                    WHERE status = ? AND ldraw_id = ?
+                    ORDER BY id LIMIT 1""", (PENDING, prefer_ldraw_id)).fetchone()
+            else:
+                row = self.conn.execute("""
+                    SELECT id, ldraw_id, options FROM jobs
+                    WHERE status = ? AND ldraw_id = ? AND cost >= ?
+                    ORDER BY cost DESC LIMIT 1""", (PENDING, prefer_ldraw_id, most / 2)).fetchone()
+        if row is None:
+            row = self.conn.execute("""
+                SELECT id, ldraw_id, options FROM jobs
+                WHERE status = ?
+                ORDER BY cost DESC, id LIMIT 1""", (PENDING,)).fetchone()
+        return row
+
+    # Extend a lease. Returns False if the job is no longer ours (the lease
+    # expired and another worker took it).
+    def heartbeat(self, job_id, worker, lease_seconds=300):
+        cursor = self.conn.execute("""
+            UPDATE jobs SET lease_expires = ?
+            WHERE id = ? AND worker = ? AND status = ?""", (time.time() + lease_seconds, job_id, worker, LEASED))
+        return cursor.rowcount == 1
+
+    def complete(self, job_id, worker, duration=None):
+        cursor = self.conn.execute("""
+            UPDATE jobs SET status = ?, lease_expires = NULL, duration = ?, completed_at = ?
+            WHERE id = ? AND worker = ? AND status = ?""", (DONE, duration, time.time(), job_id, worker, LEASED))
+        return cursor.rowcount == 1
+
+    # Give up on a job after max_attempts, otherwise let another worker try
+    def fail(self, job_id, worker, error):
+        cursor = self.conn.execute("""
+            UPDATE jobs SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END, lease_expires = NULL, error = ?
+            WHERE id = ? AND worker = ? AND status = ?""", (self.max_attempts, FAILED, PENDING, str(error), job_id, worker, LEASED))
+        return cursor.rowcount == 1
+
+    # Put jobs from dead workers back in the queue
+    def requeue_expired(self):
+        cursor = self.conn.execute("""
+            UPDATE jobs SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END, worker = NULL, lease_expires = NULL
+            WHERE status = ? AND lease_expires < ?""", (self.max_attempts, FAILED, PENDING, LEASED, time.time()))
+        return cursor.rowcount
+
+    # (id, ldraw_id, options) of the jobs still to render
+    def pending(self):
+        for job_id, ldraw_id, options in self.conn.execute("SELECT id, ldraw_id, options FROM jobs WHERE status = ?", (PENDING,)):
+            yield job_id, ldraw_id, RenderOptions.from_dict(json.loads(options))
+
+    def ldraw_ids(self):
+        return [row[0] for row in self.conn.execute("SELECT DISTINCT ldraw_id FROM jobs")]
+
+    # (ldraw_id, options, duration, completed_at) of jobs done after a time
+    def completed_since(self, since):
+        rows = self.conn.execute("""
+            SELECT ldraw_id, options, duration, completed_at FROM jobs
+            WHERE completed_at > ? AND status = ? AND duration IS NOT NULL""", (since, DONE)).fetchall()
+        return [(ldraw_id, RenderOptions.from_dict(json.loads(options)), duration, completed_at) for ldraw_id, options, duration, completed_at in rows]
+
+    # costs is {job id: estimated seconds}
+    def set_costs(self, costs):
+        with self.transaction():
+            self.conn.executemany("UPDATE jobs SET cost = ? WHERE id = ?", [(cost, job_id) for job_id, cost in costs.items()])
+
+    @property
+    def total(self):
+        return self.conn.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+
+    def counts(self):
+        counts = {PENDING: 0, LEASED: 0, DONE: 0, FAILED: 0}
+        for status, count in self.conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status"):
+            counts[status] = count
+        return counts
+
+    def transaction(self):
+        return Transaction(self.conn)
+
+# Render jobs until the queue is empty. heartbeat, e.g. a Heartbeat, is
+# told about every job this worker holds the lease of (add) and every job
+# it is done with (discard), so the lease is extended while the job renders
+# and while its image is written.
+#
+# Images may still be written in the background after render_part returns,
+# a job is only marked done once its image is written.
+def render_jobs(queue, renderer, worker, lease_seconds=300, heartbeat=None):
+    last_ldraw_id = None
+    writing = []
+    while True:
+        job = queue.lease(worker, lease_seconds, prefer_ldraw_id=last_ldraw_id)
+        if job is None:
+            break
+
+        job_id, ldraw_id, options = job
+        if heartbeat:
+            heartbeat.add(job_id)
+        start = time.time()
+        try:
+            print(f"------ [{worker}] Rendering job {job_id}: {options.image_filename}...")
+            future = renderer.render_part(ldraw_id, options)
+            writing.append((job_id, options, time.time() - start, future))
+            last_ldraw_id = ldraw_id
+        except Exception as e:
+            print(f"------ ERROR: job {job_id} {options.image_filename} failed to render: {e}")
+            traceback.print_exc()
+            if heartbeat:
+                heartbeat.discard(job_id)
+            queue.fail(job_id, worker, e)
+        writing = finish_written(queue, worker, writing, heartbeat)
+
+    renderer.wait()
+    finish_written(queue, worker, writing, heartbeat)
+
+# Mark jobs whose images have been written as done (or failed). Returns
+# the jobs still being written.
+def finish_written(queue, worker, writing, heartbeat=None):
+    remaining = []
+    for job_id, options, duration, future in writing:
+        if not future.done():
+            remaining.append((job_id, options, duration, future))
+            continue
+        # Stop heartbeating first, a heartbeat after the job is marked
+        # would report a lost lease
+        if heartbeat:
+            heartbeat.discard(job_id)
+        if future.exception() is not None:
+            print(f"------ ERROR: job {job_id} {options.image_filename} failed to write: {future.exception()}")
+            queue.fail(job_id, worker, future.exception())
+        else:
+            queue.complete(job_id, worker, duration)
+    return remaining
+
+# Extends the leases of the jobs being rendered or written from a background
+# thread. SQLite connections can't be shared between threads so it has its own.
+class Heartbeat:
+    def __init__(self, queue_path, worker, lease_seconds):
+        self.queue_path = queue_path
+        self.worker = worker
+        self.lease_seconds = lease_seconds
+        self.job_ids = set()
+        self.stopped = threading.Event()
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        queue = JobQueue(self.queue_path)
+        while not self.stopped.wait(self.lease_seconds / 3):
+            with self.lock:
+                for job_id in sorted(self.job_ids):
+                    if not queue.heartbeat(job_id, self.worker, self.lease_seconds):
+                        print(f"------ WARNING: lost lease on job {job_id}")
+        queue.close()
+
+    def add(self, job_id):
+        with self.lock:
+            self.job_ids.add(job_id)
+
+    def discard(self, job_id):
+        with self.lock:
+            self.job_ids.discard(job_id)
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+# BEGIN IMMEDIATE takes the write lock up front so two workers can't
+# lease the same job
+class Transaction:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
@@ -0,0 +1,50 @@
+import os
+import shutil
+import tempfile
+import weakref
+
+# Distance between parts in a multi part document, in LDraw units. Far enough
+# apart that the importer's objects can be told apart by their position.
+PART_SPACING = 10000
+
+# The .ldr files handed to the importer
+#
+# The importer only reads files, so each part is wrapped in a small .ldr
+# document that places it with a color code. Documents are written once per
+# (parts, color code) to a scratch directory for this process, on tmpfs
+# (/dev/shm) when there is one, and reused by later imports. The directory
+# is removed by close(), or when the process exits if close() is never called.
+class LdrDocuments:
+    def __init__(self):
+        base = "/dev/shm" if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK) else None
+        self.directory = tempfile.mkdtemp(prefix="lego-rendering-ldr-", dir=base)
+        self.remove_directory = weakref.finalize(self, shutil.rmtree, self.directory, ignore_errors=True)
+        self.filenames = {}
+
+    # A document with one or more parts, the nth part at n * PART_SPACING along x
+    def filename(self, ldraw_part_ids, color_code):
+        key = (tuple(ldraw_part_ids), color_code)
+        filename = self.filenames.get(key)
+        if filename is None:
+            name = "_".join(ldraw_part_ids) if len(ldraw_part_ids) <= 4 else f"{ldraw_part_ids[0]}_{len(self.filenames)}"
+            filename = os.path.join(self.directory, f"{name}_{color_code}.ldr")
+            with open(filename, "w") as f:
+                f.write(document(ldraw_part_ids, color_code))
+            self.filenames[key] = filename
+        return filename
+
+    def close(self):
+        self.remove_directory()
+        self.filenames = {}
+
+def document(ldraw_part_ids, color_code):
+    lines = [
+        "0 Untitled Model",
+        "0 Name:  UntitledModel",
+        "0 Author:",
+        "0 CustomBrick",
+    ]
+    for i, ldraw_part_id in enumerate(ldraw_part_ids):
+        x = 30 + i * PART_SPACING
+        lines.append(f"1 {color_code} {x:.6f} -24.000000 -20.000000 1.000000 0.000000 0.000000 0.000000 1.000000 0.000000 0.000000 0.000000 1.000000 {ldraw_part_id}.dat")
+    return "\n".join(lines) + "\n"
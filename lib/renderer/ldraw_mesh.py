@@ -0,0 +1,349 @@
+import os
+import re
+import numpy as np
+from collections import OrderedDict
+
+from lib.renderer.dat import ldraw_index
+
+# LDraw units to Blender units, the same scale as the importer
+SCALE = 0.01
+
+MAIN_COLOR = 16  # takes the color of whatever references the file
+
+# Vertices closer than this (in LDraw units) are merged
+WELD_PRECISION = 1e-3
+
+# A part flattened into arrays, ready for a Blender mesh
+#
+# vertices are (n, 3) in LDraw axes (-y is up) scaled to Blender units, the
+# importer's parts are too and the renderer rotates them upright. Faces are
+# triangles and quads: face_vertices lists the vertex indexes of every face,
+# counter-clockwise seen from the front, and loop_starts where each face
+# starts in it. face_colors is the LDraw color code of each face,
+# MAIN_COLOR for the part color. Faces from files that aren't BFC certified
+# may face either way, see face_certified.
+class LDrawMesh:
+    def __init__(self, vertices, face_vertices, face_sizes, face_colors, face_certified):
+        self.vertices = vertices
+        self.face_vertices = face_vertices
+        self.face_sizes = face_sizes
+        self.face_colors = face_colors
+        self.face_certified = face_certified
+
+    @property
+    def loop_starts(self):
+        return np.concatenate(([0], np.cumsum(self.face_sizes)[:-1])).astype(np.int32)
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in (self.vertices, self.face_vertices, self.face_sizes, self.face_colors, self.face_certified))
+
+# The faces of a file and everything it references, in the file's own
+# coordinates. Triangles are (t, 3, 3) and quads (q, 4, 3) arrays of points.
+class Geometry:
+    def __init__(self, triangles, triangle_colors, triangle_certified, quads, quad_colors, quad_certified):
+        self.triangles = triangles
+        self.triangle_colors = triangle_colors
+        self.triangle_certified = triangle_certified
+        self.quads = quads
+        self.quad_colors = quad_colors
+        self.quad_certified = quad_certified
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in (self.triangles, self.triangle_colors, self.triangle_certified, self.quads, self.quad_colors, self.quad_certified))
+
+    # Placed by a type 1 line: moved by matrix, the main color replaced by
+    # color and the winding reversed when inverted
+    def transformed(self, matrix, color, inverted):
+        rotation = matrix[:3, :3]
+        translation = matrix[:3, 3]
+        triangles = self.triangles @ rotation.T + translation
+        quads = self.quads @ rotation.T + translation
+        if inverted:
+            triangles = triangles[:, ::-1]
+            quads = quads[:, ::-1]
+        return Geometry(
+            triangles, replace_main_color(self.triangle_colors, color), self.triangle_certified,
+            quads, replace_main_color(self.quad_colors, color), self.quad_certified)
+
+    @classmethod
+    def combine(cls, geometries):
+        return cls(
+            np.concatenate([g.triangles for g in geometries]).reshape(-1, 3, 3),
+            np.concatenate([g.triangle_colors for g in geometries]).astype(np.int32),
+            np.concatenate([g.triangle_certified for g in geometries]).astype(bool),
+            np.concatenate([g.quads for g in geometries]).reshape(-1, 4, 3),
+            np.concatenate([g.quad_colors for g in geometries]).astype(np.int32),
+            np.concatenate([g.quad_certified for g in geometries]).astype(bool))
+
+def replace_main_color(colors, color):
+    if color == MAIN_COLOR:
+        return colors
+    return np.where(colors == MAIN_COLOR, color, colors)
+
+# One .dat file: its own faces and the files it references
+class DatFile:
+    def __init__(self, geometry, references):
+        self.geometry = geometry
+        self.references = references  # (color, 4x4 matrix, filename, invert next)
+
+    @property
+    def nbytes(self):
+        return self.geometry.nbytes + len(self.references) * REFERENCE_BYTES
+
+# Rough size of a parsed type 1 line, only used to bound LDrawMeshes' caches
+REFERENCE_BYTES = 256
+
+# Reads a .dat file, following its BFC statements. Faces are stored counter-
+# clockwise, so faces in CW sections are reversed.
+def parse_dat_file(path):
+    triangles, triangle_colors = [], []
+    quads, quad_colors = [], []
+    references = []
+    certified = False
+    ccw = True
+    invert_next = False
+
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            fields = line.split()
+            if not fields:
+                continue
+            kind = fields[0]
+            if kind == "0":
+                if len(fields) > 2 and fields[1] == "BFC":
+                    commands = fields[2:]
+                    if "CERTIFY" in commands:
+                        certified = True
+                    if "NOCERTIFY" in commands:
+                        certified = False
+                    if "CW" in commands:
+                        ccw = False
+                    if "CCW" in commands:
+                        ccw = True
+                    if "INVERTNEXT" in commands:
+                        invert_next = True
+            elif kind == "1" and len(fields) >= 15:
+                values = [float(value) for value in fields[2:14]]
+                x, y, z, a, b, c, d, e, f_, g, h, i = values
+                matrix = np.array([[a, b, c, x], [d, e, f_, y], [g, h, i, z], [0, 0, 0, 1]], dtype=np.float64)
+                filename = " ".join(fields[14:])
+                references.append((parse_color(fields[1]), matrix, filename, invert_next))
+                invert_next = False
+            elif kind == "3" and len(fields) >= 11:
+                points = [float(value) for value in fields[2:11]]
+                triangles.append(points if ccw else points[6:9] + points[3:6] + points[0:3])
+                triangle_colors.append(parse_color(fields[1]))
+            elif kind == "4" and len(fields) >= 14:
+                points = [float(value) for value in fields[2:14]]
+                quads.append(points if ccw else points[9:12] + points[6:9] + points[3:6] + points[0:3])
+                quad_colors.append(parse_color(fields[1]))
+            if kind in ("2", "3", "4", "5"):
+                invert_next = False  # only applies to the type 1 line after it
+
+    geometry = Geometry(
+        np.array(triangles, dtype=np.float64).reshape(-1, 3, 3),
+        np.array(triangle_colors, dtype=np.int32),
+        np.full(len(triangles), certified),
+        np.array(quads, dtype=np.float64).reshape(-1, 4, 3),
+        np.array(quad_colors, dtype=np.int32),
+        np.full(len(quads), certified))
+    return DatFile(geometry, references)
+
+# Color codes are numbers, or direct colors like 0x2FF0000
+def parse_color(value):
+    return int(value, 16) if value.lower().startswith("0x") else int(value)
+
+# Flattens parts into LDrawMesh arrays, without Blender
+#
+# Every file is parsed and flattened once in its own coordinates, a file used
+# many times (e.g. a stud) is copied into place with one matrix product.
+# Flattened parts are kept, up to max_parts of them. Parsed files and their
+# geometry are kept up to max_cache_bytes, the least recently used go first.
+class LDrawMeshes:
+    def __init__(self, ldraw_path="./ldraw", max_parts=256, assets=None, max_cache_bytes=256 * 1024 * 1024):
+        self.index = ldraw_index(ldraw_path)
+        self.max_parts = max_parts
+        self.assets = assets      # optional PartAssets, see part_assets.py
+        self.max_cache_bytes = max_cache_bytes
+        self.cache_bytes = 0
+        self.files = OrderedDict()       # path -> DatFile
+        self.geometries = OrderedDict()  # (path, high_res, logo_studs) -> Geometry
+        self.parts = OrderedDict()
+
+    # high_res uses the 48 segment primitives in p/48 where there are some,
+    # logo_studs the studs with a LEGO logo, like the importer's options
+    def mesh(self, ldraw_id, high_res=True, logo_studs=False):
+        key = (ldraw_id.lower(), high_res, logo_studs)
+        mesh = self.parts.get(key)
+        if mesh is None:
+            mesh = self.assets.load(ldraw_id, high_res, logo_studs) if self.assets else None
+            if mesh is None:
+                mesh = self.flatten(ldraw_id, high_res, logo_studs)
+                if self.assets:
+                    self.assets.save(ldraw_id, high_res, logo_studs, mesh, *self.dependencies(ldraw_id, high_res, logo_studs))
+            self.parts[key] = mesh
+            while len(self.parts) > self.max_parts:
+                self.parts.popitem(last=False)
+        self.parts.move_to_end(key)
+        return mesh
+
+    def flatten(self, ldraw_id, high_res=True, logo_studs=False):
+        path = self.index.part_path(ldraw_id)
+        if path is None:
+            raise FileNotFoundError(f"Part file not found: {ldraw_id}.dat")
+        mesh = to_mesh(self.geometry(path, high_res, logo_studs))
+        # Only subfiles are worth keeping as geometry, the part is kept as a mesh
+        geometry = self.geometries.pop((path, high_res, logo_studs), None)
+        if geometry is not None:
+            self.cache_bytes -= geometry.nbytes
+        self.trim()
+        return mesh
+
+    # Every file a part is built from, including its own
+    def sources(self, ldraw_id, high_res=True, logo_studs=False):
+        return self.dependencies(ldraw_id, high_res, logo_studs)[0]
+
+    # The files a part is built from and the references that didn't resolve:
+    # missing files, and the versions looked for before the one that was used
+    # (e.g. 48\stud.dat before stud.dat). The part is built differently
+    # once one of them is added to the library.
+    def dependencies(self, ldraw_id, high_res=True, logo_studs=False):
+        path = self.index.part_path(ldraw_id)
+        if path is None:
+            raise FileNotFoundError(f"Part file not found: {ldraw_id}.dat")
+        found = set()
+        unresolved = set()
+        todo = [path]
+        while todo:
+            path = todo.pop()
+            if path in found:
+                continue
+            found.add(path)
+            for color, matrix, filename, invert_next in self.dat_file(path).references:
+                child = self.resolve(filename, high_res, logo_studs, unresolved)
+                if child is not None:
+                    todo.append(child)
+        self.trim()
+        return sorted(found), sorted(unresolved)
+
+    def geometry(self, path, high_res, logo_studs, visiting=()):
+        key = (path, high_res, logo_studs)
+        if key in self.geometries:
+            self.geometries.move_to_end(key)
+            return self.geometries[key]
+        if path in visiting:
+            print(f"[LDRAW] WARNING: {path} references itself")
+            return self.dat_file(path).geometry
+
+        dat_file = self.dat_file(path)
+        geometries = [dat_file.geometry]
+        for color, matrix, filename, invert_next in dat_file.references:
+            child = self.resolve(filename, high_res, logo_studs)
+            if child is None:
+                print(f"[LDRAW] WARNING: {path} references missing file {filename}")
+                continue
+            # A mirroring matrix turns the faces inside out as well
+            inverted = invert_next != (np.linalg.det(matrix[:3, :3]) < 0)
+            geometries.append(self.geometry(child, high_res, logo_studs, (*visiting, path)).transformed(matrix, color, inverted))
+
+        geometry = Geometry.combine(geometries)
+        self.geometries[key] = geometry
+        self.cache_bytes += geometry.nbytes
+        return geometry
+
+    def dat_file(self, path):
+        dat_file = self.files.get(path)
+        if dat_file is None:
+            dat_file = parse_dat_file(path)
+            self.files[path] = dat_file
+            self.cache_bytes += dat_file.nbytes
+        else:
+            self.files.move_to_end(path)
+        return dat_file
+
+    # Called between parts, never while one is being flattened. Geometry
+    # goes before parsed files, it is the larger and can be rebuilt from them.
+    def trim(self):
+        while self.cache_bytes > self.max_cache_bytes and self.geometries:
+            self.cache_bytes -= self.geometries.popitem(last=False)[1].nbytes
+        while self.cache_bytes > self.max_cache_bytes and self.files:
+            self.cache_bytes -= self.files.popitem(last=False)[1].nbytes
+
+    # Candidates that aren't in the library are added to unresolved
+    def resolve(self, filename, high_res, logo_studs, unresolved=None):
+        candidates = [filename]
+        name = os.path.basename(filename.replace("\\", "/")).lower()
+        if logo_studs and STUD_PATTERN.match(name):
+            stem = name[:-4]
+            candidates = [f"{stem}-logo4.dat", f"{stem}-logo3.dat"] + candidates
+        if high_res:
+            candidates = [f"48\\{candidate}" for candidate in candidates] + candidates
+        for candidate in candidates:
+            path = self.index.resolve(candidate)
+            if path is not None:
+                return path
+            if unresolved is not None:
+                unresolved.add(candidate.lower().replace("\\", "/"))
+        return None
+
+# Studs that have a version with a logo, e.g. stud.dat and stud2.dat
+STUD_PATTERN = re.compile(r"^stud\d*\.dat$")
+
+# Welds the points of a Geometry into shared vertices
+def to_mesh(geometry):
+    triangles = geometry.triangles
+    quads = geometry.quads
+    points = np.concatenate((triangles.reshape(-1, 3), quads.reshape(-1, 3)))
+    if len(points) == 0:
+        return LDrawMesh(np.empty((0, 3), np.float32), np.empty(0, np.int32), np.empty(0, np.int32),
+                         np.empty(0, np.int32), np.empty(0, bool))
+
+    keys = np.round(points / WELD_PRECISION).astype(np.int64)
+    keys, first, inverse = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+    inverse = inverse.ravel()
+    vertices = (points[first] * SCALE).astype(np.float32)
+
+    triangle_indexes = inverse[:len(triangles) * 3].reshape(-1, 3)
+    quad_indexes = inverse[len(triangles) * 3:].reshape(-1, 4)
+
+    # Quads with two corners welded together become triangles
+    collapsed = ((quad_indexes[:, [0, 1, 2, 3]] == quad_indexes[:, [1, 2, 3, 0]]).any(axis=1) |
+                 (quad_indexes[:, 0] == quad_indexes[:, 2]) | (quad_indexes[:, 1] == quad_indexes[:, 3]))
+    split = quad_indexes[collapsed]
+    triangle_indexes = np.concatenate((triangle_indexes, split[:, [0, 1, 2]], split[:, [0, 2, 3]]))
+    triangle_colors = np.concatenate((geometry.triangle_colors, np.tile(geometry.quad_colors[collapsed], 2)))
+    triangle_certified = np.concatenate((geometry.triangle_certified, np.tile(geometry.quad_certified[collapsed], 2)))
+    quad_indexes = quad_indexes[~collapsed]
+    quad_colors = geometry.quad_colors[~collapsed]
+    quad_certified = geometry.quad_certified[~collapsed]
+
+    # Triangles that are a line or a point have no area
+    valid = ((triangle_indexes[:, 0] != triangle_indexes[:, 1]) &
+             (triangle_indexes[:, 1] != triangle_indexes[:, 2]) &
+             (triangle_indexes[:, 2] != triangle_indexes[:, 0]))
+    triangle_indexes = triangle_indexes[valid]
+
+    return LDrawMesh(
+        vertices,
+        np.concatenate((triangle_indexes.ravel(), quad_indexes.ravel())).astype(np.int32),
+        np.concatenate((np.full(len(triangle_indexes), 3), np.full(len(quad_indexes), 4))).astype(np.int32),
+        np.concatenate((triangle_colors[valid], quad_colors)).astype(np.int32),
+        np.concatenate((triangle_certified[valid], quad_certified)).astype(bool))
+
+# LDraw colors from LDConfig.ldr: code -> (red, green, blue, alpha), sRGB 0-1
+def ldraw_colors(ldraw_path="./ldraw"):
+    colors = {}
+    color_pattern = re.compile(r"CODE\s+(\d+)\s+VALUE\s+#([0-9A-Fa-f]{6})")
+    alpha_pattern = re.compile(r"ALPHA\s+(\d+)")
+    with open(os.path.join(ldraw_path, "LDConfig.ldr"), encoding="utf-8", errors="replace") as f:
+        for line in f:
+            match = color_pattern.search(line) if "!COLOUR" in line else None
+            if match:
+                alpha = alpha_pattern.search(line)
+                colors[int(match.group(1))] = hex_color(match.group(2), int(alpha.group(1)) / 255 if alpha else 1.0)
+    return colors
+
+def hex_color(value, alpha=1.0):
+    return (int(value[0:2], 16) / 255, int(value[2:4], 16) / 255, int(value[4:6], 16) / 255, alpha)
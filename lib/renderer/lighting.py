@@ -7,6 +7,7 @@ from lib.renderer.utils import rotate_around_z_origin, aim_towards_origin, set_h
 
 
 def setup_lighting(options):
+    clear_lighting()
     if options.lighting_style == LightingStyle.DEFAULT:
         default_lighting(options)
     if options.lighting_style == LightingStyle.BRIGHT:
@@ -14,6 +15,14 @@ def setup_lighting(options):
     elif options.lighting_style == LightingStyle.HARD:
         hard_lighting(options)
 
+# Remove lights from the previous render. The scene is reused between
+# renders so lights would otherwise pile up.
+def clear_lighting():
+    for obj in [obj for obj in bpy.data.objects if obj.type == 'LIGHT']:
+        bpy.data.objects.remove(obj, do_unlink=True)
+    for light in [light for light in bpy.data.lights if light.users == 0]:
+        bpy.data.lights.remove(light)
+
 def default_lighting(options):
     light_data = bpy.data.lights.new(name="KeyLight", type='AREA')
     light_data.energy = 300
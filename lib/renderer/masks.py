@@ -0,0 +1,191 @@
+import os
+import glob
+import bpy
+import numpy as np
+
+INDEX_NODE_NAME = "lego-rendering-object-index"
+
+# Labels from what is actually visible in the render
+#
+# Cycles can render an object index pass: for each pixel, the pass_index of
+# the object seen there. Each part of a render gets its own index, so the
+# pass gives a mask per part. Boxes from the masks are pixel exact and
+# leave out hidden parts of a part, unlike boxes from projected vertices, and
+# the mask outlines are used as YOLO segmentation polygons.
+#
+# The viewer node only shows one image, so the pass is written to an EXR
+# file by a File Output node and read back with Blender's image loader.
+def setup_index_pass(enabled, directory):
+    scene = bpy.context.scene
+    tree = scene.node_tree
+    bpy.context.view_layer.use_pass_object_index = enabled
+
+    node = tree.nodes.get(INDEX_NODE_NAME)
+    if node is None:
+        if not enabled:
+            return None
+        layers = next(node for node in tree.nodes if node.type == 'R_LAYERS')
+        node = tree.nodes.new('CompositorNodeOutputFile')
+        node.name = INDEX_NODE_NAME
+        node.format.file_format = 'OPEN_EXR'
+        node.format.color_mode = 'BW'
+        node.format.color_depth = '32'
+        node.file_slots[0].path = "index_"
+        socket = next(output for output in layers.outputs if output.name in ('IndexOB', 'Object Index'))
+        tree.links.new(socket, node.inputs[0])
+
+    node.base_path = os.path.abspath(directory)
+    node.mute = not enabled
+    return node
+
+# Give every object of each part the part's index, starting at 1. Everything
+# else (e.g. the ground) is 0.
+def set_pass_indexes(part_objects):
+    for obj in bpy.context.scene.objects:
+        obj.pass_index = 0
+    for i, objects in enumerate(part_objects):
+        for obj in objects:
+            obj.pass_index = i + 1
+
+# The object index pass of the last render as a (height, width) int array,
+# top row first
+def read_index_pass(directory):
+    filenames = glob.glob(os.path.join(os.path.abspath(directory), "index_*.exr"))
+    filename = max(filenames, key=os.path.getmtime)
+    image = bpy.data.images.load(filename)
+    try:
+        image.colorspace_settings.name = 'Non-Color'
+        width, height = image.size
+        pixels = np.empty(width * height * image.channels, dtype=np.float32)
+        image.pixels.foreach_get(pixels)
+    finally:
+        bpy.data.images.remove(image)
+        os.remove(filename)
+    index = pixels.reshape(height, width, -1)[::-1, :, 0]
+    return np.rint(index).astype(np.int32)
+
+# YOLO box [center_x, center_y, width, height] and polygon [x1, y1, x2, y2, ...]
+# of each part, normalized to 0-1. (None, None) for parts that aren't visible.
+def mask_labels(index, count, epsilon=1.0):
+    height, width = index.shape
+    labels = []
+    for i in range(1, count + 1):
+        mask = index == i
+        rows = np.flatnonzero(mask.any(axis=1))
+        cols = np.flatnonzero(mask.any(axis=0))
+        if len(rows) == 0:
+            labels.append((None, None))
+            continue
+
+        x1, x2 = cols[0], cols[-1] + 1
+        y1, y2 = rows[0], rows[-1] + 1
+        box = [(x1 + x2) / 2 / width, (y1 + y2) / 2 / height, (x2 - x1) / width, (y2 - y1) / height]
+
+        outline = simplify(trace_outline(largest_component(mask)), epsilon)
+        if len(outline) < 3:
+            # Too small for an outline, use the box
+            outline = np.array([(x1, y1), (x2, y1), (x2, y2), (x1, y2)], dtype=np.float64)
+        polygon = (outline / [width, height]).ravel().tolist()
+        labels.append((box, polygon))
+    return labels
+
+# The largest 8-connected region of a mask. Regions are found from the runs of
+# pixels in each row, which is quick enough without scipy.
+def largest_component(mask):
+    runs = []   # (row, start, end)
+    parent = []
+    previous = []  # indexes of the runs in the previous row
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for row in np.flatnonzero(mask.any(axis=1)):
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], mask[row].view(np.int8), [0]))))
+        current = []
+        for start, end in zip(edges[::2], edges[1::2]):
+            i = len(runs)
+            runs.append((row, start, end))
+            parent.append(i)
+            for j in previous:
+                _, other_start, other_end = runs[j]
+                # 8-connected: runs touch if they overlap or meet diagonally
+                if other_start <= end and start <= other_end and runs[j][0] == row - 1:
+                    parent[find(i)] = find(j)
+            current.append(i)
+        previous = current
+
+    sizes = {}
+    for i, (row, start, end) in enumerate(runs):
+        root = find(i)
+        sizes[root] = sizes.get(root, 0) + end - start
+    largest = max(sizes, key=sizes.get)
+
+    component = np.zeros_like(mask)
+    for i, (row, start, end) in enumerate(runs):
+        if find(i) == largest:
+            component[row, start:end] = True
+    return component
+
+# Moore neighbour tracing of the outer boundary of a region. Returns the
+# (x, y) centers of the boundary pixels, clockwise, as an (n, 2) array.
+NEIGHBOURS = [(-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1), (-1, -1)]  # (dy, dx) clockwise from up
+
+def trace_outline(mask):
+    padded = np.pad(mask, 1)
+    ys, xs = np.nonzero(padded)
+    start = (int(ys[0]), int(xs[0]))  # top row, leftmost pixel
+    boundary = [start]
+    current = start
+    direction = 6  # nothing to the left or above, start searching left
+    second = None
+    while True:
+        for k in range(8):
+            d = (direction + k) % 8
+            neighbour = (current[0] + NEIGHBOURS[d][0], current[1] + NEIGHBOURS[d][1])
+            if padded[neighbour]:
+                break
+        else:
+            break  # a single pixel
+
+        # Done when leaving the start the same way as the first time
+        if current == start:
+            if second == neighbour:
+                break
+            second = second or neighbour
+        if neighbour != start:
+            boundary.append(neighbour)
+        current = neighbour
+        # Search from the neighbour after the one we came from
+        direction = (d + 5) % 8
+
+    points = np.array(boundary, dtype=np.float64)[:, ::-1] - 1  # (x, y) without the padding
+    return points + 0.5  # pixel centers
+
+# Ramer-Douglas-Peucker simplification, epsilon in pixels
+def simplify(points, epsilon):
+    if len(points) < 3:
+        return points
+    keep = np.zeros(len(points), dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        segment = points[last] - points[first]
+        length = np.hypot(segment[0], segment[1])
+        offsets = points[first + 1:last] - points[first]
+        if length == 0:
+            distances = np.hypot(offsets[:, 0], offsets[:, 1])
+        else:
+            distances = np.abs(segment[0] * offsets[:, 1] - segment[1] * offsets[:, 0]) / length
+        i = int(np.argmax(distances))
+        if distances[i] > epsilon:
+            middle = first + 1 + i
+            keep[middle] = True
+            stack.append((first, middle))
+            stack.append((middle, last))
+    return points[keep]
@@ -0,0 +1,102 @@
+import bpy
+from lib.renderer.utils import set_material_color
+from lib.renderer.render_options import Material
+
+# Materials shared by every part, one per (Material, look, slope)
+#
+# The importer creates a new node tree for every color it sees. Instead, the
+# materials it creates for the placeholder color are adopted the first time
+# a combination is imported and then reused by every part. Changing the part
+# color only changes the inputs of these materials.
+#
+# Parts rendered together in a scene each need their own color, so the nth
+# part of a scene uses a copy of the shared material (its variant).
+#
+# Slopes (e.g. 3039) get a separate textured material for the sloped faces.
+# Parts with printed or hinged sections in fixed colors (e.g. 73587p01) keep
+# the importer's materials for those sections.
+class MaterialOverrides:
+    def __init__(self, placeholder_color_code):
+        self.placeholder = str(placeholder_color_code)
+        self.materials = {}
+
+    @staticmethod
+    def key(options, slope, variant=0):
+        return (options.material, options.look, slope, variant)
+
+    # Are all the materials needed to render this part with these options available?
+    def has(self, cached, options):
+        return all(self.key(options, slope) in self.materials for (_, _, slope) in cached.color_slots)
+
+    # Replace the placeholder color materials of a newly imported part with the
+    # shared materials. Returns the slots that take the part color.
+    def adopt(self, objects, options):
+        found = []
+        for obj in objects:
+            for index, slot in enumerate(obj.material_slots):
+                if slot.material is not None and self.placeholder in slot.material.name:
+                    found.append((obj, index, slot.material))
+
+        slots = []
+        replaced = set()
+        for obj, index, material in found:
+            slope = is_slope_material(material)
+            key = self.key(options, slope)
+            if key not in self.materials:
+                self.register(key, material)
+            elif self.materials[key] != material:
+                obj.material_slots[index].material = self.materials[key]
+                replaced.add(material)
+            slots.append((obj, index, slope))
+
+        for material in replaced:
+            if material.users == 0:
+                bpy.data.materials.remove(material)
+
+        return slots
+
+    # Share a material for a key, e.g. one of our own for parts built
+    # without the importer
+    def register(self, key, material):
+        material.name = override_name(key)
+        material.use_fake_user = True  # keep it when the last part using it is evicted
+        self.materials[key] = material
+        return material
+
+    # Point the part at the materials for these options and set the color
+    def apply(self, cached, options, color, variant=0):
+        used = set()
+        for obj, index, slope in cached.color_slots:
+            key = self.key(options, slope, variant)
+            material = self.variant(key)
+            if obj.material_slots[index].material != material:
+                obj.material_slots[index].material = material
+            used.add(key)
+
+        alpha = 0.5 if options.material == Material.TRANSPARENT else 1.0
+        for key in used:
+            set_material_color(self.materials[key], color, alpha)
+            # Used by the workbench engine instead of the node tree
+            self.materials[key].diffuse_color = (color[0], color[1], color[2], alpha)
+
+
+    def variant(self, key):
+        if key not in self.materials:
+            material = self.materials[key[:-1] + (0,)].copy()
+            material.name = override_name(key)
+            material.use_fake_user = True
+            self.materials[key] = material
+        return self.materials[key]
+
+# The importer names the material for sloped faces with a _s suffix
+def is_slope_material(material):
+    return material.name.split('.')[0].endswith('_s')
+
+def override_name(key):
+    material, look, slope, variant = key
+    # Some scripts pass the material straight from a CSV file as a string
+    material = getattr(material, 'value', material)
+    name = f"lego-rendering-{material}-{look.value}"
+    if slope:
+        name = f"{name}-slope"
+    return f"{name}-{variant}" if variant else name
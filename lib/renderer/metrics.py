@@ -0,0 +1,136 @@
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Optional timing of each stage of a render
+#
+# When a filename is given, one JSON line is appended per render with the wall
+# time of each stage (import, grounding, framing, render, label, ...), the
+# process' resident memory after each stage and its peak during the stage.
+# Use summarize-metrics.py to aggregate.
+#
+# Stages can be nested (flatten runs inside load_part). The peak is reset
+# whenever a stage starts or ends, and each reading is counted towards every
+# stage that is open at the time.
+class RenderMetrics:
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.record = None
+        self.peaks = []  # peak so far of the render and of each open stage, innermost last
+
+    @property
+    def enabled(self):
+        return self.filename is not None
+
+    def start(self, ldraw_part_id, options):
+        if not self.enabled:
+            return
+        self.record = {
+            "time": time.time(),
+            "part": ldraw_part_id,
+            "quality": options.quality.value,
+            "material": getattr(options.material, 'value', options.material),
+            "look": options.look.value,
+            "background": options.background_type.value,
+            "width": options.width,
+            "height": options.height,
+            "render_width": options.render_width,
+            "render_height": options.render_height,
+            "stages": {},
+        }
+        self.started = time.perf_counter()
+        self.rss_started = rss_mb()
+        reset_peak_rss()
+        self.peaks = [None]
+
+    # Extra information about the render, e.g. whether the part was cached
+    def note(self, key, value):
+        if self.record is not None:
+            self.record[key] = value
+
+    @contextmanager
+    def stage(self, name):
+        if self.record is None:
+            yield
+            return
+        start = time.perf_counter()
+        self.take_peak()
+        self.peaks.append(None)
+        try:
+            yield
+        finally:
+            self.take_peak()
+            self.record["stages"][name] = {
+                "seconds": time.perf_counter() - start,
+                "rss_mb": rss_mb(),
+                "peak_rss_mb": self.peaks.pop(),
+            }
+
+    # Count the peak since the last reset towards the render and every open
+    # stage, and start measuring again
+    def take_peak(self):
+        peak = peak_rss_mb()
+        reset_peak_rss()
+        if peak is not None:
+            self.peaks = [peak if current is None else max(current, peak) for current in self.peaks]
+
+    def finish(self):
+        if self.record is None:
+            return
+        self.record["seconds"] = time.perf_counter() - self.started
+        self.take_peak()
+        self.record["rss_mb"] = rss_mb()
+        self.record["rss_delta_mb"] = rss_delta(self.rss_started, self.record["rss_mb"])
+        self.record["peak_rss_mb"] = self.peaks.pop()
+        os.makedirs(os.path.dirname(os.path.abspath(self.filename)), exist_ok=True)
+        with open(self.filename, "a") as f:
+            f.write(json.dumps(self.record) + "\n")
+        self.record = None
+
+
+# Resident memory of this process right now. None where there is no /proc
+# (macOS, Windows).
+def rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return pages * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+
+def rss_delta(before, after):
+    return None if before is None or after is None else after - before
+
+# Start measuring the peak resident memory again. Linux resets the process'
+# high-water mark when 5 is written to clear_refs. Returns False where it
+# can't be reset.
+def reset_peak_rss():
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+# Peak resident memory since reset_peak_rss (VmHWM). Without /proc it falls
+# back to getrusage, which is the peak over the life of the process and only
+# tells which stage first reached it.
+def peak_rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024  # bytes on macOS, KB on Linux
@@ -0,0 +1,126 @@
+import bpy
+import bmesh
+import numpy as np
+
+from lib.renderer.ldraw_mesh import MAIN_COLOR, SCALE, hex_color
+from lib.renderer.render_options import Material
+
+GROUND_NAME = "LegoGroundPlane"  # same name as the importer's, see Renderer.set_background
+GROUND_SIZE = 10000 * SCALE      # wide enough to fill the frame at every camera height
+
+# Build a part from an LDrawMesh without the importer
+#
+# The mesh is filled straight from the arrays with foreach_set. Like an
+# import, the part is a mesh object under an empty root. main_material is
+# used for the part color (MAIN_COLOR) faces, other colors get a plain
+# material each, see fixed_material. Returns (root, part, index of the part
+# color slot or None).
+def build_part(name, mesh, main_material, colors):
+    data = bpy.data.meshes.new(name)
+    data.vertices.add(len(mesh.vertices))
+    data.vertices.foreach_set("co", mesh.vertices.ravel())
+    data.loops.add(len(mesh.face_vertices))
+    data.loops.foreach_set("vertex_index", mesh.face_vertices)
+    data.polygons.add(len(mesh.face_sizes))
+    data.polygons.foreach_set("loop_start", mesh.loop_starts)
+    try:
+        data.polygons.foreach_set("loop_total", mesh.face_sizes)
+    except (AttributeError, TypeError, RuntimeError):
+        pass  # read only since Blender 4.0, worked out from loop_start
+
+    codes = np.unique(mesh.face_colors)
+    main_slot = None
+    for slot, code in enumerate(codes):
+        if code == MAIN_COLOR:
+            main_slot = slot
+            data.materials.append(main_material)
+        else:
+            data.materials.append(fixed_material(int(code), colors))
+    data.polygons.foreach_set("material_index", np.searchsorted(codes, mesh.face_colors).astype(np.int32))
+    data.update(calc_edges=True)
+
+    if not mesh.face_certified.all():
+        recalculate_normals(data, np.flatnonzero(~mesh.face_certified))
+
+    part = bpy.data.objects.new(name, data)
+    root = bpy.data.objects.new(f"{name}_root", None)
+    collection = bpy.context.scene.collection
+    collection.objects.link(root)
+    collection.objects.link(part)
+    part.parent = root
+    return root, part, main_slot
+
+# Faces from files without BFC may face inwards. Point them outwards like
+# their certified neighbours.
+def recalculate_normals(data, face_indexes):
+    bm = bmesh.new()
+    bm.from_mesh(data)
+    bm.faces.ensure_lookup_table()
+    bmesh.ops.recalc_face_normals(bm, faces=[bm.faces[i] for i in face_indexes])
+    bm.to_mesh(data)
+    bm.free()
+
+# A material for a fixed LDraw color, e.g. the black tyre of a wheel. Looked
+# up by name so it survives clear_scene removing every material.
+def fixed_material(code, colors):
+    name = f"lego-rendering-ldraw-{code}"
+    material = bpy.data.materials.get(name)
+    if material is None:
+        if code >= 0x2000000:
+            color = hex_color(f"{code & 0xFFFFFF:06X}")  # direct color
+        else:
+            color = colors.get(code, (0.5, 0.5, 0.5, 1.0))
+        material = new_material(name, srgb_to_linear(color[:3]), roughness=0.3, transmission=1.0 if color[3] < 1 else 0.0)
+    return material
+
+# Our own material for the part color, shared like the ones adopted from the
+# importer (see MaterialOverrides). The color is set for each render.
+def part_material(options):
+    name = f"lego-rendering-{options.material.value}"
+    if options.material == Material.TRANSPARENT:
+        return new_material(name, (1.0, 1.0, 1.0), roughness=0.05, transmission=1.0)
+    return new_material(name, (1.0, 1.0, 1.0), roughness=0.7 if options.material == Material.RUBBER else 0.25)
+
+def new_material(name, linear_color, roughness, transmission=0.0):
+    material = bpy.data.materials.new(name)
+    material.use_nodes = True
+    bsdf = next(node for node in material.node_tree.nodes if node.type == 'BSDF_PRINCIPLED')
+    bsdf.inputs['Base Color'].default_value = (*linear_color, 1.0)
+    bsdf.inputs['Roughness'].default_value = roughness
+    if transmission:
+        # Renamed in Blender 4.0
+        name = 'Transmission Weight' if 'Transmission Weight' in bsdf.inputs else 'Transmission'
+        bsdf.inputs[name].default_value = transmission
+        bsdf.inputs['IOR'].default_value = 1.55
+    material.diffuse_color = (*linear_color, 1.0)
+    return material
+
+# The ground plane the importer adds, for scenes with no imported parts
+def ensure_ground_plane():
+    ground = bpy.data.objects.get(GROUND_NAME)
+    if ground is not None:
+        return ground
+
+    half = GROUND_SIZE / 2
+    data = bpy.data.meshes.new(GROUND_NAME)
+    data.vertices.add(4)
+    data.vertices.foreach_set("co", [-half, -half, 0, half, -half, 0, half, half, 0, -half, half, 0])
+    data.loops.add(4)
+    data.loops.foreach_set("vertex_index", [0, 1, 2, 3])
+    data.polygons.add(1)
+    data.polygons.foreach_set("loop_start", [0])
+    try:
+        data.polygons.foreach_set("loop_total", [4])
+    except (AttributeError, TypeError, RuntimeError):
+        pass
+    data.update(calc_edges=True)
+    uv = data.uv_layers.new()
+    uv.data.foreach_set("uv", [0, 0, 1, 0, 1, 1, 0, 1])  # background images are mapped with UVs
+    data.materials.append(new_material(GROUND_NAME, (0.8, 0.8, 0.8), roughness=0.9))
+
+    ground = bpy.data.objects.new(GROUND_NAME, data)
+    bpy.context.scene.collection.objects.link(ground)
+    return ground
+
+def srgb_to_linear(color):
+    return tuple(c / 12.92 if c <= 0.04045 else ((c + 0.055) / 1.055) ** 2.4 for c in color)
@@ -0,0 +1,99 @@
+import os
+import copy
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+from PIL import Image
+
+from lib.renderer.render_options import Format, image_filename_for_format
+from lib.renderer.render_buffer import to_pil_image
+from lib.renderer.compositing import composite, composite_filename
+from lib.file_utils import temporary_filename
+from lib.annotation_writer import write_labels_file, write_segmentation_file
+
+# Encode and write rendered images on background threads
+#
+# Blender can set up and render the next image while the previous one is
+# resized, encoded and written. At most max_pending images wait to be written,
+# after that submit blocks so memory stays bounded. With threads=0 everything
+# is written before submit returns.
+class OutputPipeline:
+    def __init__(self, threads=0, max_pending=8):
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="lego-output") if threads > 0 else None
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.pending = set()
+        self.lock = threading.Lock()
+
+    # Run fn(*args) on a background thread. Returns a Future that raises
+    # any error from writing. Without threads errors are raised here.
+    def submit(self, fn, *args):
+        if self.executor is None:
+            future = Future()
+            future.set_result(fn(*args))
+            return future
+
+        self.slots.acquire()
+        future = self.executor.submit(fn, *args)
+        with self.lock:
+            self.pending.add(future)
+        future.add_done_callback(self.done)
+        return future
+
+    def done(self, future):
+        with self.lock:
+            self.pending.discard(future)
+        self.slots.release()
+        if future.exception() is not None:
+            print(f"------ ERROR: failed to write render output: {future.exception()}")
+
+    # Wait for everything submitted so far to be written
+    def wait(self):
+        with self.lock:
+            pending = list(self.pending)
+        for future in pending:
+            future.exception()
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+
+
+# Resize, encode and write one render, its labels, a list of
+# (class_id, yolo bounding box), and its segments, a list of
+# (class_id, polygon). Runs on a background thread.
+def write_output(pixels, options, labels=None, segments=None):
+    image = to_pil_image(pixels, options.format.value)
+    if image.size != (options.width, options.height):
+        image.thumbnail((options.width, options.height), Image.LANCZOS)
+    save_image(image, options.image_filename, options)
+
+    if options.label_filename and labels is not None:
+        write_labels_file(options.label_filename, labels)
+    if options.segmentation_filename and segments is not None:
+        write_segmentation_file(options.segmentation_filename, segments)
+
+# Composite a transparent render onto composite_count backgrounds and write
+# each one with the same label. See compositing.py
+def write_composites(pixels, options, labels, segments, backgrounds):
+    height, width = pixels.shape[:2]
+    for i, background in enumerate(backgrounds.choose(options.composite_count, width, height)):
+        composite_options = copy.copy(options)
+        composite_options.image_filename = composite_filename(options.image_filename, i)
+        if options.label_filename:
+            composite_options.label_filename = composite_filename(options.label_filename, i)
+        if options.segmentation_filename:
+            composite_options.segmentation_filename = composite_filename(options.segmentation_filename, i)
+        write_output(composite(pixels, background), composite_options, labels, segments)
+
+# Write then rename so an image is never partially written. The extension
+# is corrected to options.format, so a .png name with JPEG is saved as .jpg
+def save_image(image, filename, options):
+    filename = image_filename_for_format(filename, options.format)
+    os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+    temp_filename = temporary_filename(filename)
+    if options.format == Format.JPEG:
+        image.convert('RGB').save(temp_filename, format='JPEG', quality=options.jpeg_quality)
+    elif options.format == Format.WEBP:
+        image.save(temp_filename, format='WEBP', quality=options.webp_quality, lossless=options.webp_quality >= 100)
+    else:
+        image.save(temp_filename, format='PNG', compress_level=options.png_compress_level)
+    os.replace(temp_filename, filename)
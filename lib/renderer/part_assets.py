@@ -0,0 +1,132 @@
+import os
+import hashlib
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from lib.renderer.dat import ldraw_index
+from lib.renderer.ldraw_mesh import LDrawMesh, LDrawMeshes
+
+# Bumped when the arrays in an asset change meaning, older assets are rebuilt
+ASSET_VERSION = 2
+
+# Flattened parts saved as .npz files, so a new worker doesn't parse and
+# flatten every part again
+#
+# Assets are keyed by part id, primitive resolution and logo studs. Each one
+# keeps the SHA-1 of every .dat file it was built from (paths relative to the
+# library, so the directory can be copied to other machines) and is rebuilt
+# when one of them changes. The files' sizes and modification times are kept
+# too, a file is only hashed again when they differ. References that didn't
+# resolve when the asset was built are kept as well, the asset is rebuilt
+# once one of them is in the library. Built up front by build-part-assets.py,
+# or as parts are first flattened.
+class PartAssets:
+    def __init__(self, directory="./cache/part-assets", ldraw_path="./ldraw"):
+        self.directory = directory
+        self.ldraw_path = os.path.abspath(ldraw_path)
+
+    def filename(self, ldraw_id, high_res, logo_studs):
+        name = ldraw_id.lower().replace("/", "__").replace("\\", "__")
+        return os.path.join(self.directory, f"{name}-{'high' if high_res else 'standard'}{'-logo' if logo_studs else ''}.npz")
+
+    # The part's LDrawMesh, or None if there is no asset or it is out of date
+    def load(self, ldraw_id, high_res, logo_studs):
+        filename = self.filename(ldraw_id, high_res, logo_studs)
+        if not os.path.exists(filename):
+            return None
+        try:
+            with np.load(filename, allow_pickle=False) as data:
+                if int(data["version"]) != ASSET_VERSION:
+                    return None
+                if not self.is_current(data["sources"], data["hashes"], zip(data["sizes"], data["mtimes"]), data["unresolved"]):
+                    return None
+                return LDrawMesh(data["vertices"], data["face_vertices"], data["face_sizes"], data["face_colors"], data["face_certified"])
+        except (OSError, ValueError, KeyError) as e:
+            print(f"[ASSETS] WARNING: can't read {filename}: {e}")
+            return None
+
+    # sources are the absolute paths of the files the mesh was built from,
+    # unresolved the references that weren't found (see LDrawMeshes.dependencies)
+    def save(self, ldraw_id, high_res, logo_studs, mesh, sources, unresolved=()):
+        os.makedirs(self.directory, exist_ok=True)
+        filename = self.filename(ldraw_id, high_res, logo_studs)
+        temp_filename = f"{filename[:-4]}.tmp{os.getpid()}.npz"
+        stats = [os.stat(path) for path in sources]
+        np.savez(temp_filename,
+            version=ASSET_VERSION,
+            sources=np.array([os.path.relpath(path, self.ldraw_path) for path in sources]),
+            hashes=np.array([file_hash(path) for path in sources]),
+            sizes=np.array([stat.st_size for stat in stats], dtype=np.int64),
+            mtimes=np.array([stat.st_mtime_ns for stat in stats], dtype=np.int64),
+            unresolved=np.array(list(unresolved), dtype=str),
+            vertices=mesh.vertices,
+            face_vertices=mesh.face_vertices,
+            face_sizes=mesh.face_sizes,
+            face_colors=mesh.face_colors,
+            face_certified=mesh.face_certified)
+        os.replace(temp_filename, filename)
+
+    # stats are the saved (size, modification time) of each source, or None
+    # to hash every source
+    def is_current(self, sources, hashes, stats=None, unresolved=()):
+        index = ldraw_index(self.ldraw_path)
+        if any(index.resolve(str(reference)) is not None for reference in unresolved):
+            return False
+        stats = stats if stats is not None else [(None, None)] * len(sources)
+        for source, saved, (size, mtime) in zip(sources, hashes, stats):
+            path = os.path.join(self.ldraw_path, str(source))
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return False
+            if stat.st_size == size and stat.st_mtime_ns == mtime:
+                continue
+            if file_hash(path) != saved:
+                return False
+        return True
+
+# SHA-1 of a file's contents. Primitives are shared by most parts, so hashes
+# are kept for as long as the file's size and modification time don't change.
+# One entry per path, at most one per file in the library.
+file_hashes = {}  # path -> (size, modification time, SHA-1)
+
+def file_hash(path):
+    stat = os.stat(path)
+    size, mtime, digest = file_hashes.get(path, (None, None, None))
+    if size != stat.st_size or mtime != stat.st_mtime_ns:
+        with open(path, "rb") as f:
+            digest = hashlib.sha1(f.read()).hexdigest()
+        file_hashes[path] = (stat.st_size, stat.st_mtime_ns, digest)
+    return digest
+
+# Build the assets of many parts in a process pool. variants are
+# (high_res, logo_studs) pairs. Returns the number of assets built, parts
+# with an up to date asset are skipped.
+def build_part_assets(ldraw_ids, variants, ldraw_path="./ldraw", directory="./cache/part-assets", processes=None, chunk_size=100):
+    chunks = [ldraw_ids[i:i + chunk_size] for i in range(0, len(ldraw_ids), chunk_size)]
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context("fork" if "fork" in methods else None)
+    built = 0
+    with ProcessPoolExecutor(max_workers=processes, mp_context=context) as executor:
+        for count in executor.map(build_chunk, chunks, [variants] * len(chunks), [ldraw_path] * len(chunks), [directory] * len(chunks)):
+            built += count
+    return built
+
+# Runs in a worker process. Subfiles shared by the parts of a chunk are only
+# flattened once.
+def build_chunk(ldraw_ids, variants, ldraw_path, directory):
+    assets = PartAssets(directory, ldraw_path)
+    meshes = LDrawMeshes(ldraw_path, max_parts=0)
+    built = 0
+    for ldraw_id in ldraw_ids:
+        for high_res, logo_studs in variants:
+            if assets.load(ldraw_id, high_res, logo_studs) is not None:
+                continue
+            try:
+                mesh = meshes.flatten(ldraw_id, high_res, logo_studs)
+                assets.save(ldraw_id, high_res, logo_studs, mesh, *meshes.dependencies(ldraw_id, high_res, logo_studs))
+                built += 1
+            except (FileNotFoundError, OSError, ValueError) as e:
+                print(f"[ASSETS] WARNING: {ldraw_id}: {e}")
+    return built
@@ -0,0 +1,147 @@
+import bpy
+from collections import OrderedDict
+
+# Rough per-element sizes in bytes used to estimate how much memory
+# a mesh uses. These don't need to be exact, they are only used to
+# decide when to evict parts from the cache.
+VERTEX_BYTES = 32
+EDGE_BYTES = 8
+LOOP_BYTES = 24
+POLYGON_BYTES = 16
+
+# A part hierarchy imported into the scene
+#
+# The importer creates a root object with the part as its only child. The
+# part may have children of its own (e.g. sub-parts). The whole hierarchy
+# stays in the scene between renders and is hidden when not in use.
+class CachedPart:
+    def __init__(self, key, root, part, color_slots=()):
+        self.key = key
+        self.root = root
+        self.part = part
+        self.color_slots = list(color_slots)  # (object, slot index, slope) that take the part color
+        self.home = tuple(root.location)  # where the importer put it, scenes move it
+        self.size = estimate_size(self.objects)
+
+    @property
+    def objects(self):
+        return hierarchy(self.root)
+
+    def show(self):
+        set_visible(self.objects, True)
+
+    def hide(self):
+        set_visible(self.objects, False)
+
+    # A copy of the hierarchy with its own meshes, so a scene can show the
+    # same part twice in different colors
+    def copy(self, key):
+        copies = {}
+        for obj in self.objects:
+            new = obj.copy()
+            if obj.data is not None:
+                new.data = obj.data.copy()
+            for collection in obj.users_collection:
+                collection.objects.link(new)
+            copies[obj] = new
+        for obj, new in copies.items():
+            if obj.parent in copies:
+                new.parent = copies[obj.parent]
+        color_slots = [(copies[obj], index, slope) for obj, index, slope in self.color_slots]
+        return CachedPart(key, copies[self.root], copies[self.part], color_slots)
+
+    def remove(self):
+        objects = self.objects
+        meshes = {obj.data for obj in objects if obj.type == 'MESH'}
+        materials = {slot.material for obj in objects for slot in obj.material_slots if slot.material}
+
+        # Children first so parents are never removed out from under them
+        for obj in reversed(objects):
+            bpy.data.objects.remove(obj, do_unlink=True)
+
+        # Mesh data and materials can be shared between parts, only
+        # remove them once nothing else uses them. Shared color materials
+        # have a fake user so they are kept.
+        for mesh in meshes:
+            if mesh.users == 0:
+                bpy.data.meshes.remove(mesh)
+        for material in materials:
+            if material.users == 0:
+                bpy.data.materials.remove(material)
+
+# Imported parts, reused across renders
+#
+# Parts are keyed by everything that changes the imported geometry. Placement,
+# rotation and color are set on each render so they are not part of the key.
+# Scenes with the same part more than once use a copy per instance.
+# When the estimated mesh memory goes over max_bytes the least recently used
+# parts are removed from the scene.
+class PartCache:
+    def __init__(self, max_bytes=512 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.parts = OrderedDict()
+
+    @staticmethod
+    def key(ldraw_part_id, options, instance=0):
+        return (ldraw_part_id, options.res_prisms, options.use_logo_studs, options.look, instance)
+
+    @property
+    def size(self):
+        return sum(part.size for part in self.parts.values())
+
+    def get(self, key):
+        part = self.parts.get(key)
+        if part is not None:
+            self.parts.move_to_end(key)
+        return part
+
+    # Parts in keep (e.g. the rest of a scene) are never evicted
+    def add(self, part, keep=()):
+        self.parts[part.key] = part
+        self.parts.move_to_end(part.key)
+        self.evict(keep={part.key, *keep})
+
+    def remove(self, key):
+        part = self.parts.pop(key, None)
+        if part is not None:
+            part.remove()
+
+    def hide_all(self):
+        for part in self.parts.values():
+            part.hide()
+
+    def clear(self):
+        for key in list(self.parts.keys()):
+            self.remove(key)
+
+    # Remove least recently used parts until we are under the memory limit
+    def evict(self, keep=()):
+        for key in list(self.parts.keys()):
+            if self.size <= self.max_bytes:
+                break
+            if key in keep:
+                continue
+            print(f"[CACHE] Evicting {key[0]} ({self.parts[key].size / 1024 / 1024:.1f} MB)")
+            self.remove(key)
+
+
+def hierarchy(obj):
+    objects = [obj]
+    for child in obj.children:
+        objects.extend(hierarchy(child))
+    return objects
+
+def set_visible(objects, visible):
+    for obj in objects:
+        obj.hide_viewport = not visible
+        obj.hide_render = not visible
+
+def estimate_size(objects):
+    meshes = {obj.data for obj in objects if obj.type == 'MESH'}
+    return sum(
+        len(mesh.vertices) * VERTEX_BYTES +
+        len(mesh.edges) * EDGE_BYTES +
+        len(mesh.loops) * LOOP_BYTES +
+        len(mesh.polygons) * POLYGON_BYTES
+        for mesh in meshes
+    )
@@ -0,0 +1,67 @@
+import bpy
+import numpy as np
+from PIL import Image
+
+VIEWER_NODE_NAME = "lego-rendering-viewer"
+
+# Read the rendered image straight from Blender instead of from a file
+#
+# Blender doesn't expose the pixels of the render result, but it does for
+# the compositor's viewer node. A viewer node is added alongside whatever
+# feeds the composite output so the final image is unchanged.
+def setup_viewer():
+    scene = bpy.context.scene
+    scene.use_nodes = True
+    scene.render.use_compositing = True
+    tree = scene.node_tree
+    if VIEWER_NODE_NAME in tree.nodes:
+        return tree.nodes[VIEWER_NODE_NAME]
+
+    layers = next((node for node in tree.nodes if node.type == 'R_LAYERS'), None)
+    if layers is None:
+        layers = tree.nodes.new('CompositorNodeRLayers')
+    composite = next((node for node in tree.nodes if node.type == 'COMPOSITE'), None)
+    if composite is None:
+        composite = tree.nodes.new('CompositorNodeComposite')
+        tree.links.new(layers.outputs['Image'], composite.inputs['Image'])
+
+    image_input = composite.inputs['Image']
+    source = image_input.links[0].from_socket if image_input.is_linked else layers.outputs['Image']
+
+    viewer = tree.nodes.new('CompositorNodeViewer')
+    viewer.name = VIEWER_NODE_NAME
+    viewer.use_alpha = True
+    tree.links.new(source, viewer.inputs['Image'])
+    return viewer
+
+# The last render as a (height, width, 4) float array, top row first, in
+# linear color with premultiplied alpha
+def read_render_pixels():
+    image = bpy.data.images['Viewer Node']
+    width, height = image.size
+    pixels = np.empty(width * height * 4, dtype=np.float32)
+    image.pixels.foreach_get(pixels)
+    return pixels.reshape(height, width, 4)[::-1]
+
+# Convert linear pixels to an 8-bit PIL image, matching what Blender writes
+# with the Standard view transform
+def to_pil_image(pixels, format):
+    rgb = pixels[:, :, :3]
+    alpha = pixels[:, :, 3:4]
+
+    if format == 'JPEG':
+        # Blender drops alpha, leaving transparent areas black
+        mode = 'RGB'
+        channels = linear_to_srgb(rgb)
+    else:
+        # PNG stores straight alpha
+        mode = 'RGBA'
+        straight = np.divide(rgb, alpha, out=np.zeros_like(rgb), where=alpha > 0)
+        channels = np.concatenate([linear_to_srgb(straight), np.clip(alpha, 0, 1)], axis=2)
+
+    data = np.round(channels * 255).astype(np.uint8)
+    return Image.fromarray(np.ascontiguousarray(data), mode)
+
+def linear_to_srgb(c):
+    c = np.clip(c, 0, 1)
+    return np.where(c < 0.0031308, c * 12.92, 1.055 * np.power(c, 1 / 2.4) - 0.055)
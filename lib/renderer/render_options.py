@@ -1,3 +1,4 @@
+import os
 from enum import Enum
 from math import radians
 
@@ -5,6 +6,8 @@ class Quality(Enum):
     HIGH = 'high'
     NORMAL = 'normal'
     DRAFT = 'draft'
+    ADAPTIVE = 'adaptive'              # normal geometry, stops sampling once the noise is low enough, denoised
+    ADAPTIVE_DRAFT = 'adaptive-draft'  # draft geometry, stops sampling sooner, denoised
 
 class LightingStyle(Enum):
     DEFAULT = 'default'
@@ -25,17 +28,47 @@ class BackgroundType(Enum):
     TRANSPARENT = 'transparent'
     GENERATED = 'generated'
     IMAGE = 'image'
+    COMPOSITED = 'composited'  # rendered once with shadows on transparent, composited onto composite_count backgrounds
+
+class Engine(Enum):
+    CYCLES = 'cycles'        # path traced, realistic
+    EEVEE = 'eevee'          # rasterized, keeps the instructions look's outlines (Freestyle)
+    WORKBENCH = 'workbench'  # flat shaded with outlines, fastest, for line art thumbnails
 
 class Format(Enum):
     PNG = 'PNG'
     JPEG = 'JPEG'
+    WEBP = 'WEBP'
+
+# Extensions accepted for each format, the first one is added when a
+# filename has none of them
+FORMAT_EXTENSIONS = {
+    Format.PNG: ('.png',),
+    Format.JPEG: ('.jpg', '.jpeg'),
+    Format.WEBP: ('.webp',),
+}
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp', '.bmp', '.tif', '.tiff', '.exr', '.tga')
+
+# Give filename the extension of format like Blender's write_still did: a
+# matching extension is kept, another image extension is replaced and
+# anything else gets the extension added
+def image_filename_for_format(filename, format):
+    base, ext = os.path.splitext(filename)
+    if ext.lower() in FORMAT_EXTENSIONS[format]:
+        return filename
+    if ext.lower() not in IMAGE_EXTENSIONS:
+        base = filename
+    return base + FORMAT_EXTENSIONS[format][0]
 
 class RenderOptions:
     def __init__(self,
                  image_filename = "renders/test.png",  # output filename
                  label_filename = None,  # optionally, output the bounding box in YOLO format
                  part_class_id = 0,
-                 background_type = BackgroundType.WHITE,
+                 mask_labels = False,  # boxes from the visible pixels of each part instead of its projected vertices (cycles only)
+                 segmentation_filename = None,  # optionally, output the outline of each part in YOLO segmentation format (cycles only)
+                 background_type = BackgroundType.WHITE,  # image uses lib/backgrounds, generated draws random shapes
+                 composite_count = 4,  # images per render with BackgroundType.COMPOSITED
                  width = 640,  # standard yolo size
                  height = 640,  # standard yolo size
                  quality = Quality.NORMAL,  # trade between speed and quality
@@ -49,14 +82,22 @@ class RenderOptions:
                  zoom = 1.0,  # 1.0 for part to fill frame, < 1.0 to zoom out, > 1.0 to zoom in
                  look = Look.NORMAL,  # normal (realistic) or instructions (line art)
                  format = Format.JPEG,  # PNG = lossless, transparent backgrounds, JPG much smaller
+                 jpeg_quality = 90,  # 1 - 95, higher is larger files
+                 png_compress_level = 6,  # 0 - 9, higher is smaller files but slower to write
+                 webp_quality = 90,  # 1 - 100, 100 is lossless
+                 render_time_limit = None,  # optionally stop sampling after this many seconds
+                 engine = Engine.CYCLES,  # cycles for realistic renders, workbench or eevee for fast line art
                  ):
         self.background_type = background_type
+        self.composite_count = composite_count
         self.width = width
         self.height = height
         self.quality = quality
         self.image_filename = image_filename
         self.label_filename = label_filename
         self.part_class_id = part_class_id
+        self.mask_labels = mask_labels
+        self.segmentation_filename = segmentation_filename
         self.blender_filename = blender_filename
         self.lighting_style = lighting_style
         self.light_angle = light_angle
@@ -67,10 +108,35 @@ class RenderOptions:
         self.zoom = zoom
         self.look = look
         self.format = format
+        self.jpeg_quality = jpeg_quality
+        self.png_compress_level = png_compress_level
+        self.webp_quality = webp_quality
+        self.render_time_limit = render_time_limit
+        self.engine = engine
+
+    # Plain dict that can be stored as JSON, e.g. in the job queue
+    def to_dict(self):
+        return {key: value.value if isinstance(value, Enum) else value for key, value in vars(self).items()}
+
+    @classmethod
+    def from_dict(cls, values):
+        options = cls()
+        for key, value in values.items():
+            enum = OPTION_ENUMS.get(key)
+            if enum is not None and value in {e.value for e in enum}:
+                value = enum(value)
+            elif isinstance(value, list):
+                value = tuple(value)
+            setattr(options, key, value)
+        return options
 
     @property
     def draft(self):
-        return self.quality == Quality.DRAFT
+        return self.quality in (Quality.DRAFT, Quality.ADAPTIVE_DRAFT)
+
+    @property
+    def adaptive_sampling(self):
+        return self.quality in (Quality.ADAPTIVE, Quality.ADAPTIVE_DRAFT)
 
     @property
     def instructions(self):
@@ -87,8 +153,26 @@ class RenderOptions:
 
     @property
     def render_samples(self):
+        # With adaptive sampling this is an upper limit. Simple opaque parts
+        # stop well before it, transparent parts need more.
+        if self.adaptive_sampling:
+            return 64 if self.draft else 512
         return 16 if self.draft else 256
 
+    # Noise level where adaptive sampling stops, lower is less noisy
+    @property
+    def adaptive_threshold(self):
+        return 0.1 if self.draft else 0.02
+
+    @property
+    def adaptive_min_samples(self):
+        return 4 if self.draft else 16
+
+    # Adaptive sampling leaves some noise behind, the denoiser cleans it up
+    @property
+    def denoise(self):
+        return self.adaptive_sampling
+
     @property
     def part_rotation_radian(self):
         return tuple(map(radians, self.part_rotation))
@@ -100,3 +184,14 @@ class RenderOptions:
     @property
     def render_height(self):
         return self.height * 2 if self.quality == Quality.HIGH else self.height
+
+# Options that are stored as an enum value when serialized
+OPTION_ENUMS = {
+    'background_type': BackgroundType,
+    'quality': Quality,
+    'lighting_style': LightingStyle,
+    'material': Material,
+    'look': Look,
+    'format': Format,
+    'engine': Engine,
+}
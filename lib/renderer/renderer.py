@@ -2,55 +2,176 @@ import copy
 import bpy
 import os
 import tempfile
+import shutil
+import weakref
 from PIL import Image
 from math import radians
 from lib.renderer.utils import *
 from lib.renderer.lighting import setup_lighting
-from lib.renderer.render_options import Material, BackgroundType
+from lib.renderer.render_options import Material, BackgroundType, Engine, Look
+from lib.renderer.part_cache import PartCache, CachedPart, hierarchy
+from lib.renderer.material_overrides import MaterialOverrides
+from lib.renderer.hull_cache import HullCache
+from lib.renderer.background_pool import BackgroundPool
+from lib.renderer.generated_backgrounds import GeneratedBackgrounds
+from lib.renderer.metrics import RenderMetrics
+from lib.renderer.render_buffer import setup_viewer, read_render_pixels
+from lib.renderer.output_pipeline import OutputPipeline, write_output, write_composites
+from lib.renderer.compositing import CompositeBackgrounds
+from lib.renderer.scene_layout import layout_footprints
+from lib.renderer.ldr_documents import LdrDocuments
+from lib.renderer.dat import ldraw_index
+from lib.renderer.geometry_snapshot import GeometrySnapshot
+from lib.renderer.masks import setup_index_pass, set_pass_indexes, read_index_pass, mask_labels
+from lib.renderer.ldraw_mesh import LDrawMeshes, ldraw_colors
+from lib.renderer.part_assets import PartAssets
+from lib.renderer.native_import import build_part, part_material, ensure_ground_plane
 from lib.annotation_writer import *
 from io_scene_importldraw.loadldraw.loadldraw import LegoColours, BlenderMaterials
-import glob
-import random
 import math
 
+# LDraw color code reserved for the part color. See import_part
+PLACEHOLDER_COLOR_CODE = 99999
+
 # Render Lego parts
 # This class is responsible for rendering a single image
 # for a single part. It abstracts Blender and LDraw models
+#
+# Images are encoded and written by an output pipeline. With output_threads > 0
+# that happens in the background while the next image renders: render_part
+# returns a Future for the written image, and wait() blocks until all images
+# are written.
+#
+# With native_import parts with the normal look are built from the .dat files
+# by our own loader (see ldraw_mesh.py) instead of the ImportLDraw operator.
 class Renderer:
-    def __init__(self, ldraw_path = "./ldraw"):
+    def __init__(self, ldraw_path = "./ldraw", part_cache_max_bytes = 512 * 1024 * 1024, metrics_filename = None,
+                 output_threads = 0, max_pending_outputs = 8, native_import = False, part_assets_dir = "./cache/part-assets"):
         self.ldraw_path = ldraw_path
         self.ldraw_parts_path = os.path.join(ldraw_path, "parts")
         self.ldraw_unofficial_parts_path = os.path.join(ldraw_path, "unofficial", "parts")
+        self.ldraw_index = ldraw_index(ldraw_path)  # which parts exist, see dat.py
         self.has_imported_at_least_once = False
         self.class_to_id = {}
+        self.part_cache = PartCache(part_cache_max_bytes)
+        self.materials = MaterialOverrides(PLACEHOLDER_COLOR_CODE)
+        self.hulls = HullCache(ldraw_index=self.ldraw_index, mesh_source=self.mesh_source)
+        self.backgrounds = BackgroundPool()
+        self.generated_backgrounds = GeneratedBackgrounds()  # process pool only started when first used
+        self.composite_backgrounds = CompositeBackgrounds()
+        self.metrics = RenderMetrics(metrics_filename)  # optionally time each stage, see summarize-metrics.py
+        self.output = OutputPipeline(output_threads, max_pending_outputs)
+        self.ground_material = None
+        self.ground_scale = None
+        self.default_sampling = None
+        self.scratch_dir = tempfile.mkdtemp(prefix="lego-rendering-")  # render passes read back after rendering
+        # Most scripts never call close(), so also removed when the process exits
+        self.remove_scratch_dir = weakref.finalize(self, shutil.rmtree, self.scratch_dir, ignore_errors=True)
+        self.ldr_documents = LdrDocuments()
+        self.native_import = native_import
+        self.meshes = None
+        if native_import:
+            # Flattened parts are saved to part_assets_dir, see build-part-assets.py
+            assets = PartAssets(part_assets_dir, ldraw_path) if part_assets_dir else None
+            self.meshes = LDrawMeshes(ldraw_path, assets=assets)
+        self.ldraw_colors = None
         
     def render_part(self, ldraw_part_id, options):
-        self.import_part(ldraw_part_id, options)
+        self.metrics.start(ldraw_part_id, options)
+        with self.metrics.stage("load_part"):
+            cached = self.load_part(ldraw_part_id, options)
+        future = self.render_loaded_part(cached, options)
+        self.metrics.finish()
+        return future
+
+    # Wait until every image rendered so far has been written
+    def wait(self):
+        self.output.wait()
+
+    def close(self):
+        self.output.close()
+        self.generated_backgrounds.close()
+        self.remove_scratch_dir()
+        self.ldr_documents.close()
+
+    # Render several views of the same part, e.g. front, back and top. The
+    # part is loaded once, each view only changes the rotation, camera,
+    # lighting and color. Produces the same images and labels as calling
+    # render_part for each view.
+    def render_views(self, ldraw_part_id, options_list):
+        cached = None
+        futures = []
+        for options in options_list:
+            self.metrics.start(ldraw_part_id, options)
+            with self.metrics.stage("load_part"):
+                if cached is not None and cached.key == PartCache.key(ldraw_part_id, options) and self.materials.has(cached, options):
+                    self.metrics.note("cached", True)
+                    self.set_part_color(cached, options)
+                else:
+                    cached = self.load_part(ldraw_part_id, options)
+            futures.append(self.render_loaded_part(cached, options))
+            self.metrics.finish()
+        return futures
+
+    # Render several parts together, e.g. so a detection image has more than
+    # one object. parts is a list of (ldraw_id, options), each part's options
+    # set its color, material, rotation and class id. Everything else (size,
+    # quality, background, lighting, camera, file names) comes from
+    # scene_options, by default the first part's options. Parts are spread
+    # over the ground so each covers at most max_overlap of another, and the
+    # label file has a line for each part.
+    def render_scene(self, parts, scene_options=None, max_overlap=0.0):
+        scene_options = scene_options or parts[0][1]
+        self.metrics.start(",".join(ldraw_id for ldraw_id, _ in parts), scene_options)
+        with self.metrics.stage("load_part"):
+            loaded = self.load_parts(parts)
+        future = self.render_loaded_parts(loaded, scene_options, max_overlap)
+        self.metrics.finish()
+        return future
 
-        part = bpy.data.objects[0].children[0]
+    # Render a part that is already in the scene
+    def render_loaded_part(self, cached, options):
+        return self.render_loaded_parts([(cached, options)], options)
+
+    # Render parts that are already in the scene, a list of (cached part, options)
+    def render_loaded_parts(self, parts, options, max_overlap=0.0):
         camera = bpy.data.objects['Camera']
         
         print(options.background_type)
 
         # Do this after import b/c the importer overwrites some of these settings
-        bpy.context.scene.render.engine = 'CYCLES'
+        self.set_engine(options)
         bpy.context.scene.cycles.samples = options.render_samples
-        bpy.context.scene.cycles.max_bounces = 15 if options.material == Material.TRANSPARENT else 2
+        self.set_sampling(options)
+        any_transparent = any(part_options.material == Material.TRANSPARENT for _, part_options in parts)
+        bpy.context.scene.cycles.max_bounces = 15 if any_transparent else 2
         bpy.context.scene.render.resolution_x = options.render_width
         bpy.context.scene.render.resolution_y = options.render_height
-        bpy.context.scene.render.film_transparent = True if options.background_type == BackgroundType.TRANSPARENT else False
+        bpy.context.scene.render.film_transparent = options.background_type in (BackgroundType.TRANSPARENT, BackgroundType.COMPOSITED)
         bpy.context.scene.view_settings.view_transform = 'Standard'
         bpy.data.worlds["World"].node_tree.nodes["Background"].inputs[1].default_value = 0 # turn off ambient lighting
 
-        rotation = options.part_rotation_radian
-        rotation = (rotation[0]+ radians(270), rotation[1], rotation[2] + radians(90)) # parts feel in a natural orientation with 90 degree z rotation
-        part.rotation_euler = rotation
+        for cached, part_options in parts:
+            rotation = part_options.part_rotation_radian
+            rotation = (rotation[0]+ radians(270), rotation[1], rotation[2] + radians(90)) # parts feel in a natural orientation with 90 degree z rotation
+            cached.part.rotation_euler = rotation
+            cached.root.location = cached.home  # undo the layout of a previous scene
         
-        if not options.background_type == BackgroundType.TRANSPARENT and not options.background_type == BackgroundType.WHITE:
-            self.set_background_image(options.background_type)
-            
-        place_object_on_ground(part)
-        setup_lighting(options)
+        with self.metrics.stage("background"):
+            self.set_background(options)
+
+        # Every later step reads the parts' points from here, see geometry_snapshot.py
+        with self.metrics.stage("geometry_snapshot"):
+            snapshot = GeometrySnapshot.capture(parts, self.hulls)
+        with self.metrics.stage("place_object_on_ground"):
+            for i, (cached, part_options) in enumerate(parts):
+                offset = place_object_on_ground(cached.part, snapshot.points[i])
+                snapshot.translate(i, (0, 0, offset))
+        if len(parts) > 1:
+            with self.metrics.stage("layout"):
+                self.arrange_parts(parts, max_overlap, snapshot)
+        with self.metrics.stage("lighting"):
+            setup_lighting(options)
 
         # The importer does not handle instructions look properly
         # If we skip the line that errors, we still need to re-enable these:
@@ -60,47 +181,222 @@ class Renderer:
                 for collection in layer.layer_collection.children:
                     collection.exclude = False
 
-        # Aim and position the camera so the part is centered in the frame.
+        # Aim and position the camera so the parts are centered in the frame.
         # The importer can do this for us but we rotate and move the part
-        # after importing so would need to do it again anyways.
-        select_hierarchy(part)
-        camera.data.type = 'PERSP' # I prefer perspective even for instructions
-        camera.data.lens = 120 # Long focal length so perspective is minor
-        set_height_by_angle(camera, options.camera_height)
-        aim_towards_origin(camera)
-        bpy.ops.view3d.camera_to_view_selected()
-        zoom_camera(camera, options.zoom)
-
-
-        # Render
-        bpy.context.scene.render.image_settings.file_format = options.format.value
-        bpy.context.scene.render.image_settings.quality = 90 # for jpeg
-        bpy.context.scene.render.filepath = options.image_filename
-        bpy.ops.render.render(write_still=True)
-
-        # Did we render a larger size, if so resize
-        if options.width != options.render_width:
-            image = Image.open(options.image_filename)
-            image.thumbnail((options.width, options.height), Image.LANCZOS)
-            image.save(options.image_filename)
-
-        # Save a Blender file so we can debug this script
+        # after importing so would need to do it again anyways. The camera is
+        # fitted to the parts' convex hulls, the extremes of every vertex.
+        with self.metrics.stage("frame_camera"):
+            camera.data.type = 'PERSP' # I prefer perspective even for instructions
+            camera.data.lens = 120 # Long focal length so perspective is minor
+            set_height_by_angle(camera, options.camera_height)
+            aim_towards_origin(camera)
+            camera_matrix = frame_camera(camera, snapshot.all_points, options.zoom)
+
+
+        # Render and keep the image in memory. Resizing (for Quality.HIGH),
+        # encoding and writing happen in the output pipeline.
+        setup_viewer()
+
+        # Object index pass for labels from the visible pixels, see masks.py
+        use_masks = options.mask_labels or options.segmentation_filename is not None
+        if use_masks and options.engine != Engine.CYCLES:
+            print("------ WARNING: mask labels need Cycles, using projected boxes and no outlines")
+            use_masks = False
+        setup_index_pass(use_masks, self.scratch_dir)
+        if use_masks:
+            set_pass_indexes([cached.objects for cached, part_options in parts])
+
+        with self.metrics.stage("render"):
+            bpy.ops.render.render()
+        with self.metrics.stage("read_pixels"):
+            pixels = read_render_pixels()
+            index = read_index_pass(self.scratch_dir) if use_masks else None
+
+        # Save a Blender file so we can debug this script. Blender isn't
+        # thread safe so this can't move to the output pipeline.
         if options.blender_filename:
-            bpy.ops.wm.save_as_mainfile(filepath=os.path.abspath(options.blender_filename))
+            with self.metrics.stage("save_blend"):
+                bpy.ops.wm.save_as_mainfile(filepath=os.path.abspath(options.blender_filename))
             
-        # Save the bounding box coordinates in YOLO format
-        if options.label_filename:
-            bounding_box = get_2d_bounding_box(part, camera).to_yolo(options.width, options.height)
-            write_label_file(options.label_filename, bounding_box, options.part_class_id)
+        # Bounding box coordinates in YOLO format, one per part, written with the image
+        labels = None
+        segments = None
+        if use_masks:
+            with self.metrics.stage("mask_labels"):
+                labels = []
+                segments = []
+                for (cached, part_options), (box, polygon) in zip(parts, mask_labels(index, len(parts))):
+                    if box is None:
+                        print(f"------ WARNING: {cached.key[0]} is not visible, no label")
+                        continue
+                    labels.append((part_options.part_class_id, box))
+                    segments.append((part_options.part_class_id, polygon))
+        if options.label_filename and not use_masks:
+            with self.metrics.stage("label"):
+                labels = []
+                for i, (cached, part_options) in enumerate(parts):
+                    bounding_box = project_bounding_box(snapshot.points[i], camera, camera_matrix)
+                    if bounding_box is None:
+                        print(f"------ WARNING: {cached.key[0]} is not in the frame, no label")
+                        continue
+                    # The box is in pixels of the rendered image, before any resizing
+                    labels.append((part_options.part_class_id, bounding_box.to_yolo(pixels.shape[1], pixels.shape[0])))
+
+        # Blocks when too many images are waiting to be written
+        with self.metrics.stage("output"):
+            if options.background_type == BackgroundType.COMPOSITED:
+                return self.output.submit(write_composites, pixels, options, labels, segments, self.composite_backgrounds)
+            return self.output.submit(write_output, pixels, options, labels, segments)
+
+    # Spread the parts of a scene over the ground, see scene_layout.py
+    def arrange_parts(self, parts, max_overlap, snapshot):
+        footprints = []
+        centers = []
+        for i in range(len(parts)):
+            min_x, min_y, max_x, max_y = snapshot.footprint(i)
+            center = ((min_x + max_x) / 2, (min_y + max_y) / 2)
+            footprints.append((min_x - center[0], min_y - center[1], max_x - center[0], max_y - center[1]))
+            centers.append(center)
+
+        for i, ((cached, part_options), center, (x, y)) in enumerate(zip(parts, centers, layout_footprints(footprints, max_overlap))):
+            cached.root.location.x += x - center[0]
+            cached.root.location.y += y - center[1]
+            snapshot.translate(i, (x - center[0], y - center[1], 0))
+
+    def set_engine(self, options):
+        scene = bpy.context.scene
+        if options.engine == Engine.WORKBENCH:
+            # Flat colors with a dark outline, close to the instructions look
+            scene.render.engine = 'BLENDER_WORKBENCH'
+            scene.display.render_aa = '8'
+            shading = scene.display.shading
+            shading.light = 'STUDIO'
+            shading.color_type = 'MATERIAL'
+            shading.show_object_outline = True
+            shading.object_outline_color = (0, 0, 0)
+            shading.show_cavity = True
+            shading.cavity_type = 'WORLD'
+            shading.show_specular_highlight = False
+        elif options.engine == Engine.EEVEE:
+            # Blender 4.2 renamed the engine for a few versions
+            engines = bpy.types.RenderSettings.bl_rna.properties['engine'].enum_items.keys()
+            scene.render.engine = 'BLENDER_EEVEE_NEXT' if 'BLENDER_EEVEE_NEXT' in engines else 'BLENDER_EEVEE'
+            scene.eevee.taa_render_samples = options.render_samples
+        else:
+            scene.render.engine = 'CYCLES'
+
+    # Adaptive sampling and denoising for the adaptive quality presets. Other
+    # presets keep whatever the scene had before the first render.
+    def set_sampling(self, options):
+        cycles = bpy.context.scene.cycles
+        names = ['use_adaptive_sampling', 'adaptive_threshold', 'adaptive_min_samples', 'use_denoising', 'denoiser', 'time_limit']
+        if self.default_sampling is None:
+            self.default_sampling = {name: getattr(cycles, name) for name in names}
+
+        for name, value in self.default_sampling.items():
+            setattr(cycles, name, value)
+
+        if options.adaptive_sampling:
+            cycles.use_adaptive_sampling = True
+            cycles.adaptive_threshold = options.adaptive_threshold
+            cycles.adaptive_min_samples = options.adaptive_min_samples
+        if options.denoise:
+            cycles.use_denoising = True
+            cycles.denoiser = 'OPENIMAGEDENOISE'  # runs on the CPU
+        if options.render_time_limit:
+            cycles.time_limit = options.render_time_limit
+
+    # Get the part into the scene, reusing a previous import if possible.
+    # All other cached parts are hidden.
+    def load_part(self, ldraw_part_id, options):
+        self.part_cache.hide_all()
+        cached = self.get_part(ldraw_part_id, options)
+        self.set_part_color(cached, options)
+        cached.show()
+        return cached
+
+    # Get the parts of a scene into the scene. A part used more than once
+    # gets a copy for each extra instance, and each part its own color.
+    def load_parts(self, parts):
+        self.part_cache.hide_all()
+        self.import_missing_parts(parts)
+        loaded = []
+        instances = {}
+        for variant, (ldraw_part_id, options) in enumerate(parts):
+            key = PartCache.key(ldraw_part_id, options)
+            instance = instances.get(key, 0)
+            instances[key] = instance + 1
+
+            cached = self.get_part(ldraw_part_id, options, instance, keep=[cached.key for cached, _ in loaded])
+            self.set_part_color(cached, options, variant)
+            cached.show()
+            loaded.append((cached, options))
+        return loaded
+
+    # Import the parts of a scene that aren't cached yet, with one importer
+    # call for all the parts that share the same import settings
+    def import_missing_parts(self, parts):
+        groups = {}
+        for ldraw_part_id, options in parts:
+            key = PartCache.key(ldraw_part_id, options)
+            cached = self.part_cache.parts.get(key)
+            if cached is not None and self.materials.has(cached, options):
+                continue
+            settings = (options.res_prisms, options.use_logo_studs, options.look, options.material)
+            group = groups.setdefault(settings, {})
+            group.setdefault(ldraw_part_id, options)
+
+        keep = [PartCache.key(ldraw_part_id, options) for ldraw_part_id, options in parts]
+        for group in groups.values():
+            if len(group) < 2:
+                continue  # imported by get_part as usual
+            for ldraw_part_id, options in group.items():
+                self.part_cache.remove(PartCache.key(ldraw_part_id, options))
+            options = next(iter(group.values()))
+            for cached in self.import_parts(list(group.keys()), options):
+                self.part_cache.add(cached, keep)
+
+    # Get an imported part from the cache or import it. Parts in keep are
+    # not evicted to make room.
+    def get_part(self, ldraw_part_id, options, instance=0, keep=()):
+        key = PartCache.key(ldraw_part_id, options, instance)
+        cached = self.part_cache.get(key)
+
+        # Shared materials are taken from the importer, so the first time a
+        # material (e.g. transparent) is used with a look the part is re-imported
+        if cached is not None and not self.materials.has(cached, options):
+            self.part_cache.remove(key)
+            cached = None
+
+        if cached is None:
+            self.metrics.note("cached", False)
+            if instance == 0:
+                cached = self.import_part(ldraw_part_id, options)
+            else:
+                cached = self.get_part(ldraw_part_id, options, 0, keep).copy(key)
+            self.part_cache.add(cached, keep)
+        else:
+            self.metrics.note("cached", True)
+            print(f"[CACHE] Reusing imported part {ldraw_part_id}")
+        return cached
+
+    # variant picks the copy of the shared materials, see MaterialOverrides
+    def set_part_color(self, cached, options, variant=0):
+        linearRGBA = LegoColours.hexDigitsToLinearRGBA(options.part_color.replace('#', ''), 1.0)
+        self.materials.apply(cached, options, linearRGBA, variant)
 
     def import_part(self, ldraw_part_id, options):
-        self.clear_scene()
+        return self.import_parts([ldraw_part_id], options)[0]
+
+    # Import parts with one importer call. They share the import settings
+    # (look, primitives, studs and material) of options.
+    def import_parts(self, ldraw_part_ids, options):
+        for ldraw_part_id in ldraw_part_ids:
+            if not self.ldraw_index.part_exists(ldraw_part_id):
+                raise FileNotFoundError(f"Part file not found: {ldraw_part_id}.dat in {self.ldraw_path}")
 
-        part_filename = os.path.abspath(os.path.join(self.ldraw_parts_path, f"{ldraw_part_id}.dat"))
-        if not os.path.exists(part_filename):
-            part_filename = os.path.abspath(os.path.join(self.ldraw_unofficial_parts_path, f"{ldraw_part_id}.dat"))
-            if not os.path.exists(part_filename):
-                raise FileNotFoundError(f"Part file not found: {part_filename}")
+        if self.mesh_source(options) == "native":
+            return self.build_parts(ldraw_part_ids, options)
 
 
         # Set the part color
@@ -112,9 +408,16 @@ class Renderer:
         #   - the importer uses the LDraw color to determine color and material (e.g. transparent)
         #   - a part may have multiple materials (slopes 3039) and colors (hinged attenna 73587p01)
         #   - colors are re-read from LDConfig.ldr each time the importer is invoked
-        ldraw_color = 99999
+        #
+        # Clear the importer caches so it doesn't reuse a material made for a previous
+        # color. The materials it creates are swapped for shared ones after importing.
+        if self.has_imported_at_least_once:
+            LegoColours()
+            BlenderMaterials.clearCache()
+
+        ldraw_color = PLACEHOLDER_COLOR_CODE
         linearRGBA = LegoColours.hexDigitsToLinearRGBA(options.part_color.replace('#', ''), 1.0)
-        LegoColours.colours[99999] = {
+        LegoColours.colours[ldraw_color] = {
             "name": "lego-rendering-placeholder-color",
             "colour": linearRGBA[0:3],
             "alpha": 0.5 if options.material == Material.TRANSPARENT else 1,
@@ -122,27 +425,18 @@ class Renderer:
             "material": "RUBBER" if options.material == Material.RUBBER else "BASIC",
         }
 
-        name = ""
-        with tempfile.NamedTemporaryFile(suffix=".ldr", mode='w+', delete=False) as temp:
-            temp.write("0 Untitled Model\n")
-            temp.write("0 Name:  UntitledModel\n")
-            temp.write("0 Author:\n")
-            temp.write("0 CustomBrick\n")
-            temp.write(f"1 {ldraw_color} 30.000000 -24.000000 -20.000000 1.000000 0.000000 0.000000 0.000000 1.000000 0.000000 0.000000 0.000000 1.000000 {ldraw_part_id}.dat\n")
-
-            name = temp.name
-
-        with open(name, 'r') as file:
-            data = file.read()
-            print("-----")
-            print(data)
-            print("-----")
+        # The wrapper document only depends on the parts, so it is written once
+        filename = self.ldr_documents.filename(ldraw_part_ids, ldraw_color)
 
         # Import the part into the scene
         # https://github.com/TobyLobster/ImportLDraw/blob/09dd286d294672c816d33e70ac10146beb69693c/importldraw.py
-        bpy.ops.import_scene.importldraw(filepath=name, **{
+        #
+        # The environment (ground plane) is always added. It is shared by all
+        # cached parts and hidden for transparent backgrounds.
+        existing_names = set(bpy.data.objects.keys())
+        bpy.ops.import_scene.importldraw(filepath=filename, **{
             "ldrawPath": os.path.abspath(self.ldraw_path),
-            "addEnvironment": False if options.background_type == BackgroundType.TRANSPARENT else True,                  # add a white ground plane
+            "addEnvironment": True,                  # add a white ground plane
             "resPrims": options.res_prisms,          # high resolution primitives
             "useLogoStuds": options.use_logo_studs,  # LEGO logo on studs
             "look": options.look.value,              # normal (realistic) or instructions (line art)
@@ -150,10 +444,64 @@ class Renderer:
         })
 
         bpy.ops.object.select_all(action='DESELECT')
-        os.remove(name)
         self.has_imported_at_least_once = True
 
+        new_objects = [obj for obj in bpy.data.objects if obj.name not in existing_names]
+        self.remove_duplicate_ground_planes(new_objects)
+
+        root = next(obj for obj in new_objects if obj.parent is None and len(obj.children) > 0)
+        if len(ldraw_part_ids) == 1:
+            roots = [root]
+        else:
+            roots = split_import(root, len(ldraw_part_ids))
+
+        cached_parts = []
+        for ldraw_part_id, part_root in zip(ldraw_part_ids, roots):
+            color_slots = self.materials.adopt(hierarchy(part_root), options)
+            cached_parts.append(CachedPart(PartCache.key(ldraw_part_id, options), part_root, part_root.children[0], color_slots))
+        return cached_parts
+
+    # "native" when parts are built by build_parts, "importer" otherwise. The
+    # instructions look needs the importer's line art.
+    def mesh_source(self, options):
+        return "native" if self.native_import and options.look == Look.NORMAL else "importer"
+
+    # Build parts from their .dat files without the importer. Fixed colors
+    # come from LDConfig.ldr, the part color from our own shared material.
+    def build_parts(self, ldraw_part_ids, options):
+        ensure_ground_plane()
+        if self.ldraw_colors is None:
+            self.ldraw_colors = ldraw_colors(self.ldraw_path) if os.path.exists(os.path.join(self.ldraw_path, "LDConfig.ldr")) else {}
+        key = MaterialOverrides.key(options, False)
+        main_material = self.materials.materials.get(key) or self.materials.register(key, part_material(options))
+
+        cached_parts = []
+        for ldraw_part_id in ldraw_part_ids:
+            with self.metrics.stage("flatten"):
+                mesh = self.meshes.mesh(ldraw_part_id, options.res_prisms == "High", options.use_logo_studs)
+            root, part, slot = build_part(ldraw_part_id, mesh, main_material, self.ldraw_colors)
+            color_slots = [] if slot is None else [(part, slot, False)]
+            cached_parts.append(CachedPart(PartCache.key(ldraw_part_id, options), root, part, color_slots))
+        return cached_parts
+
+    # Every import adds a ground plane, only keep the first one
+    def remove_duplicate_ground_planes(self, new_objects):
+        for obj in new_objects:
+            if obj.name.startswith("LegoGroundPlane") and obj.name != "LegoGroundPlane":
+                mesh = obj.data
+                materials = [material for material in mesh.materials if material]
+                bpy.data.objects.remove(obj, do_unlink=True)
+                if mesh.users == 0:
+                    bpy.data.meshes.remove(mesh)
+                for material in materials:
+                    if material.users == 0:
+                        bpy.data.materials.remove(material)
+
     def clear_scene(self):
+        self.part_cache.clear()
+        self.materials = MaterialOverrides(PLACEHOLDER_COLOR_CODE)
+        self.ground_material = None
+        self.ground_scale = None
         bpy.ops.object.select_all(action='DESELECT')
 
         # Select all objects in the current scene
@@ -167,70 +515,85 @@ class Renderer:
         # Delete materials because we reuse the same LDraw color
         # for all renders but change the LDRConfig to change the
         # rendered color
+        # Background images and their material are kept.
+        keep = self.backgrounds.datablocks + self.generated_backgrounds.datablocks
         for datablock in [bpy.data.meshes, bpy.data.materials, bpy.data.textures, bpy.data.images]:
             for block in datablock:
-                datablock.remove(block, do_unlink=True)
+                if block not in keep:
+                    datablock.remove(block, do_unlink=True)
 
         # Clear caches. For the same reason above (LDRConfig changes)
         if self.has_imported_at_least_once:
             LegoColours()
             BlenderMaterials.clearCache()
 
-    #TODO: make this methed switch between different backgrounds
-    def set_background_image(self, background_type=BackgroundType.IMAGE):  
+    # The ground plane is kept between renders so reset anything a
+    # previous render changed
+    def set_background(self, options):
+        ground = bpy.data.objects.get("LegoGroundPlane")
+        if not ground:
+            return
+
+        if self.ground_scale is None:
+            self.ground_scale = tuple(ground.scale)
+            self.ground_material = ground.data.materials[0] if ground.data.materials else None
+            if self.ground_material:
+                self.ground_material.use_fake_user = True
+
+        # Composited renders keep the ground's shadows on a transparent film.
+        # Only Cycles has shadow catchers, other engines composite without shadows.
+        shadow_catcher = options.background_type == BackgroundType.COMPOSITED and options.engine == Engine.CYCLES
+        transparent = options.background_type in (BackgroundType.TRANSPARENT, BackgroundType.COMPOSITED) and not shadow_catcher
+        ground.hide_viewport = transparent
+        ground.hide_render = transparent
+        ground.is_shadow_catcher = shadow_catcher
+
+        if options.background_type in (BackgroundType.TRANSPARENT, BackgroundType.WHITE, BackgroundType.COMPOSITED):
+            ground.scale = self.ground_scale
+            if self.ground_material and ground.data.materials:
+                ground.data.materials[0] = self.ground_material
+        else:
+            self.set_background_image(options)
+
+    def set_background_image(self, options):
         ground = bpy.data.objects.get("LegoGroundPlane")
         if not ground:
             print("LegoGroundPlane not found.")
             return
-    
-        # Load random image
-        image_dir = os.path.abspath("./lib/backgrounds")
-        images = glob.glob(os.path.join(image_dir, "*.jpg")) + glob.glob(os.path.join(image_dir, "*.png"))
-        if not images:
-            print(f"No background images found in: {image_dir}")
+
+        if options.background_type == BackgroundType.GENERATED:
+            self.backgrounds.apply_image(ground, self.generated_backgrounds.next_image())
+        elif not self.backgrounds.apply(ground, options):
             return
-    
-        img_path = random.choice(images)
-        print(f"Using background image: {img_path}")
-        img = bpy.data.images.load(img_path)
-    
-        # Create or reuse material
-        mat_name = "LegoGroundPlaneMaterial"
-        mat = bpy.data.materials.get(mat_name)
-        if not mat:
-            mat = bpy.data.materials.new(name=mat_name)
-            mat.use_nodes = True
-    
-        # Assign material only to the ground plane
-        if ground.data.materials:
-            ground.data.materials[0] = mat
-        else:
-            ground.data.materials.append(mat)
-    
-        # Clear and set up new nodes
-        nodes = mat.node_tree.nodes
-        links = mat.node_tree.links
-        nodes.clear()
-    
-        # Create nodes
-        tex_image = nodes.new('ShaderNodeTexImage')
-        tex_image.image = img
-    
-        bsdf = nodes.new('ShaderNodeBsdfPrincipled')
-        output = nodes.new('ShaderNodeOutputMaterial')
-    
-        tex_coord = nodes.new('ShaderNodeTexCoord')
-        mapping = nodes.new('ShaderNodeMapping')
-    
-        # Link nodes
-        links.new(tex_coord.outputs['UV'], mapping.inputs['Vector'])
-        links.new(mapping.outputs['Vector'], tex_image.inputs['Vector'])
-        links.new(tex_image.outputs['Color'], bsdf.inputs['Base Color'])
-        links.new(bsdf.outputs['BSDF'], output.inputs['Surface'])
-    
-        print("Updated texture on LegoGroundPlane.")
-
-        ground.scale = (.006, .006, 1)  # X and Y scaled down, Z left unchanged
-        bpy.context.view_layer.objects.active = ground
-        bpy.ops.object.transform_apply(location=False, rotation=False, scale=True)
-        print("Background image applied to LegoGroundPlane.")
\ No newline at end of file
+
+        # X and Y scaled down, Z left unchanged. Not applied to the mesh
+        # because the ground plane is reused by other backgrounds.
+        sx, sy, sz = self.ground_scale or (1, 1, 1)
+        ground.scale = (sx * .006, sy * .006, sz)
+
+
+# A multi part document is imported under one root with a child per part.
+# Give each part a root of its own, matching a single part import, so it can
+# be cached, shown and removed on its own. Children are matched to the
+# document by their position along x, then moved back to where a single
+# part import puts them.
+def split_import(root, count):
+    bpy.context.view_layer.update()
+    children = sorted(root.children, key=lambda child: child.matrix_world.translation.x)[:count]
+    origin = children[0].matrix_world.translation.copy()
+
+    roots = []
+    for i, child in enumerate(children):
+        part_root = bpy.data.objects.new(f"{root.name}.{i}", None)
+        for collection in root.users_collection:
+            collection.objects.link(part_root)
+        part_root.matrix_world = root.matrix_world
+
+        matrix = child.matrix_world.copy()
+        matrix.translation = origin
+        child.parent = part_root
+        child.matrix_world = matrix
+        roots.append(part_root)
+
+    bpy.data.objects.remove(root, do_unlink=True)
+    return roots
\ No newline at end of file
@@ -0,0 +1,59 @@
+import math
+import random
+
+# Arrange parts on the ground for a multi part scene
+#
+# Each footprint is the (min_x, min_y, max_x, max_y) rectangle a part covers
+# on the ground, relative to its location. Parts are placed largest first at
+# random spots around the origin. A spot is rejected if the part would cover
+# more than max_overlap of a placed part (or of itself), after too many
+# rejections the area searched grows. Returns an (x, y) location per part.
+def layout_footprints(footprints, max_overlap=0.0, spacing=0.1, attempts=50):
+    sizes = [max(f[2] - f[0], f[3] - f[1]) for f in footprints]
+    gap = spacing * (max(sizes) if sizes else 0)
+    radius = sum(sizes) / 4
+
+    locations = [None] * len(footprints)
+    placed = []  # rectangles in world coordinates
+    for i in sorted(range(len(footprints)), key=lambda i: -area(footprints[i])):
+        footprint = footprints[i]
+        failures = 0
+        while True:
+            if not placed:
+                x, y = 0.0, 0.0
+            else:
+                angle = random.uniform(0, 2 * math.pi)
+                distance = radius * math.sqrt(random.random())
+                x, y = distance * math.cos(angle), distance * math.sin(angle)
+
+            rectangle = moved(footprint, x, y)
+            if all(fits(rectangle, other, max_overlap, gap) for other in placed):
+                break
+
+            failures += 1
+            if failures % attempts == 0:
+                radius *= 1.25
+
+        locations[i] = (x, y)
+        placed.append(rectangle)
+    return locations
+
+def fits(a, b, max_overlap, gap):
+    if max_overlap <= 0:
+        # Keep a gap so parts don't touch
+        return overlap_area(grown(a, gap / 2), grown(b, gap / 2)) == 0
+    return overlap_area(a, b) <= max_overlap * min(area(a), area(b))
+
+def overlap_area(a, b):
+    width = min(a[2], b[2]) - max(a[0], b[0])
+    height = min(a[3], b[3]) - max(a[1], b[1])
+    return max(0, width) * max(0, height)
+
+def area(rectangle):
+    return (rectangle[2] - rectangle[0]) * (rectangle[3] - rectangle[1])
+
+def moved(rectangle, x, y):
+    return (rectangle[0] + x, rectangle[1] + y, rectangle[2] + x, rectangle[3] + y)
+
+def grown(rectangle, amount):
+    return (rectangle[0] - amount, rectangle[1] - amount, rectangle[2] + amount, rectangle[3] + amount)
@@ -1,13 +1,15 @@
 import os
 import bpy
+import bmesh
 import random
 from math import radians, sin, cos
 from mathutils import Vector, Matrix
 from lib.bounding_box import BoundingBox
-import glob
-from functools import reduce
+import numpy as np
 
 from lib.renderer.render_options import BackgroundType
+from lib.renderer.dat import ldraw_index
+from lib.renderer.camera_fit import camera_fit_location
 
 
 def rotate_object_randomly(obj, min_angle=-360, max_angle=360):
@@ -16,22 +18,31 @@ def rotate_object_randomly(obj, min_angle=-360, max_angle=360):
     random_z = radians(random.uniform(min_angle, max_angle))
     obj.rotation_euler = (random_x, random_y, random_z)
 
-def place_object_on_ground(obj):
-    # Update the object's bounding box data
-    bpy.context.view_layer.update()
-
-    # Move the object up so that its lowest point is on the ground plane (Z=0)
-    obj.location.z -= lowest_z(obj)
+# Move the object up so that its lowest point is on the ground plane (Z=0).
+# points are its world space points when they are already known (see
+# GeometrySnapshot), otherwise the corners of the bounding boxes of its
+# hierarchy are used. Returns how far it moved.
+def place_object_on_ground(obj, points=None):
+    if points is None:
+        # Update the object's bounding box data
+        bpy.context.view_layer.update()
+        points = bound_box_corners(obj)
+    offset = -float(points[:, 2].min())
+    obj.location.z += offset
+    return offset
 
 def lowest_z(obj):
-    # Find the lowest point of the object's bounding box
-    world_corners = [obj.matrix_world @
-                     Vector(corner) for corner in obj.bound_box]
-    lowest = min(corner.z for corner in world_corners)
-    for child in obj.children:
-        lowest = min(lowest, lowest_z(child))
-
-    return lowest
+    return float(bound_box_corners(obj)[:, 2].min())
+
+# World space corners of the bounding boxes of an object and its children
+# as an (n, 3) array
+def bound_box_corners(obj):
+    corners = []
+    for o in [obj] + list(obj.children_recursive):
+        box = np.array(o.bound_box, dtype=np.float64)
+        matrix = np.array(o.matrix_world, dtype=np.float64)
+        corners.append(box @ matrix[:3, :3].T + matrix[:3, 3])
+    return np.concatenate(corners)
 
 def rotate_around_z_origin(object, angle_in_degrees):
     angle_in_radians = radians(angle_in_degrees)
@@ -62,7 +73,7 @@ def set_height_by_angle(object, angle_in_degrees):
 
 
 # https://blender.stackexchange.com/a/158236
-def get_2d_bounding_box(obj, camera):
+def get_2d_bounding_box(obj, camera, local_points=None):
     """
     Returns camera space bounding box of mesh object.
 
@@ -70,88 +81,120 @@ def get_2d_bounding_box(obj, camera):
 
     Takes shift-x/y, lens angle and sensor size into account
     as well as perspective/ortho projections.
-    """
-    bounding_boxes = [] # bounding box for this part + children
 
-    for child in obj.children:
-        bbox = get_2d_bounding_box(child, camera)
-        if bbox is None:
-            print(f"[DEBUG] Child '{child.name}' returned None bounding box")
-        else:
-            bounding_boxes.append(bbox)
-
-    if obj.type == 'MESH':
-        print(f"[DEBUG] Processing mesh object: {obj.name}")
-        scene = bpy.context.scene
-        mat = camera.matrix_world.normalized().inverted()
-        depsgraph = bpy.context.evaluated_depsgraph_get()
-        mesh_eval = obj.evaluated_get(depsgraph)
+    local_points optionally replaces the mesh vertices with points in the
+    object's coordinates, e.g. its convex hull.
+    """
+    if local_points is not None:
+        bpy.context.view_layer.update()
+        points = world_points(obj, local_points)
+    else:
+        points = world_vertices(obj)
+    if len(points) == 0:
+        return None
+    return project_bounding_box(points, camera)
+
+# Points in an object's coordinates moved to world space
+def world_points(obj, local_points):
+    matrix = np.array(obj.matrix_world, dtype=np.float64)
+    return local_points @ matrix[:3, :3].T + matrix[:3, 3]
+
+# World space vertices of every mesh in the hierarchy as an (n, 3) array
+def world_vertices(obj):
+    depsgraph = bpy.context.evaluated_depsgraph_get()
+    arrays = []
+    for mesh_obj in mesh_objects(obj):
+        mesh_eval = mesh_obj.evaluated_get(depsgraph)
         me = mesh_eval.to_mesh()
-        me.transform(obj.matrix_world)
-        me.transform(mat)
-
-        camera = camera.data
-        frame = [-v for v in camera.view_frame(scene=scene)[:3]]
-        camera_persp = camera.type != 'ORTHO'
-
-        lx = []
-        ly = []
-
-        for v in me.vertices:
-            co_local = v.co
-            z = -co_local.z
-
-            if camera_persp:
-                if z == 0.0:
-                    lx.append(0.5)
-                    ly.append(0.5)
-                # Does it make any sense to drop these?
-                # if z <= 0.0:
-                #    continue
-                else:
-                    frame = [(v / (v.z / z)) for v in frame]
-
-            min_x, max_x = frame[1].x, frame[2].x
-            min_y, max_y = frame[0].y, frame[1].y
-
-            x = (co_local.x - min_x) / (max_x - min_x)
-            y = (co_local.y - min_y) / (max_y - min_y)
-            
-            if len(lx) == 0 or len(ly) == 0:
-                print(f"[WARN] No valid projected vertices for object {obj.name}")
-
-            lx.append(x)
-            ly.append(y)
-
-        min_x = clamp(min(lx), 0.0, 1.0)
-        max_x = clamp(max(lx), 0.0, 1.0)
-        min_y = clamp(min(ly), 0.0, 1.0)
-        max_y = clamp(max(ly), 0.0, 1.0)
-
+        co = np.empty(len(me.vertices) * 3, dtype=np.float32)
+        me.vertices.foreach_get('co', co)
         mesh_eval.to_mesh_clear()
 
-        r = scene.render
-        fac = r.resolution_percentage * 0.01
-        dim_x = r.resolution_x * fac
-        dim_y = r.resolution_y * fac
-
-        # Sanity check
-        if round((max_x - min_x) * dim_x) == 0 or round((max_y - min_y) * dim_y) == 0:
-            return (0, 0, 0, 0)
-
-        bounding_boxes.append(BoundingBox.from_xyxy(
-            x1 = round(min_x * dim_x),
-            y1 = round(dim_y - max_y * dim_y),
-            x2 = round(max_x * dim_x),
-            y2 = round(max_y * dim_y),
-        ))
-
-    if len(bounding_boxes) == 0:
+        matrix = np.array(mesh_obj.matrix_world, dtype=np.float64)
+        arrays.append(co.reshape(-1, 3) @ matrix[:3, :3].T + matrix[:3, 3])
+
+    if len(arrays) == 0:
+        return np.empty((0, 3))
+    return np.concatenate(arrays)
+
+# Points on the convex hull of an (n, 3) array of points. Any projection
+# of the points has its extremes at these points.
+def convex_hull(points):
+    points = np.unique(points, axis=0)
+    if len(points) < 4:
+        return points
+
+    # Build a temporary mesh so bmesh can read the points in one go
+    mesh = bpy.data.meshes.new("lego-rendering-hull")
+    mesh.vertices.add(len(points))
+    mesh.vertices.foreach_set('co', points.astype(np.float32).ravel())
+    bm = bmesh.new()
+    bm.from_mesh(mesh)
+    bpy.data.meshes.remove(mesh)
+
+    result = bmesh.ops.convex_hull(bm, input=bm.verts[:])
+    hull = [vert.co[:] for vert in result['geom'] if isinstance(vert, bmesh.types.BMVert)]
+    bm.free()
+
+    # Flat or degenerate input has no hull, keep every point
+    if len(hull) == 0:
+        return points
+    return np.array(hull, dtype=np.float64)
+
+def mesh_objects(obj):
+    objects = [obj] if obj.type == 'MESH' else []
+    for child in obj.children:
+        objects.extend(mesh_objects(child))
+    return objects
+
+# Project world space points into the camera frame and return the pixel
+# bounding box enclosing them. camera_matrix is the camera's world matrix
+# when it moved since the scene was last updated, see frame_camera.
+def project_bounding_box(points, camera, camera_matrix=None):
+    scene = bpy.context.scene
+    if camera_matrix is None:
+        matrix = np.array(camera.matrix_world.normalized().inverted(), dtype=np.float64)
+    else:
+        matrix = np.linalg.inv(camera_matrix)
+    co = points @ matrix[:3, :3].T + matrix[:3, 3]
+
+    frame = [-v for v in camera.data.view_frame(scene=scene)[:3]]
+    min_x, max_x = frame[1].x, frame[2].x
+    min_y, max_y = frame[0].y, frame[1].y
+
+    if camera.data.type != 'ORTHO':
+        # Scale the frame to the depth of each point
+        z = -co[:, 2]
+        on_camera_plane = z == 0.0
+        scale = np.where(on_camera_plane, 1.0, z) / frame[0].z
+        x = (co[:, 0] - min_x * scale) / ((max_x - min_x) * scale)
+        y = (co[:, 1] - min_y * scale) / ((max_y - min_y) * scale)
+        x[on_camera_plane] = 0.5
+        y[on_camera_plane] = 0.5
+    else:
+        x = (co[:, 0] - min_x) / (max_x - min_x)
+        y = (co[:, 1] - min_y) / (max_y - min_y)
+
+    min_x = clamp(float(x.min()), 0.0, 1.0)
+    max_x = clamp(float(x.max()), 0.0, 1.0)
+    min_y = clamp(float(y.min()), 0.0, 1.0)
+    max_y = clamp(float(y.max()), 0.0, 1.0)
+
+    r = scene.render
+    fac = r.resolution_percentage * 0.01
+    dim_x = r.resolution_x * fac
+    dim_y = r.resolution_y * fac
+
+    # Sanity check
+    if round((max_x - min_x) * dim_x) == 0 or round((max_y - min_y) * dim_y) == 0:
         return None
 
-    # combine all bounding boxes in a single box enclosing all
-    print(f"[DEBUG] Final combined bounding box from {len(bounding_boxes)} boxes")
-    return reduce(lambda a, b: a.combine(b), bounding_boxes)
+    return BoundingBox.from_xyxy(
+        x1 = round(min_x * dim_x),
+        y1 = round(dim_y - max_y * dim_y),
+        x2 = round(max_x * dim_x),
+        y2 = round(dim_y - min_y * dim_y),
+    )
 
 def draw_bounding_box(bounding_box, input_filename):
     from PIL import Image, ImageDraw
@@ -172,6 +215,25 @@ def zoom_camera(camera, percentage):
     # Move the camera along the scaled vector
     camera.location += scaled_vector
 
+# Frame the points with the camera and zoom in or out like zoom_camera.
+# Replaces selecting the objects, camera_to_view_selected and zoom_camera.
+# Returns the camera's new world matrix (it has no parent), which
+# camera.matrix_world only shows after the scene is updated.
+def frame_camera(camera, points, zoom=1.0, scene=None):
+    render = (scene or bpy.context.scene).render
+    rotation = np.array(camera.rotation_euler.to_matrix(), dtype=np.float64)
+    location = camera_fit_location(
+        points, rotation, camera.data.lens, camera.data.sensor_width, camera.data.sensor_height, camera.data.sensor_fit,
+        render.resolution_x * render.pixel_aspect_x, render.resolution_y * render.pixel_aspect_y)
+    # zoom_camera moves along the camera's local z axis by 1 - zoom
+    location = location + rotation[:, 2] * (1.0 - zoom)
+    camera.location = tuple(location)
+
+    matrix = np.identity(4)
+    matrix[:3, :3] = rotation
+    matrix[:3, 3] = location
+    return matrix
+
 def select_hierarchy(obj):
     obj.select_set(True)
     for child in obj.children:
@@ -183,7 +245,19 @@ def change_object_color(obj, new_color, options):
     material.node_tree.nodes["Group"].inputs[0].default_value = new_color
     return
 
+def set_material_color(material, new_color, alpha=None):
+    # The ImportLDraw addon builds each material around a node group
+    # with the color as its first input. Our own materials (see
+    # native_import.py) are a Principled BSDF, transparent ones use
+    # transmission instead of alpha.
+    for node in material.node_tree.nodes:
+        if node.type == 'GROUP' and len(node.inputs) > 0:
+            node.inputs[0].default_value = new_color
+            if alpha is not None and 'Alpha' in node.inputs:
+                node.inputs['Alpha'].default_value = alpha
+        elif node.type == 'BSDF_PRINCIPLED':
+            node.inputs['Base Color'].default_value = new_color
+
 
 def file_exists(pattern, search_path):
-    matching = glob.glob(os.path.join(search_path, '**', pattern), recursive=True)
-    return len(matching) > 0
\ No newline at end of file
+    return len(ldraw_index(search_path).matching(pattern)) > 0
\ No newline at end of file
@@ -10,6 +10,7 @@ sys.path.insert(0, dir_path)
 
 from lib.image_utils import grid, get_default_font
 from lib.renderer.renderer import Renderer
+from lib.renderer.dat import ldraw_dat_exists
 from lib.renderer.render_options import RenderOptions, Quality, LightingStyle, Look
 from lib.colors import RebrickableColors, RebrickableColorsById
 
@@ -48,9 +49,8 @@ for color_id in color_ids:
   if color_id not in RebrickableColorsById:
     raise ValueError(f"Color {color_id} does not exist")
 for part_num in part_nums:
-  filename = f"./ldraw/parts/{part_num}.dat"
-  if not os.path.isfile(filename):
-    raise ValueError(f"File {filename} does not exist")
+  if not ldraw_dat_exists(part_num):
+    raise ValueError(f"Part {part_num} does not exist in ./ldraw")
 
 
 for i in range(num_images):
@@ -10,7 +10,8 @@ sys.path.insert(0, dir_path)
 
 from lib.image_utils import grid, get_default_font
 from lib.renderer.renderer import Renderer
-from lib.renderer.render_options import RenderOptions, Quality, LightingStyle, Material
+from lib.renderer.dat import ldraw_dat_exists
+from lib.renderer.render_options import RenderOptions, Quality, LightingStyle, Material, BackgroundType, Format, FORMAT_EXTENSIONS
 from lib.colors import RebrickableColors, RebrickableColorsById
 
 
@@ -46,6 +47,19 @@ num_images = 4000
 # Draft (1s per image on M1 Pro Mac) or Normal (10s per image on M1 Pro Mac)
 quality = Quality.NORMAL
 
+# Image format, the file names get its extension
+image_format = Format.JPEG
+
+# Images per Cycles render. Above 1 each part is rendered once on a
+# transparent background with its shadow and composited onto this many
+# backgrounds (white, photos and generated), see lib/renderer/compositing.py
+backgrounds_per_render = 1
+
+# Parts per image. Above 1 the parts are spread over the ground and the
+# label file has a line for each
+parts_per_render = 1
+max_overlap = 0.0
+
 dataset_path = f"./renders/{dataset_name}"
 dataset_yaml_path = f"./renders/{dataset_name}.yaml"
 
@@ -53,42 +67,55 @@ os.makedirs(dataset_path, exist_ok=True)
 os.makedirs(os.path.join(dataset_path, "images"), exist_ok=True)
 os.makedirs(os.path.join(dataset_path, "labels"), exist_ok=True)
 
-renderer = Renderer(ldraw_path="./ldraw")
+# Images are written in the background while the next one renders
+renderer = Renderer(ldraw_path="./ldraw", output_threads=2)
 
 # Check colors and parts
 for color_id in color_ids:
   if color_id not in RebrickableColorsById:
     raise ValueError(f"Color {color_id} does not exist")
 for ldraw_id in ldraw_ids:
-  filename = f"./ldraw/parts/{ldraw_id}.dat"
-  if not os.path.isfile(filename):
-    raise ValueError(f"File {filename} does not exist")
+  if not ldraw_dat_exists(ldraw_id):
+    raise ValueError(f"Part {ldraw_id} does not exist in ./ldraw")
 
 # Generate images
-for i in range(num_images):
-    color_id = random.choice(color_ids)
-    color = RebrickableColorsById[color_id]
-    ldraw_id = random.choices(ldraw_ids, weights=weights)[0]
-
-    image_filename = os.path.join(dataset_path, "images", f"{color_id}_{ldraw_id}_{i}.png")
-    label_filename = os.path.join(dataset_path, "labels", f"{color_id}_{ldraw_id}_{i}.txt")
-
-    options = RenderOptions(
-        image_filename = image_filename,
-        label_filename= label_filename,
-        quality = quality,
-        lighting_style = random.choices([LightingStyle.DEFAULT, LightingStyle.HARD], [72, 25])[0],
-        light_angle = random.uniform(0, 360),
-        part_color = color.best_hex,
-        material = Material.TRANSPARENT if color.is_transparent else Material.PLASTIC,
-        part_rotation=(random.uniform(0, 360), random.uniform(0, 360), random.uniform(0, 360)),
-        camera_height=random.uniform(15, 90),
-        width=244,
-        height=244,
-        zoom=0.1,
-    )
-
-    renderer.render_part(ldraw_id, options)
+for i in range(0, num_images, backgrounds_per_render):
+    parts = []
+    for j in range(parts_per_render):
+        color_id = random.choice(color_ids)
+        color = RebrickableColorsById[color_id]
+        ldraw_id = random.choices(ldraw_ids, weights=weights)[0]
+        if j == 0:
+            # File names, size and lighting come from the first part
+            image_filename = os.path.join(dataset_path, "images", f"{color_id}_{ldraw_id}_{i}{FORMAT_EXTENSIONS[image_format][0]}")
+            label_filename = os.path.join(dataset_path, "labels", f"{color_id}_{ldraw_id}_{i}.txt")
+
+        options = RenderOptions(
+            image_filename = image_filename,
+            label_filename= label_filename,
+            format = image_format,
+            quality = quality,
+            lighting_style = random.choices([LightingStyle.DEFAULT, LightingStyle.HARD], [72, 25])[0],
+            light_angle = random.uniform(0, 360),
+            part_color = color.best_hex,
+            material = Material.TRANSPARENT if color.is_transparent else Material.PLASTIC,
+            part_rotation=(random.uniform(0, 360), random.uniform(0, 360), random.uniform(0, 360)),
+            camera_height=random.uniform(15, 90),
+            width=244,
+            height=244,
+            zoom=0.1,
+        )
+        if backgrounds_per_render > 1:
+            options.background_type = BackgroundType.COMPOSITED
+            options.composite_count = backgrounds_per_render
+        parts.append((ldraw_id, options))
+
+    if parts_per_render > 1:
+        renderer.render_scene(parts, max_overlap=max_overlap)
+    else:
+        renderer.render_part(*parts[0])
 
     # print percentage complete as 0-100% with no decimal places
     print(f"{i / num_images * 100:.0f}% complete...")
+
+renderer.close()
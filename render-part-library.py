@@ -11,7 +11,7 @@ sys.path.insert(0, dir_path)
 
 from lib.renderer.dat import ldraw_dat_exists
 from lib.renderer.renderer import Renderer
-from lib.renderer.render_options import RenderOptions, Quality, LightingStyle, Look, Format
+from lib.renderer.render_options import RenderOptions, Quality, LightingStyle, Look, Format, Engine
 from lib.colors import RebrickableColors
 
 csv_file_path = '../lego-inventory/sorter-10000.csv'
@@ -28,6 +28,10 @@ with open(csv_file_path, mode='r') as csv_file:
 
 RENDER_DIR ="./renders/part-library"
 
+# Line art thumbnails don't need path tracing, workbench is much faster.
+# See benchmark-engines.py to compare against Engine.CYCLES.
+ENGINE = Engine.WORKBENCH
+
 os.makedirs(RENDER_DIR, exist_ok=True)
 
 renderer = Renderer(ldraw_path="./ldraw")
@@ -58,6 +62,7 @@ for (part_num, ldraw_id) in ids:
         part_rotation=(0, 0, 0),
         zoom=1,
         look=Look.INSTRUCTIONS,
+        engine=ENGINE,
         width=150,
         height=150,
     )
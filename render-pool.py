@@ -0,0 +1,123 @@
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+# This script runs with regular Python, not under Blender. It starts
+# Blender workers that render jobs from a queue. Jobs are added to the
+# queue by the dataset scripts, e.g.:
+#
+#   ./run.sh render-random-views.py -- --queue render_queue.db --plan-only
+#   python render-pool.py --queue render_queue.db --workers 16
+#
+# Each job's render time is estimated from the part's geometry and its
+# options (see lib/renderer/cost_model.py) and workers take the slowest jobs
+# first. The estimates improve as jobs finish. Add --dry-run to only print
+# how long the plan is expected to take.
+dir_path = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, dir_path)
+
+from lib.renderer.job_queue import JobQueue, PENDING, LEASED, DONE, FAILED
+from lib.renderer.dat_graph import analyze_parts
+from lib.renderer.cost_model import CostModel, job_features, schedule_makespan
+
+parser = argparse.ArgumentParser(description="Render queued jobs with a pool of Blender workers")
+parser.add_argument("--queue", default="render_queue.db")
+parser.add_argument("--workers", type=int, default=os.cpu_count())
+parser.add_argument("--threads", type=int, default=None, help="render threads per worker, defaults to cores / workers")
+parser.add_argument("--blender", default="blender")
+parser.add_argument("--lease-seconds", type=float, default=300)
+parser.add_argument("--ldraw-path", default="./ldraw")
+parser.add_argument("--log-dir", default="./renders/logs")
+parser.add_argument("--metrics", action="store_true", help="record stage timings, see summarize-metrics.py")
+parser.add_argument("--native-import", action="store_true", help="build parts without the ImportLDraw operator, see lib/renderer/ldraw_mesh.py")
+parser.add_argument("--cost-model", default="./cache/cost-model.json", help="render time estimates learned from earlier batches")
+parser.add_argument("--dry-run", action="store_true", help="print the estimated time to render the plan and exit")
+args = parser.parse_args()
+
+threads = args.threads or max(1, os.cpu_count() // args.workers)
+os.makedirs(args.log_dir, exist_ok=True)
+
+def start_worker(name):
+    log = open(os.path.join(args.log_dir, f"{name}.log"), "a")
+    command = [
+        args.blender, "--background", "--threads", str(threads),
+        "--python", os.path.join(dir_path, "render-worker.py"), "--",
+        "--queue", args.queue,
+        "--worker", name,
+        "--lease-seconds", str(args.lease_seconds),
+        "--ldraw-path", args.ldraw_path,
+    ]
+    if args.native_import:
+        command.append("--native-import")
+    if args.metrics:
+        command += ["--metrics", os.path.join(args.log_dir, f"{name}.metrics.jsonl")]
+    return subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT)
+
+def format_duration(seconds):
+    hours, minutes = divmod(int(seconds) // 60, 60)
+    return f"{hours}h {minutes:02d}m"
+
+queue = JobQueue(args.queue)
+model = CostModel(args.cost_model)
+part_stats = analyze_parts(queue.ldraw_ids(), args.ldraw_path)
+learned = model.learn_from_queue(queue, part_stats)  # jobs done by an earlier run of this plan
+features = {job_id: job_features(options, part_stats.get(ldraw_id)) for job_id, ldraw_id, options in queue.pending()}
+
+def estimate_costs():
+    costs = {job_id: model.predict(job) for job_id, job in features.items()}
+    queue.set_costs(costs)
+    return costs
+
+costs = estimate_costs()
+longest_first, per_worker = schedule_makespan(sorted(costs.values(), reverse=True), args.workers)
+print(f"{len(costs)} jobs, {format_duration(sum(costs.values()))} of rendering, estimated from {model.count} measured renders")
+print(f"Estimated time on {args.workers} workers: {format_duration(longest_first)}, busiest worker {format_duration(per_worker[0])}, least busy {format_duration(per_worker[-1])}")
+if args.dry_run:
+    in_order, _ = schedule_makespan([costs[job_id] for job_id in sorted(costs)], args.workers)
+    print(f"Estimated time in plan order: {format_duration(in_order)}")
+    model.save()
+    queue.close()
+    sys.exit(0)
+
+print(f"Starting {args.workers} workers with {threads} threads each")
+workers = {f"w{i}": start_worker(f"w{i}") for i in range(args.workers)}
+
+try:
+    while True:
+        time.sleep(10)
+        requeued = queue.requeue_expired()
+        if requeued:
+            print(f"Re-queued {requeued} jobs with expired leases")
+
+        # Re-estimate the remaining jobs once there are enough new measurements
+        learned += model.learn_from_queue(queue, part_stats)
+        if learned >= max(20, model.count // 10):
+            estimate_costs()
+            model.save()
+            learned = 0
+
+        counts = queue.counts()
+        print(f"pending: {counts[PENDING]} rendering: {counts[LEASED]} done: {counts[DONE]} failed: {counts[FAILED]}")
+
+        # Workers exit when the queue is empty. If one died while there
+        # is still work to do (including re-queued jobs) start a new one.
+        for name, process in list(workers.items()):
+            if process.poll() is not None:
+                print(f"Worker {name} exited with code {process.returncode}")
+                del workers[name]
+        for i in range(args.workers):
+            if f"w{i}" not in workers and counts[PENDING] > 0:
+                workers[f"w{i}"] = start_worker(f"w{i}")
+
+        if not workers and counts[PENDING] == 0 and counts[LEASED] == 0:
+            break
+except KeyboardInterrupt:
+    print("Stopping workers...")
+    for process in workers.values():
+        process.terminate()
+
+model.learn_from_queue(queue, part_stats)
+model.save()
+queue.close()
@@ -1,3 +1,4 @@
+import argparse
 import copy
 import random
 import traceback
@@ -14,6 +15,7 @@ sys.path.insert(0, dir_path)
 
 from lib.renderer.dat import ldraw_dat_exists
 from lib.renderer.renderer import Renderer
+from lib.renderer.job_queue import JobQueue, Heartbeat, render_jobs, PENDING, DONE
 from lib.renderer.render_options import Material, RenderOptions, Quality, LightingStyle, Look, Format
 from lib.colors import RebrickableColors, random_color_from_ids
 
@@ -74,6 +76,9 @@ def calculate_items_to_render(rows, num_images_per_part):
 
         image_filename = os.path.join(RENDER_DIR, str(part_num), f"{part_num}_random{i:02}.jpg")
         label_filename = os.path.join(RENDER_DIR, str(part_num), f"{part_num}_random{i:02}.txt")
+
+        # Only checked once when the plan is created, e.g. for datasets
+        # rendered before there was a plan
         if os.path.exists(image_filename) and os.path.exists(label_filename):
           print(f"------ Skipping {image_filename}, already exists")
           continue
@@ -97,28 +102,46 @@ def calculate_items_to_render(rows, num_images_per_part):
     random.shuffle(items)
     return sorted(items, key=lambda x: x[0])
 
+# Everything to render is planned once and written to a plan (a job queue).
+# Restarting picks up the jobs that aren't done yet instead of checking every
+# output file. Pass --plan-only to only write the plan, e.g. to render it with
+# render-pool.py. Blender passes everything after -- to the script.
+argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else []
+parser = argparse.ArgumentParser()
+parser.add_argument("--queue", default=os.path.join(RENDER_DIR, "plan.db"))
+parser.add_argument("--plan-only", action="store_true")
+args = parser.parse_args(argv)
+
 os.makedirs(RENDER_DIR, exist_ok=True)
-renderer = Renderer(ldraw_path="./ldraw")
-rows = read_csv_file(classifed_parts_csv_file)
-items = calculate_items_to_render(rows, NUM_IMAGES_PER_CLASSIFED_PART)
-rows = read_csv_file(other_parts_csv_file)
-items += calculate_items_to_render(rows, NUM_IMAGES_PER_OTHER_PART)
-
-print(f"------ {len(items)} images to render")
-
-for (i, options, ldraw_id) in items:
-  try:
-    # Check filesystem again in case another process is rendering as well
-    if os.path.exists(options.image_filename) and os.path.exists(options.label_filename):
-      print(f"------ Skipping {options.image_filename}, already exists")
-      continue
-    if os.path.exists(options.image_filename) and not os.path.exists(options.label_filename):
-      print(f"------ Regenerating {options.image_filename} with bounding box")
-      os.remove(options.image_filename)
-
-    print(f"------ Rendering {options.image_filename}...")
-    renderer.render_part(ldraw_id, options)
-  except Exception as e:
-    print(f"------ ERROR: {options.image_filename} failed to render: {e}")
-    traceback.print_exc()
-    continue
+queue = JobQueue(args.queue)
+
+if queue.total == 0:
+  rows = read_csv_file(classifed_parts_csv_file)
+  items = calculate_items_to_render(rows, NUM_IMAGES_PER_CLASSIFED_PART)
+  rows = read_csv_file(other_parts_csv_file)
+  items += calculate_items_to_render(rows, NUM_IMAGES_PER_OTHER_PART)
+  queue.add_many([(ldraw_id, options) for (i, options, ldraw_id) in items])
+  print(f"------ Planned {len(items)} images in {args.queue}")
+else:
+  print(f"------ Resuming plan {args.queue}")
+
+counts = queue.counts()
+print(f"------ {counts[PENDING]} images to render, {counts[DONE]} done")
+
+if args.plan_only:
+  queue.close()
+  sys.exit(0)
+
+# Images and labels are written to a temporary file and renamed, so there
+# are no partial outputs to clean up after a crash. The lease lets more than
+# one process render the same plan. It is kept short and extended by a
+# heartbeat, so jobs leased by a run that crashed go back to pending within
+# a minute when the plan is resumed.
+LEASE_SECONDS = 60
+worker = f"render-random-views-{os.getpid()}"
+heartbeat = Heartbeat(args.queue, worker, LEASE_SECONDS)
+renderer = Renderer(ldraw_path="./ldraw", output_threads=2)
+render_jobs(queue, renderer, worker, LEASE_SECONDS, heartbeat=heartbeat)
+renderer.close()
+heartbeat.stop()
+queue.close()
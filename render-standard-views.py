@@ -57,6 +57,7 @@ for (part_num, ldraw_id, color_ids, material_id) in rows:
     views = []
     views.extend([(0, 0, 45, 10), (0, 0, 45+90, 10), (0, 0, 45+180, 10), (0, 0, 45+270, 10)]) # front, left, back, right
     views.extend({(0, 0, 0, 90), (180, 0, 0, 90)}) # top, bottom
+    options_list = []
     for ((rx, ry, rz, camera_height)) in views:
       image_filename = os.path.join(RENDER_DIR, str(part_num), f"{part_num}_{rx}_{ry}_{rz}_{camera_height}.jpg")
       label_filename = os.path.join(RENDER_DIR, str(part_num), f"{part_num}_{rx}_{ry}_{rz}_{camera_height}.txt")
@@ -81,7 +82,10 @@ for (part_num, ldraw_id, color_ids, material_id) in rows:
       options.zoom = random.uniform(.99, 1.0)
       options.part_color = color.best_hex
       options.material = material
-      renderer.render_part(ldraw_id, options)
+      options_list.append(options)
+
+    # All views of a part share one import
+    renderer.render_views(ldraw_id, options_list)
   except Exception as e:
     print(f"------ ERROR: {part_num} failed to render: {e}")
     traceback.print_exc()
@@ -0,0 +1,37 @@
+import argparse
+import sys
+import os
+
+# This script runs under Blender's python environment. Add the current
+# directly to the path so we can import our own modules
+dir_path = os.path.dirname(os.path.realpath(__file__))
+print(f"Prepending {dir_path} to Python path...")
+sys.path.insert(0, dir_path)
+
+from lib.renderer.renderer import Renderer
+from lib.renderer.job_queue import JobQueue, Heartbeat, render_jobs
+
+# Render jobs from a queue until it is empty. Started by render-pool.py:
+#
+#   blender --background --python render-worker.py -- --queue render_queue.db --worker w0
+#
+# Blender passes everything after -- to the script
+argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else []
+parser = argparse.ArgumentParser()
+parser.add_argument("--queue", default="render_queue.db")
+parser.add_argument("--worker", default=f"worker-{os.getpid()}")
+parser.add_argument("--lease-seconds", type=float, default=300)
+parser.add_argument("--ldraw-path", default="./ldraw")
+parser.add_argument("--metrics", default=None, help="append stage timings to this JSONL file")
+parser.add_argument("--output-threads", type=int, default=2, help="threads encoding and writing images, 0 to write before the next render")
+parser.add_argument("--native-import", action="store_true", help="build parts from the .dat files without the ImportLDraw operator")
+args = parser.parse_args(argv)
+
+queue = JobQueue(args.queue)
+heartbeat = Heartbeat(args.queue, args.worker, args.lease_seconds)
+renderer = Renderer(ldraw_path=args.ldraw_path, metrics_filename=args.metrics, output_threads=args.output_threads, native_import=args.native_import)
+render_jobs(queue, renderer, args.worker, args.lease_seconds, heartbeat=heartbeat)
+renderer.close()
+heartbeat.stop()
+queue.close()
+print(f"------ [{args.worker}] No jobs left")
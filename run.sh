@@ -2,4 +2,4 @@
 
 set -e
 
-blender --background --python $1
+blender --background --python $1 "${@:2}"
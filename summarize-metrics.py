@@ -0,0 +1,77 @@
+import argparse
+import json
+from collections import defaultdict
+
+# Summarize the metrics written by Renderer(metrics_filename=...). Runs with
+# regular Python, not under Blender:
+#
+#   python summarize-metrics.py renders/logs/*.metrics.jsonl
+
+parser = argparse.ArgumentParser(description="Summarize render stage timings")
+parser.add_argument("filenames", nargs="+")
+parser.add_argument("--top", type=int, default=20, help="number of slowest parts to show")
+args = parser.parse_args()
+
+def percentile(values, p):
+    values = sorted(values)
+    index = (len(values) - 1) * p / 100
+    lower = int(index)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (index - lower)
+
+def print_row(name, values):
+    print(f"{name:<28} {len(values):>7} {percentile(values, 50):>8.3f} {percentile(values, 90):>8.3f} {percentile(values, 99):>8.3f} {max(values):>8.3f} {sum(values):>10.1f}")
+
+records = []
+for filename in args.filenames:
+    with open(filename) as f:
+        for line in f:
+            if line.strip():
+                records.append(json.loads(line))
+
+stages = defaultdict(list)
+stage_peaks = defaultdict(list)
+parts = defaultdict(list)
+# The highest peak memory of any render of the part
+part_peaks = {}
+for record in records:
+    for name, stage in record["stages"].items():
+        stages[name].append(stage["seconds"])
+        if stage.get("peak_rss_mb") is not None:
+            stage_peaks[name].append(stage["peak_rss_mb"])
+    parts[record["part"]].append(record["seconds"])
+    peak = record.get("peak_rss_mb")
+    if peak is not None:
+        part_peaks[record["part"]] = max(part_peaks.get(record["part"], peak), peak)
+
+total = sum(record["seconds"] for record in records)
+cached = sum(1 for record in records if record.get("cached"))
+print(f"{len(records)} renders, {len(parts)} parts, {total:.1f}s total, {cached} with a cached part")
+print()
+
+header = f"{'':<28} {'count':>7} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8} {'total':>10}"
+print("Seconds per stage")
+print(header)
+for name, values in sorted(stages.items(), key=lambda item: -sum(item[1])):
+    print_row(name, values)
+print_row("render_part", [record["seconds"] for record in records])
+print()
+
+print(f"Slowest {args.top} parts by median seconds per render")
+print(header)
+slowest = sorted(parts.items(), key=lambda item: -percentile(item[1], 50))[:args.top]
+for part, values in slowest:
+    print_row(part, values)
+print()
+
+if stage_peaks:
+    print("Peak memory per stage (MB)")
+    print(f"{'':<28} {'count':>7} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8}")
+    for name, values in sorted(stage_peaks.items(), key=lambda item: -max(item[1])):
+        print(f"{name:<28} {len(values):>7} {percentile(values, 50):>8.0f} {percentile(values, 90):>8.0f} {percentile(values, 99):>8.0f} {max(values):>8.0f}")
+    print()
+
+if part_peaks:
+    print(f"Highest {args.top} parts by peak memory per render (MB)")
+    for part, peak in sorted(part_peaks.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"{part:<28} {peak:>8.0f}")
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Import our own modules like the scripts at the top of the repository do
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
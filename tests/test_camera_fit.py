@@ -0,0 +1,154 @@
+import numpy as np
+import pytest
+from math import radians
+
+from lib.renderer.camera_fit import camera_fit_location
+
+# Shapes to frame: a cube, a long flat brick away from the origin and a
+# random cloud of points
+def shapes():
+    corners = np.array([[x, y, z] for x in (-1, 1) for y in (-1, 1) for z in (-1, 1)], dtype=np.float64)
+    brick = corners * [4.0, 0.5, 0.15] + [3.0, -2.0, 0.15]
+    cloud = np.random.default_rng(7).normal(size=(200, 3)) * [1.0, 2.0, 0.5] + [-1.0, 0.5, 1.0]
+    return {"cube": corners, "brick": brick, "cloud": cloud}
+
+# Camera rotations as Blender XYZ euler angles in degrees, from nearly top
+# down to nearly level, one with a roll
+ANGLES = [(20, 0, 200), (60, 0, 45), (80, 0, -30), (70, 10, 30)]
+
+# (resolution x, resolution y, sensor fit)
+FRAMES = [
+    (224, 224, 'AUTO'),
+    (640, 360, 'AUTO'),
+    (360, 640, 'AUTO'),
+    (640, 360, 'VERTICAL'),
+    (360, 640, 'HORIZONTAL'),
+]
+
+LENSES = [50, 120]
+SENSOR_WIDTH = 36
+SENSOR_HEIGHT = 24
+
+CASES = [(shape, angles, frame, lens) for shape in shapes() for angles in ANGLES for frame in FRAMES for lens in LENSES]
+
+def euler_matrix(angles):
+    x, y, z = (radians(angle) for angle in angles)
+    rx = np.array([[1, 0, 0], [0, np.cos(x), -np.sin(x)], [0, np.sin(x), np.cos(x)]])
+    ry = np.array([[np.cos(y), 0, np.sin(y)], [0, 1, 0], [-np.sin(y), 0, np.cos(y)]])
+    rz = np.array([[np.cos(z), -np.sin(z), 0], [np.sin(z), np.cos(z), 0], [0, 0, 1]])
+    return rz @ ry @ rx
+
+# Half the frame at distance 1, worked out like Blender's
+# BKE_camera_params_compute_viewplane with square pixels
+def half_frame(lens, resolution_x, resolution_y, sensor_fit):
+    if sensor_fit == 'AUTO':
+        sensor_fit = 'HORIZONTAL' if resolution_x >= resolution_y else 'VERTICAL'
+        sensor_size = SENSOR_WIDTH
+    else:
+        sensor_size = SENSOR_HEIGHT if sensor_fit == 'VERTICAL' else SENSOR_WIDTH
+    view = resolution_x if sensor_fit == 'HORIZONTAL' else resolution_y
+    pixel = sensor_size / lens / view
+    return 0.5 * resolution_x * pixel, 0.5 * resolution_y * pixel
+
+# Where camera_to_view_selected puts the camera, following Blender's
+# camera_frame_fit_calc_from_data: each side plane of the frame is pushed
+# out to the furthest point, opposite planes meet in a line and the camera
+# goes to the point on those two lines that is furthest back.
+def operator_location(points, rotation, half_x, half_y):
+    right, up, forward = rotation[:, 0], rotation[:, 1], -rotation[:, 2]
+    normals = [right - half_x * forward, up - half_y * forward, -right - half_x * forward, -up - half_y * forward]
+    normals = [normal / np.linalg.norm(normal) for normal in normals]
+    distances = [np.max(points @ normal) for normal in normals]
+
+    def plane_plane(a, b):
+        direction = np.cross(normals[a], normals[b])
+        point = np.linalg.solve(np.array([normals[a], normals[b], direction]), [distances[a], distances[b], 0])
+        return point, direction
+
+    point_1, direction_1 = plane_plane(0, 2)
+    point_2, direction_2 = plane_plane(1, 3)
+
+    # Closest points of the two lines
+    offset = point_2 - point_1
+    d11, d12, d22 = direction_1 @ direction_1, direction_1 @ direction_2, direction_2 @ direction_2
+    denominator = d11 * d22 - d12 * d12
+    s = (offset @ direction_1 * d22 - offset @ direction_2 * d12) / denominator
+    t = (offset @ direction_1 * d12 - offset @ direction_2 * d11) / denominator
+    closest_1 = point_1 + s * direction_1
+    closest_2 = point_2 + t * direction_2
+    return closest_1 if (closest_2 - closest_1) @ forward > 0 else closest_2
+
+def fit(points, angles, frame, lens):
+    resolution_x, resolution_y, sensor_fit = frame
+    return camera_fit_location(points, euler_matrix(angles), lens, SENSOR_WIDTH, SENSOR_HEIGHT, sensor_fit, resolution_x, resolution_y)
+
+@pytest.mark.parametrize("shape,angles,frame,lens", CASES)
+def test_matches_operator_construction(shape, angles, frame, lens):
+    points = shapes()[shape]
+    resolution_x, resolution_y, sensor_fit = frame
+    half_x, half_y = half_frame(lens, resolution_x, resolution_y, sensor_fit)
+    expected = operator_location(points, euler_matrix(angles), half_x, half_y)
+    assert np.allclose(fit(points, angles, frame, lens), expected, rtol=1e-9, atol=1e-9)
+
+# Every point is in the frame and the tighter direction touches both sides
+@pytest.mark.parametrize("shape,angles,frame,lens", CASES)
+def test_points_fill_the_frame(shape, angles, frame, lens):
+    points = shapes()[shape]
+    rotation = euler_matrix(angles)
+    location = fit(points, angles, frame, lens)
+    local = (points - location) @ rotation
+    depth = -local[:, 2]
+    resolution_x, resolution_y, sensor_fit = frame
+    half_x, half_y = half_frame(lens, resolution_x, resolution_y, sensor_fit)
+    x = local[:, 0] / depth / half_x
+    y = local[:, 1] / depth / half_y
+    assert (depth > 0).all()
+    assert np.abs(x).max() <= 1 + 1e-9 and np.abs(y).max() <= 1 + 1e-9
+    touching = [np.isclose(x.max(), 1) and np.isclose(x.min(), -1), np.isclose(y.max(), 1) and np.isclose(y.min(), -1)]
+    assert any(touching)
+
+# The operator itself, under Blender's python. Compared on every vertex of a
+# mesh, like the operator reads them.
+@pytest.mark.parametrize("shape,angles,frame,lens", CASES[::7])
+def test_matches_operator(shape, angles, frame, lens):
+    bpy = pytest.importorskip("bpy")
+    from lib.renderer.utils import frame_camera, zoom_camera
+
+    points = shapes()[shape]
+    resolution_x, resolution_y, sensor_fit = frame
+    scene = bpy.context.scene
+    scene.render.resolution_x = resolution_x
+    scene.render.resolution_y = resolution_y
+    scene.render.pixel_aspect_x = scene.render.pixel_aspect_y = 1
+
+    data = bpy.data.meshes.new("test-camera-fit")
+    data.from_pydata(points.tolist(), [], [])
+    obj = bpy.data.objects.new("test-camera-fit", data)
+    scene.collection.objects.link(obj)
+    camera_data = bpy.data.cameras.new("test-camera-fit")
+    camera_data.lens = lens
+    camera_data.sensor_width = SENSOR_WIDTH
+    camera_data.sensor_height = SENSOR_HEIGHT
+    camera_data.sensor_fit = sensor_fit
+    camera = bpy.data.objects.new("test-camera-fit-camera", camera_data)
+    scene.collection.objects.link(camera)
+    scene.camera = camera
+    try:
+        camera.rotation_euler = tuple(radians(angle) for angle in angles)
+        bpy.ops.object.select_all(action='DESELECT')
+        obj.select_set(True)
+        bpy.ops.view3d.camera_to_view_selected()
+        expected = np.array(camera.location)
+        assert np.allclose(fit(points, angles, frame, lens), expected, rtol=1e-4, atol=1e-4)
+
+        # frame_camera's zoom moves the camera like zoom_camera
+        bpy.context.view_layer.update()
+        zoom_camera(camera, 0.95)
+        expected = np.array(camera.location)
+        frame_camera(camera, points, 0.95, scene)
+        assert np.allclose(np.array(camera.location), expected, rtol=1e-4, atol=1e-4)
+    finally:
+        bpy.data.objects.remove(obj)
+        bpy.data.objects.remove(camera)
+        bpy.data.meshes.remove(data)
+        bpy.data.cameras.remove(camera_data)
@@ -0,0 +1,54 @@
+import os
+import pytest
+
+from lib.renderer import dat
+from lib.renderer.dat_graph import analyze_parts
+
+# A part with two studs, one of them from a file that isn't in the library
+FILES = {
+    "parts/1.dat": """0 Test Part
+3 16 0 0 0 1 0 0 0 0 1
+1 16 0 0 0 1 0 0 0 1 0 0 0 1 stud.dat
+1 16 20 0 0 1 0 0 0 1 0 0 0 1 stud2.dat
+""",
+    "p/stud.dat": """0 Stud
+4 16 0 0 0 1 0 0 1 0 1 0 0 1
+""",
+}
+
+def write_library(path, files):
+    for name, text in files.items():
+        filename = os.path.join(path, name)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename, "w") as f:
+            f.write(text)
+    return str(path)
+
+@pytest.fixture
+def ldraw_path(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # the library index is saved to ./cache
+    monkeypatch.setattr(dat, "indexes", {})
+    return write_library(tmp_path / "ldraw", FILES)
+
+# Like a new run of analyze-library.py, with a fresh library index
+def analyze(ldraw_ids, ldraw_path):
+    dat.indexes.clear()
+    return analyze_parts(ldraw_ids, ldraw_path, processes=1)
+
+def test_stats(ldraw_path):
+    stats = analyze(["1"], ldraw_path)["1"]
+    assert (stats.triangles, stats.quads, stats.studs) == (1, 1, 2)
+    assert stats.unresolved == {"stud2.dat"}
+
+def test_stale_once_a_missing_file_is_added(ldraw_path):
+    analyze(["1"], ldraw_path)
+    write_library(ldraw_path, {"p/stud2.dat": FILES["p/stud.dat"]})
+    stats = analyze(["1"], ldraw_path)["1"]
+    assert stats.quads == 2
+    assert not stats.unresolved
+
+def test_libraries_are_cached_separately(ldraw_path, tmp_path):
+    other_path = write_library(tmp_path / "other", {"parts/1.dat": "3 16 0 0 0 1 0 0 0 0 1\n"})
+    assert analyze(["1"], ldraw_path)["1"].quads == 1
+    assert analyze(["1"], other_path)["1"].quads == 0
+    assert analyze(["1"], ldraw_path)["1"].quads == 1
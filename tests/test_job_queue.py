@@ -0,0 +1,48 @@
+import threading
+import time
+from concurrent.futures import Future
+
+from lib.renderer.job_queue import JobQueue, Heartbeat, render_jobs, DONE
+from lib.renderer.render_options import RenderOptions
+
+LEASE_SECONDS = 0.3
+
+# Renders instantly and writes each image in the background for a few
+# lease periods. Requeues expired leases while writing, like render-pool.py.
+class SlowWriter:
+    def __init__(self, queue_path):
+        self.queue = JobQueue(queue_path)
+        self.threads = []
+        self.requeued = 0
+
+    def render_part(self, ldraw_id, options):
+        future = Future()
+        thread = threading.Thread(target=self.write, args=(future,))
+        thread.start()
+        self.threads.append(thread)
+        return future
+
+    def write(self, future):
+        queue = JobQueue(self.queue.db_path)
+        for _ in range(10):
+            time.sleep(LEASE_SECONDS / 3)
+            self.requeued += queue.requeue_expired()
+        queue.close()
+        future.set_result(None)
+
+    def wait(self):
+        for thread in self.threads:
+            thread.join()
+
+def test_leases_are_extended_while_writing(tmp_path):
+    queue_path = str(tmp_path / "queue.db")
+    queue = JobQueue(queue_path)
+    queue.add_many([("3001", RenderOptions()), ("3002", RenderOptions())])
+    renderer = SlowWriter(queue_path)
+    heartbeat = Heartbeat(queue_path, "worker", LEASE_SECONDS)
+    render_jobs(queue, renderer, "worker", LEASE_SECONDS, heartbeat=heartbeat)
+    heartbeat.stop()
+    assert renderer.requeued == 0
+    assert queue.counts()[DONE] == 2
+    assert not heartbeat.job_ids
+    queue.close()
@@ -0,0 +1,131 @@
+import os
+import numpy as np
+import pytest
+
+from lib.renderer.ldraw_mesh import LDrawMeshes, MAIN_COLOR, SCALE
+
+# A tiny library: a part made of a subpart and two studs, a stud with high
+# resolution and logo versions, and a primitive used mirrored
+FILES = {
+    "parts/1.dat": """0 Test Part
+0 BFC CERTIFY CCW
+1 16 0 0 0 1 0 0 0 1 0 0 0 1 s\\1s01.dat
+1 16 10 0 0 1 0 0 0 1 0 0 0 1 stud.dat
+1 4 20 0 0 1 0 0 0 1 0 0 0 1 stud.dat
+""",
+    "parts/s/1s01.dat": """0 Test Subpart
+0 BFC CERTIFY CW
+3 16 0 0 0 0 0 1 1 0 0
+4 2 0 1 0 1 1 0 1 1 1 0 1 1
+""",
+    "p/stud.dat": """0 Stud
+0 BFC CERTIFY CCW
+3 16 0 0 0 1 0 0 0 0 1
+""",
+    "p/48/stud.dat": """0 Stud, high resolution
+0 BFC CERTIFY CCW
+3 16 0 0 0 1 0 0 0 0 1
+3 16 1 0 0 1 0 1 0 0 1
+""",
+    "p/stud-logo4.dat": """0 Stud with a logo
+0 BFC CERTIFY CCW
+3 16 0 0 0 1 0 0 0 0 1
+3 16 1 0 0 1 0 1 0 0 1
+3 16 0 0 0 0 0 1 -1 0 0
+""",
+    "parts/2.dat": """0 Mirrored Part
+0 BFC CERTIFY CCW
+0 BFC INVERTNEXT
+1 16 0 0 0 1 0 0 0 1 0 0 0 1 tri.dat
+1 16 0 0 0 -1 0 0 0 1 0 0 0 1 tri.dat
+""",
+    "p/tri.dat": """0 Triangle
+0 BFC CERTIFY CCW
+3 16 0 0 0 1 0 0 0 0 1
+""",
+    "parts/3.dat": """0 Uncertified Part
+3 16 0 0 0 1 0 0 0 0 1
+4 16 0 0 0 1 0 0 1 0 0 0 0 1
+""",
+}
+
+@pytest.fixture
+def ldraw_path(tmp_path, monkeypatch):
+    for name, text in FILES.items():
+        path = tmp_path / "ldraw" / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(text)
+    monkeypatch.chdir(tmp_path)  # the library index is saved to ./cache
+    return str(tmp_path / "ldraw")
+
+def faces(mesh):
+    starts = mesh.loop_starts
+    return [mesh.vertices[mesh.face_vertices[start:start + size]] / SCALE for start, size in zip(starts, mesh.face_sizes)]
+
+def normal(points):
+    return np.cross(points[1] - points[0], points[2] - points[0])
+
+def test_flatten_places_subfiles(ldraw_path):
+    mesh = LDrawMeshes(ldraw_path).flatten("1", high_res=False)
+    assert list(mesh.face_sizes) == [3, 3, 3, 4]
+    # Subparts keep the part color, fixed colors stay
+    assert list(mesh.face_colors) == [MAIN_COLOR, MAIN_COLOR, 4, 2]
+    assert mesh.face_certified.all()
+    # The second stud is moved 20 units along x
+    assert np.allclose(faces(mesh)[2][0], [20, 0, 0])
+
+def test_cw_faces_are_reversed(ldraw_path):
+    triangle = faces(LDrawMeshes(ldraw_path).flatten("1", high_res=False))[0]
+    assert np.allclose(triangle, [[1, 0, 0], [0, 0, 1], [0, 0, 0]])
+
+# tri.dat faces -y. INVERTNEXT turns it around, a mirroring matrix must not.
+def test_invertnext_and_mirroring(ldraw_path):
+    inverted, mirrored = faces(LDrawMeshes(ldraw_path).flatten("2"))
+    assert normal(inverted)[1] > 0
+    assert normal(mirrored)[1] < 0
+
+def test_high_res_and_logo_studs(ldraw_path):
+    meshes = LDrawMeshes(ldraw_path)
+    assert len(meshes.flatten("1", high_res=False).face_sizes) == 4
+    assert len(meshes.flatten("1", high_res=True).face_sizes) == 6
+    assert len(meshes.flatten("1", high_res=False, logo_studs=True).face_sizes) == 8
+
+def test_uncertified_faces_and_collapsed_quads(ldraw_path):
+    mesh = LDrawMeshes(ldraw_path).flatten("3")
+    assert not mesh.face_certified.any()
+    # The quad with two welded corners is split in two triangles, the one
+    # with no area is dropped
+    assert list(mesh.face_sizes) == [3, 3]
+    assert len(mesh.vertices) == 3
+
+def test_sources(ldraw_path):
+    sources = LDrawMeshes(ldraw_path).sources("1", high_res=True, logo_studs=False)
+    relative = sorted(path[len(ldraw_path) + 1:].replace("\\", "/") for path in sources)
+    assert relative == ["p/48/stud.dat", "parts/1.dat", "parts/s/1s01.dat"]
+
+def test_missing_part(ldraw_path):
+    with pytest.raises(FileNotFoundError):
+        LDrawMeshes(ldraw_path).flatten("404")
+
+def test_caches_are_bounded(ldraw_path):
+    unbounded = LDrawMeshes(ldraw_path)
+    bounded = LDrawMeshes(ldraw_path, max_cache_bytes=0)
+    for ldraw_id in ["1", "2", "3", "1"]:
+        expected = unbounded.flatten(ldraw_id)
+        mesh = bounded.flatten(ldraw_id)
+        assert np.array_equal(mesh.vertices, expected.vertices)
+        assert np.array_equal(mesh.face_vertices, expected.face_vertices)
+        assert not bounded.files and not bounded.geometries
+        assert bounded.cache_bytes == 0
+        bounded.sources(ldraw_id)
+        assert not bounded.files and bounded.cache_bytes == 0
+    # The part's own geometry is never kept, only its subfiles'
+    parts = {os.path.join(ldraw_path, "parts", f"{ldraw_id}.dat") for ldraw_id in "123"}
+    assert unbounded.geometries and not parts & {path for path, *_ in unbounded.geometries}
+    assert unbounded.cache_bytes == sum(g.nbytes for g in unbounded.geometries.values()) + sum(f.nbytes for f in unbounded.files.values())
+
+def test_mesh_keeps_max_parts(ldraw_path):
+    meshes = LDrawMeshes(ldraw_path, max_parts=2)
+    for ldraw_id in ["1", "2", "3"]:
+        meshes.mesh(ldraw_id)
+    assert [key[0] for key in meshes.parts] == ["2", "3"]
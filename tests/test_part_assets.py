@@ -0,0 +1,78 @@
+import os
+import numpy as np
+import pytest
+
+from lib.renderer import dat, part_assets
+from lib.renderer.ldraw_mesh import LDrawMeshes
+from lib.renderer.part_assets import PartAssets, file_hash
+
+# A part with a stud that has a high resolution version but no logo versions
+FILES = {
+    "parts/1.dat": """0 Test Part
+0 BFC CERTIFY CCW
+1 16 0 0 0 1 0 0 0 1 0 0 0 1 stud.dat
+""",
+    "p/stud.dat": """0 Stud
+0 BFC CERTIFY CCW
+3 16 0 0 0 1 0 0 0 0 1
+""",
+    "p/48/stud.dat": """0 Stud, high resolution
+0 BFC CERTIFY CCW
+3 16 0 0 0 1 0 0 0 0 1
+3 16 1 0 0 1 0 1 0 0 1
+""",
+}
+
+@pytest.fixture
+def ldraw_path(tmp_path, monkeypatch):
+    for name, text in FILES.items():
+        path = tmp_path / "ldraw" / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(text)
+    monkeypatch.chdir(tmp_path)  # the library index is saved to ./cache
+    monkeypatch.setattr(dat, "indexes", {})
+    return str(tmp_path / "ldraw")
+
+# Another worker starts, with a fresh library index
+def new_worker(ldraw_path):
+    dat.indexes.clear()
+    return PartAssets(ldraw_path=ldraw_path), LDrawMeshes(ldraw_path, assets=PartAssets(ldraw_path=ldraw_path))
+
+def test_assets_are_reused(ldraw_path):
+    assets, meshes = new_worker(ldraw_path)
+    mesh = meshes.mesh("1", high_res=True, logo_studs=True)
+    assets, _ = new_worker(ldraw_path)
+    loaded = assets.load("1", high_res=True, logo_studs=True)
+    assert np.array_equal(loaded.vertices, mesh.vertices)
+
+def test_dependencies(ldraw_path):
+    sources, unresolved = LDrawMeshes(ldraw_path).dependencies("1", high_res=True, logo_studs=True)
+    assert [os.path.relpath(path, ldraw_path).replace("\\", "/") for path in sources] == ["p/48/stud.dat", "parts/1.dat"]
+    assert unresolved == ["48/stud-logo3.dat", "48/stud-logo4.dat"]
+
+def test_asset_is_stale_once_a_missing_file_is_added(ldraw_path):
+    _, meshes = new_worker(ldraw_path)
+    meshes.mesh("1", high_res=True, logo_studs=True)
+    meshes.mesh("1", high_res=False, logo_studs=False)
+    with open(os.path.join(ldraw_path, "p", "48", "stud-logo4.dat"), "w") as f:
+        f.write(FILES["p/48/stud.dat"])
+    assets, _ = new_worker(ldraw_path)
+    assert assets.load("1", high_res=True, logo_studs=True) is None
+    assert assets.load("1", high_res=False, logo_studs=False) is not None
+
+def test_asset_is_stale_once_a_source_changes(ldraw_path):
+    _, meshes = new_worker(ldraw_path)
+    meshes.mesh("1", high_res=False, logo_studs=False)
+    with open(os.path.join(ldraw_path, "p", "stud.dat"), "a") as f:
+        f.write("3 16 0 0 0 0 0 1 1 0 0\n")
+    assets, _ = new_worker(ldraw_path)
+    assert assets.load("1", high_res=False, logo_studs=False) is None
+
+def test_file_hashes_keep_one_entry_per_file(ldraw_path, monkeypatch):
+    monkeypatch.setattr(part_assets, "file_hashes", {})
+    path = os.path.join(ldraw_path, "p", "stud.dat")
+    before = file_hash(path)
+    with open(path, "a") as f:
+        f.write("0 changed\n")
+    assert file_hash(path) != before
+    assert list(part_assets.file_hashes) == [path]
@@ -0,0 +1,9 @@
+from lib.renderer.render_options import Format, image_filename_for_format
+
+def test_image_filename_for_format():
+    assert image_filename_for_format("renders/a.png", Format.JPEG) == "renders/a.jpg"
+    assert image_filename_for_format("renders/a.jpeg", Format.JPEG) == "renders/a.jpeg"
+    assert image_filename_for_format("renders/a.JPG", Format.JPEG) == "renders/a.JPG"
+    assert image_filename_for_format("renders/a.jpg", Format.WEBP) == "renders/a.webp"
+    assert image_filename_for_format("renders/a", Format.PNG) == "renders/a.png"
+    assert image_filename_for_format("renders/a.1", Format.PNG) == "renders/a.1.png"
@@ -0,0 +1,39 @@
+import os
+import pytest
+
+bpy = pytest.importorskip("bpy")  # runs under Blender's python, see run.sh
+
+from lib.renderer.renderer import Renderer
+from lib.renderer.render_options import RenderOptions, Engine, Quality
+
+LDRAW_PATH = "./ldraw"
+
+@pytest.fixture(scope="module")
+def renderer():
+    if not os.path.exists(os.path.join(LDRAW_PATH, "parts", "3001.dat")):
+        pytest.skip("needs the LDraw library, see setup.sh")
+    renderer = Renderer(ldraw_path=LDRAW_PATH)
+    yield renderer
+    renderer.close()
+
+# Mask labels need Cycles' object index pass. Other engines fall back to the
+# projected box instead of writing no label at all.
+@pytest.mark.parametrize("engine", [Engine.WORKBENCH, Engine.EEVEE])
+def test_mask_labels_fall_back_to_projected_boxes(renderer, tmp_path, engine):
+    options = RenderOptions(
+        image_filename=str(tmp_path / "3001.png"),
+        label_filename=str(tmp_path / "3001.txt"),
+        mask_labels=True,
+        engine=engine,
+        quality=Quality.DRAFT,
+        width=64,
+        height=64,
+    )
+    renderer.render_part("3001", options).result()
+    renderer.wait()
+
+    with open(options.label_filename) as f:
+        lines = f.read().splitlines()
+    assert len(lines) == 1
+    class_id, x, y, width, height = lines[0].split()
+    assert 0 < float(width) <= 1 and 0 < float(height) <= 1